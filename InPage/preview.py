@@ -0,0 +1,166 @@
+"""
+Preview: clean a few pages at a low DPI and put them before/after on one image (a contact sheet),
+to check the color, tolerance and region settings in seconds instead of a full run.
+
+The pages are the first and last pages of the document and a few random ones (always the same
+for the same document, the seed is fixed). They are copied into a small PDF that goes through
+process_multiple_pdfs, the function the full run uses, so the preview shows exactly what the full run does
+(JPEG compression included). The "before" side is the same pages rendered at the same DPI.
+
+    python preview.py book.pdf --color "#C0C0C0" --tolerance 40
+    python preview.py book.pdf --color 220,40,40 --random 8 --dpi 100 --output sheet.png
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+
+import wmremv2  # Assuming wmremv2.py is in the same directory
+import renderer  # Render backends and DPI settings
+import watermark_detect  # Finds the watermark regions, so only those are cleaned
+
+PREVIEW_DPI = 72  # Enough to judge the settings, and fast
+FIRST_PAGES, LAST_PAGES, RANDOM_PAGES = 1, 1, 4
+SEED = 0
+THUMB_WIDTH = 420  # Width of every page on the sheet, in pixels
+LABEL_HEIGHT = 20
+MARGIN = 10
+
+
+def pick_pages(page_total, first=FIRST_PAGES, last=LAST_PAGES, random_count=RANDOM_PAGES, seed=SEED):
+    """
+    Page numbers (1-based, sorted) to preview: the first and last pages and random_count
+    random pages in between.
+    """
+    pages = set(range(1, min(first, page_total) + 1))
+    pages |= set(range(max(1, page_total - last + 1), page_total + 1))
+    others = [page for page in range(1, page_total + 1) if page not in pages]
+    pages |= set(random.Random(seed).sample(others, min(random_count, len(others))))
+    return sorted(pages)
+
+
+def locate_pages(pdf_paths, pages):
+    """
+    (pdf path, 1-based page number in that PDF) of pages numbered over all the PDFs together
+    (the splits of one document).
+    """
+    located, offset = [], 0
+    for pdf_path in pdf_paths:
+        count = renderer.page_count(pdf_path)
+        located += [(pdf_path, page - offset) for page in pages if offset < page <= offset + count]
+        offset += count
+    return located
+
+
+def sample_pdf(located, path):
+    """
+    Copy the located pages into a new PDF at path, in order.
+    """
+    with fitz.open() as sample:
+        for pdf_path, page_num in located:
+            with fitz.open(pdf_path) as doc:
+                sample.insert_pdf(doc, from_page=page_num - 1, to_page=page_num - 1)
+        sample.save(path)
+
+
+def contact_sheet(rows, output_path, thumb_width=THUMB_WIDTH):
+    """
+    One image with a row per page: label, page before and after (None when the page is not in
+    the output). rows are (label, before image, after image).
+    """
+    def thumb(image):
+        height = round(image.height * thumb_width / image.width)
+        return image.convert("RGB").resize((thumb_width, height), Image.LANCZOS)
+
+    thumbs = [(label, thumb(before), thumb(after) if after is not None else None) for label, before, after in rows]
+    row_heights = [LABEL_HEIGHT + before.height + MARGIN for _, before, _ in thumbs]
+    sheet = Image.new("RGB", (2 * thumb_width + 3 * MARGIN, LABEL_HEIGHT + sum(row_heights) + MARGIN), "white")
+    draw = ImageDraw.Draw(sheet)
+    draw.text((MARGIN, 4), "before", fill="black")
+    draw.text((2 * MARGIN + thumb_width, 4), "after", fill="black")
+
+    y = LABEL_HEIGHT
+    for (label, before, after), row_height in zip(thumbs, row_heights):
+        draw.text((MARGIN, y + 4), label, fill="black")
+        sheet.paste(before, (MARGIN, y + LABEL_HEIGHT))
+        if after is not None:
+            sheet.paste(after, (2 * MARGIN + thumb_width, y + LABEL_HEIGHT))
+        else:
+            draw.text((2 * MARGIN + thumb_width, y + LABEL_HEIGHT + 4), "not in the output", fill="red")
+        y += row_height
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    sheet.save(output_path)
+    return sheet
+
+
+def parse_color(color_input):
+    """
+    Parse a color typed by the user, either HEX (#RRGGBB) or RGB (R,G,B), like the UI does.
+    """
+    color_input = color_input.strip()
+    if color_input.startswith('#'):
+        return wmremv2.hex_to_rgb(color_input)
+    return tuple(map(int, color_input.split(',')))
+
+
+def preview(pdf_paths, output_path, target_color=(0, 0, 0), tolerance=50, dpi=PREVIEW_DPI, grayscale=False, boxes=None, first=FIRST_PAGES, last=LAST_PAGES, random_count=RANDOM_PAGES, seed=SEED):
+    """
+    Clean a sample of the pages of pdf_paths (the splits of one document) with
+    process_multiple_pdfs and write the before/after contact sheet to output_path.
+    Returns the page numbers shown.
+    """
+    started = time.perf_counter()
+    page_total = sum(renderer.page_count(pdf_path) for pdf_path in pdf_paths)
+    pages = pick_pages(page_total, first, last, random_count, seed)
+    located = locate_pages(pdf_paths, pages)
+
+    work_dir = tempfile.mkdtemp(prefix="wmrem-preview-")
+    try:
+        sample_path = os.path.join(work_dir, "sample.pdf")
+        sample_pdf(located, sample_path)
+        output_folder = os.path.join(work_dir, "output_images")
+        wmremv2.process_multiple_pdfs([sample_path], output_folder, target_color, tolerance, grayscale, dpi=dpi, boxes=boxes)
+
+        before = renderer.render_pages(sample_path, dpi, grayscale=grayscale)
+        rows = []
+        for index, page in enumerate(pages):
+            with Image.open(os.path.join(output_folder, f"page_{index + 1}.jpg")) as after:
+                rows.append((f"page {page}", before[index], after.copy()))
+        contact_sheet(rows, output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    logging.info(f"Preview of pages {pages} written to {output_path} in {time.perf_counter() - started:.1f}s")
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean a few pages at a low DPI and write a before/after contact sheet.")
+    parser.add_argument("inputs", nargs="+", help="the PDF (or its splits, in order)")
+    parser.add_argument("--output", default="preview.png", help="contact sheet image")
+    parser.add_argument("--color", default="#000000", help="watermark color, HEX or R,G,B")
+    parser.add_argument("--tolerance", type=int, default=50)
+    parser.add_argument("--dpi", type=renderer.parse_dpi, default=PREVIEW_DPI, help='a number, or "auto" for the resolution of the scans')
+    parser.add_argument("--grayscale", action="store_true", help="render, clean and save pages in grayscale")
+    parser.add_argument("--detect-region", action="store_true", help="clean only where the watermark is (auto-detect)")
+    parser.add_argument("--first", type=int, default=FIRST_PAGES, help="first pages to show")
+    parser.add_argument("--last", type=int, default=LAST_PAGES, help="last pages to show")
+    parser.add_argument("--random", type=int, default=RANDOM_PAGES, help="random pages to show")
+    parser.add_argument("--seed", type=int, default=SEED, help="another seed shows other random pages")
+    args = parser.parse_args()
+
+    target_color = parse_color(args.color)
+    boxes = watermark_detect.detect_watermark_boxes(args.inputs, target_color, args.tolerance) if args.detect_region else None
+    pages = preview(args.inputs, args.output, target_color, args.tolerance, args.dpi, args.grayscale, boxes,
+                    args.first, args.last, args.random, args.seed)
+    print(f"Pages {', '.join(map(str, pages))}: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Profiling mode: records a span for every page and every stage and writes them as a Chrome
+trace-event JSON file, open it in https://ui.perfetto.dev or chrome://tracing.
+
+Off unless WMREM_PROFILE is set to the path of the trace file:
+    WMREM_PROFILE=trace.json python main.py
+When several processes write traces (distributed workers), put {pid} in the name: trace-{pid}.json
+With WMREM_PROFILE_CPROFILE=1 every stage is also run under cProfile, the stats are saved
+next to the trace as trace.json.<stage>.prof (open them with pstats or snakeviz).
+"""
+import atexit
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_FILE = os.environ.get("WMREM_PROFILE")
+CPROFILE = os.environ.get("WMREM_PROFILE_CPROFILE") == "1"
+
+_lock = threading.Lock()
+_events = []
+_profiles = {}  # stage name -> cProfile.Profile
+_local = threading.local()  # current page label and "a cProfile is running" flag, per thread
+
+
+def enabled():
+    return TRACE_FILE is not None
+
+
+def _now_us():
+    return time.perf_counter_ns() // 1000
+
+
+@contextmanager
+def span(name, cprofile=True, **args):
+    """
+    Record a block of code as one span on the timeline of the current thread.
+    The page set with page() is added to the span arguments.
+    With cprofile=False the span is never run under cProfile (for spans that contain stages).
+    """
+    if not enabled():
+        yield
+        return
+
+    current_page = getattr(_local, "page", None)
+    if current_page is not None:
+        args.setdefault("page", current_page)
+
+    # Only one cProfile can run per thread, nested spans are not profiled separately
+    profile = None
+    if CPROFILE and cprofile and not getattr(_local, "profiling", False):
+        with _lock:
+            profile = _profiles.setdefault(name, cProfile.Profile())
+        try:
+            profile.enable()
+            _local.profiling = True
+        except ValueError:
+            profile = None  # Another thread is being profiled (Python 3.12+ allows only one profiler)
+
+    started = _now_us()
+    try:
+        yield
+    finally:
+        ended = _now_us()
+        if profile is not None:
+            profile.disable()
+            _local.profiling = False
+        with _lock:
+            _events.append({
+                "name": name,
+                "cat": "stage",
+                "ph": "X",
+                "ts": started,
+                "dur": ended - started,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            })
+
+
+@contextmanager
+def page(label):
+    """
+    Mark the pages being worked on: everything inside gets the page label, and the page
+    itself shows up as a span around its stages.
+    """
+    if not enabled():
+        yield
+        return
+
+    previous = getattr(_local, "page", None)
+    _local.page = label
+    try:
+        with span("page", cprofile=False):
+            yield
+    finally:
+        _local.page = previous
+
+
+def save(path=None):
+    """
+    Write the trace (and the cProfile stats) collected so far. Called at exit too.
+    """
+    path = path or TRACE_FILE
+    if not path:
+        return
+    path = path.replace("{pid}", str(os.getpid()))
+
+    with _lock:
+        events = list(_events)
+        profiles = dict(_profiles)
+
+    # Name the process and threads so the timeline is readable
+    metadata = [{"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": f"wm-remove-pdf ({os.getpid()})"}}]
+    for tid in {event["tid"] for event in events}:
+        thread_name = next((t.name for t in threading.enumerate() if t.ident == tid), f"thread {tid}")
+        metadata.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": thread_name}})
+
+    with open(path, "w", encoding="utf-8") as trace_file:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, trace_file)
+
+    for stage_name, profile in profiles.items():
+        profile.dump_stats(f"{path}.{stage_name}.prof")
+
+
+atexit.register(save)
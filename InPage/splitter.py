@@ -1,99 +1,254 @@
-import tkinter as tk
-from tkinter import filedialog, ttk, messagebox
-import PyPDF2
-import os
-
-class PdfSplitterApp:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("PDF Splitter")
-        self.root.geometry("400x200")
-
-        # Create UI elements
-        self.create_widgets()
-
-    def create_widgets(self):
-        # Choose PDF Button
-        self.choose_button = tk.Button(self.root, text="Choose PDF File", command=self.choose_file)
-        self.choose_button.pack(pady=10)
-
-        # Label to show the selected file
-        self.file_label = tk.Label(self.root, text="No file selected")
-        self.file_label.pack(pady=5)
-
-        # Progress bar
-        self.progress = ttk.Progressbar(self.root, orient="horizontal", length=300, mode="determinate")
-        self.progress.pack(pady=10)
-
-    def choose_file(self):
-        # Open file dialog to select a PDF
-        file_name = filedialog.askopenfilename(title="Open PDF File", filetypes=[("PDF Files", "*.pdf")])
-
-        if file_name:
-            self.file_label.config(text=f"Selected file: {os.path.basename(file_name)}")
-            self.split_pdf(file_name)
-
-    def split_pdf(self, input_pdf, pages_per_split=20):
-        try:
-            # Ensure the "temp_cut" folder exists
-            temp_cut_folder = "temp_cut"
-            os.makedirs(temp_cut_folder, exist_ok=True)
-
-            # Open the input PDF file
-            with open(input_pdf, "rb") as file:
-                reader = PyPDF2.PdfReader(file)
-                total_pages = len(reader.pages)
-
-                # Determine how many split files are needed
-                num_splits = total_pages // pages_per_split + (1 if total_pages % pages_per_split != 0 else 0)
-
-                # Set progress bar maximum
-                self.progress["maximum"] = num_splits
-
-                # Initialize a list to keep track of the output filenames
-                output_filenames = []
-
-                # Process each split
-                for split_num in range(num_splits):
-                    writer = PyPDF2.PdfWriter()
-
-                    # Determine the start and end page for this split
-                    start_page = split_num * pages_per_split
-                    end_page = min(start_page + pages_per_split, total_pages)
-
-                    # Add pages to the writer
-                    for page_num in range(start_page, end_page):
-                        writer.add_page(reader.pages[page_num])
-
-                    # Name the output PDF file with "input" followed by the part number
-                    output_pdf = f"{temp_cut_folder}/input{split_num + 1}.pdf"
-                    output_filenames.append(f"'{output_pdf}'")
-
-                    # Write the output PDF to a file in the "temp_cut" folder
-                    with open(output_pdf, "wb") as output_file:
-                        writer.write(output_file)
-
-                    print(f"Created: {output_pdf}")
-
-                    # Update progress bar
-                    self.progress["value"] = split_num + 1
-                    self.root.update_idletasks()
-
-                # Save the list of output filenames in the required format to a text file
-                with open("output.txt", "w", encoding="utf-8") as txt_file:
-                    txt_file.write(f"[{', '.join(output_filenames)}]")
-                print(f"Output filenames saved to output.txt")
-
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {e}")
-        finally:
-            # Close the app after completion
-            self.root.destroy()
-
-def run():
-    root = tk.Tk()
-    app = PdfSplitterApp(root)
-    root.mainloop()
-
-if __name__ == "__main__":
+import math
+import time
+import tkinter as tk
+from tkinter import filedialog, ttk, messagebox
+import fitz  # PyMuPDF
+import PyPDF2
+import os
+import metrics
+
+# Limits for the automatic chunk size
+MIN_PAGES_PER_SPLIT = 4
+MAX_PAGES_PER_SPLIT = 50
+SPLITS_PER_WORKER = 4  # More splits than workers so a slow split doesn't hold up the rest
+HEAVY_PAGE_BYTES = 256 * 1024  # Content stream + image bytes of a page we consider "heavy"
+
+
+def estimate_page_complexity(doc, sample_size=10):
+    """
+    Estimate how heavy the pages of a document are.
+    Samples a few pages spread over the document and returns the average number of
+    content stream + image bytes per page.
+    """
+    total_pages = len(doc)
+    if total_pages == 0:
+        return 0
+
+    step = max(1, total_pages // sample_size)
+    sampled = range(0, total_pages, step)
+
+    total_bytes = 0
+    for page_num in sampled:
+        page = doc[page_num]
+        total_bytes += len(page.read_contents())
+        for image in page.get_images(full=True):
+            try:
+                total_bytes += len(doc.xref_stream_raw(image[0]))
+            except Exception:
+                pass  # Broken image streams don't matter for an estimate
+
+    return total_bytes / len(sampled)
+
+
+def choose_pages_per_split(total_pages, page_complexity=0, workers=None):
+    """
+    Pick how many pages go in each split.
+    Aims for a few splits per available worker so the work balances out, and makes the
+    splits smaller when pages are heavy (big scans, lots of vector content).
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    pages_per_split = math.ceil(total_pages / (workers * SPLITS_PER_WORKER))
+
+    # Heavy pages take longer to render, so halve the chunk for every "heavy page" step
+    heaviness = page_complexity / HEAVY_PAGE_BYTES
+    if heaviness > 1:
+        pages_per_split = math.ceil(pages_per_split / heaviness)
+
+    return max(MIN_PAGES_PER_SPLIT, min(MAX_PAGES_PER_SPLIT, pages_per_split))
+
+
+def split_pdf_file(input_pdf, temp_cut_folder="temp_cut", pages_per_split=None, workers=None, progress_callback=None):
+    """
+    Split a PDF into smaller PDFs using PyMuPDF, without any UI.
+    Every split only keeps the objects its own pages use (garbage collection on save),
+    so shared fonts and images don't blow up the size of "temp_cut".
+    Returns the list of split files and the timing of every split.
+    """
+    os.makedirs(temp_cut_folder, exist_ok=True)
+
+    src = fitz.open(input_pdf)
+    total_pages = len(src)
+
+    if pages_per_split is None:
+        pages_per_split = choose_pages_per_split(total_pages, estimate_page_complexity(src), workers)
+
+    # Determine how many split files are needed
+    num_splits = math.ceil(total_pages / pages_per_split)
+
+    output_files = []
+    timings = []  # One entry per split: pages, seconds and size on disk
+
+    for split_num in range(num_splits):
+        started = time.perf_counter()
+
+        # Determine the start and end page for this split
+        start_page = split_num * pages_per_split
+        end_page = min(start_page + pages_per_split, total_pages)
+
+        # Copy the page range into a fresh document
+        part = fitz.open()
+        part.insert_pdf(src, from_page=start_page, to_page=end_page - 1)
+
+        # Name the output PDF file with "input" followed by the part number
+        output_pdf = f"{temp_cut_folder}/input{split_num + 1}.pdf"
+        part.save(output_pdf, garbage=3, deflate=True)
+        part.close()
+
+        output_files.append(output_pdf)
+        timings.append({
+            "split": split_num + 1,
+            "pages": end_page - start_page,
+            "seconds": time.perf_counter() - started,
+            "bytes": os.path.getsize(output_pdf),
+        })
+        print(f"Created: {output_pdf} ({timings[-1]['seconds']:.2f}s)")
+
+        if progress_callback:
+            progress_callback(split_num + 1, num_splits)
+
+    src.close()
+    record_split_metrics(input_pdf, timings)
+    return output_files, timings
+
+
+def split_pdf_file_pypdf2(input_pdf, temp_cut_folder="temp_cut", pages_per_split=20, progress_callback=None):
+    """
+    Old PyPDF2 splitter, kept for PDFs that PyMuPDF can't open.
+    Returns the same (files, timings) pair as split_pdf_file.
+    """
+    os.makedirs(temp_cut_folder, exist_ok=True)
+
+    output_files = []
+    timings = []
+
+    with open(input_pdf, "rb") as file:
+        reader = PyPDF2.PdfReader(file)
+        total_pages = len(reader.pages)
+
+        # Determine how many split files are needed
+        num_splits = math.ceil(total_pages / pages_per_split)
+
+        for split_num in range(num_splits):
+            started = time.perf_counter()
+            writer = PyPDF2.PdfWriter()
+
+            # Determine the start and end page for this split
+            start_page = split_num * pages_per_split
+            end_page = min(start_page + pages_per_split, total_pages)
+
+            # Add pages to the writer
+            for page_num in range(start_page, end_page):
+                writer.add_page(reader.pages[page_num])
+
+            # Write the output PDF to a file in the "temp_cut" folder
+            output_pdf = f"{temp_cut_folder}/input{split_num + 1}.pdf"
+            with open(output_pdf, "wb") as output_file:
+                writer.write(output_file)
+
+            output_files.append(output_pdf)
+            timings.append({
+                "split": split_num + 1,
+                "pages": end_page - start_page,
+                "seconds": time.perf_counter() - started,
+                "bytes": os.path.getsize(output_pdf),
+            })
+            print(f"Created: {output_pdf}")
+
+            if progress_callback:
+                progress_callback(split_num + 1, num_splits)
+
+    record_split_metrics(input_pdf, timings)
+    return output_files, timings
+
+
+def record_split_metrics(input_pdf, timings):
+    metrics.record(
+        "split",
+        sum(t["seconds"] for t in timings),
+        pages=sum(t["pages"] for t in timings),
+        bytes_in=os.path.getsize(input_pdf),
+        bytes_out=sum(t["bytes"] for t in timings),
+    )
+
+
+def write_pdf_list(output_files, list_file="output.txt"):
+    """
+    Save the list of split files in the format the cleaners read (['input1.pdf', ...]).
+    """
+    with open(list_file, "w", encoding="utf-8") as txt_file:
+        txt_file.write(f"[{', '.join(repr(f) for f in output_files)}]")
+    print(f"Output filenames saved to {list_file}")
+
+
+class PdfSplitterApp:
+    def __init__(self, root, temp_cut_folder="temp_cut", list_file="output.txt"):
+        self.root = root
+        self.root.title("PDF Splitter")
+        self.root.geometry("400x200")
+
+        # Where the splits and their list go (the job's workspace when main.py runs it)
+        self.temp_cut_folder = temp_cut_folder
+        self.list_file = list_file
+
+        # Timing of every split, filled in by split_pdf
+        self.split_timings = []
+
+        # Create UI elements
+        self.create_widgets()
+
+    def create_widgets(self):
+        # Choose PDF Button
+        self.choose_button = tk.Button(self.root, text="Choose PDF File", command=self.choose_file)
+        self.choose_button.pack(pady=10)
+
+        # Label to show the selected file
+        self.file_label = tk.Label(self.root, text="No file selected")
+        self.file_label.pack(pady=5)
+
+        # Progress bar
+        self.progress = ttk.Progressbar(self.root, orient="horizontal", length=300, mode="determinate")
+        self.progress.pack(pady=10)
+
+    def choose_file(self):
+        # Open file dialog to select a PDF
+        file_name = filedialog.askopenfilename(title="Open PDF File", filetypes=[("PDF Files", "*.pdf")])
+
+        if file_name:
+            self.file_label.config(text=f"Selected file: {os.path.basename(file_name)}")
+            self.split_pdf(file_name)
+
+    def split_pdf(self, input_pdf, pages_per_split=None):
+        try:
+            def update_progress(done, total):
+                # Update progress bar
+                self.progress["maximum"] = total
+                self.progress["value"] = done
+                self.root.update_idletasks()
+
+            try:
+                output_files, self.split_timings = split_pdf_file(input_pdf, self.temp_cut_folder, pages_per_split, progress_callback=update_progress)
+            except (fitz.FileDataError, RuntimeError) as e:
+                print(f"PyMuPDF could not split the file ({e}), falling back to PyPDF2...")
+                output_files, self.split_timings = split_pdf_file_pypdf2(input_pdf, self.temp_cut_folder, pages_per_split or 20, progress_callback=update_progress)
+
+            total_seconds = sum(t["seconds"] for t in self.split_timings)
+            print(f"Split into {len(output_files)} files in {total_seconds:.2f}s")
+
+            # Save the list of output filenames in the required format to a text file
+            write_pdf_list(output_files, self.list_file)
+
+        except Exception as e:
+            messagebox.showerror("Error", f"An error occurred: {e}")
+        finally:
+            # Close the app after completion
+            self.root.destroy()
+
+def run(temp_cut_folder="temp_cut", list_file="output.txt"):
+    root = tk.Tk()
+    app = PdfSplitterApp(root, temp_cut_folder, list_file)
+    root.mainloop()
+
+if __name__ == "__main__":
     run()
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""
+Find where the watermark is, so the color replacement only runs there.
+
+A watermark is at the same place on every page, body text of the same color is not. A few
+pages are rendered at a low DPI, every pixel gets the share of the pages where it has the
+watermark color (its persistence), and the boxes around the persistent pixels are the
+watermark regions.
+
+Boxes are fractions of the page size (x0, y0, x1, y1 between 0 and 1), so they work at any DPI.
+"""
+import logging
+
+import numpy as np
+from PIL import Image
+from scipy.ndimage import binary_dilation, find_objects, label
+
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import renderer  # Render backends (PyMuPDF / poppler)
+import kernels  # Mask and fill kernels: NumPy, numexpr or Numba
+
+SAMPLE_PAGES = 12  # Pages rendered for the detection, spread over the document
+DETECT_DPI = 72  # Low resolution is enough to find the watermark, lower and thin lines blur away
+MIN_PERSISTENCE = 0.6  # A pixel must have the color on this share of the sampled pages
+MARGIN = 0.01  # Added around every box, in fractions of the page
+MIN_SAMPLES = 3  # With fewer pages, text can't be told from the watermark
+
+
+def sample_pages(pdf_paths, count=SAMPLE_PAGES):
+    """
+    (pdf path, 1-based page number) of count pages spread evenly over all the PDFs.
+    """
+    pages = [(pdf_path, page_num) for pdf_path in pdf_paths for page_num in range(1, renderer.page_count(pdf_path) + 1)]
+    if len(pages) <= count:
+        return pages
+    step = len(pages) / count
+    return [pages[int(i * step)] for i in range(count)]
+
+
+def color_mask(data, target_color, tolerance):
+    """
+    Pixels of an RGB array within tolerance of the target color on every channel.
+    """
+    lower = [max(0, c - tolerance) for c in target_color]
+    upper = [min(255, c + tolerance) for c in target_color]
+    return kernels.get_backend().mask(data, lower, upper)
+
+
+def persistence_map(pdf_paths, target_color, tolerance, samples=SAMPLE_PAGES, dpi=DETECT_DPI):
+    """
+    For every pixel (on the grid of the first sampled page), the share of the sampled pages
+    where it has the target color. None when there are too few pages.
+    """
+    pages = sample_pages(pdf_paths, samples)
+    if len(pages) < MIN_SAMPLES:
+        return None
+
+    counts, size = None, None
+    for pdf_path, page_num in pages:
+        image = renderer.render_pages(pdf_path, dpi, page_num, page_num)[0].convert("RGB")
+        if size is None:
+            size = image.size
+            counts = np.zeros((size[1], size[0]), dtype=np.uint16)
+        elif image.size != size:
+            image = image.resize(size, Image.BILINEAR)  # Pages of another size are compared relative to the page
+        counts += color_mask(np.asarray(image), target_color, tolerance)
+    return counts / len(pages)
+
+
+def merge_boxes(boxes):
+    """
+    Merge the boxes that overlap (or touch), until none do. The letters of a watermark and the
+    frame around them become one box.
+    """
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]:
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+def detect_watermark_boxes(pdf_paths, target_color, tolerance=50, samples=SAMPLE_PAGES, dpi=DETECT_DPI, min_persistence=MIN_PERSISTENCE, margin=MARGIN):
+    """
+    Boxes (fractions of the page) around the watermark, from a few pages of the PDFs.
+    Returns None when no watermark could be found, the whole page has to be cleaned then.
+    """
+    with metrics.stage("detect") as measurement:
+        persistence = persistence_map(pdf_paths, target_color, tolerance, samples, dpi)
+        if persistence is None:
+            logging.info("Too few pages to detect the watermark region, cleaning whole pages.")
+            return None
+        measurement["pages"] = min(samples, len(sample_pages(pdf_paths, samples)))
+
+        # Close the small gaps between letters, so a watermark is one box and not one per letter
+        persistent = binary_dilation(persistence >= min_persistence, iterations=2)
+        labels, count = label(persistent)
+        if count == 0:
+            logging.info("No watermark region found, cleaning whole pages.")
+            return None
+
+        height, width = persistence.shape
+        boxes = []
+        for rows, cols in find_objects(labels):
+            if (rows.stop - rows.start) * (cols.stop - cols.start) < 4:
+                continue  # A couple of pixels, noise
+            boxes.append((
+                max(0.0, cols.start / width - margin),
+                max(0.0, rows.start / height - margin),
+                min(1.0, cols.stop / width + margin),
+                min(1.0, rows.stop / height + margin),
+            ))
+
+    if not boxes:
+        return None
+    boxes = merge_boxes(boxes)
+    area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in boxes)
+    logging.info(f"Watermark found in {len(boxes)} region(s), {area:.0%} of the page.")
+    return boxes
+
+
+def boxes_to_pixels(boxes, width, height):
+    """
+    Boxes in pixels (x0, y0, x1, y1) for an image of width x height.
+    """
+    return [(int(x0 * width), int(y0 * height), int(np.ceil(x1 * width)), int(np.ceil(y1 * height))) for x0, y0, x1, y1 in boxes]
+
+
+def box_slices(boxes, width, height):
+    """
+    NumPy slices (rows, columns) of the boxes for an image of width x height, one slice over
+    the whole image when boxes is None.
+    """
+    if boxes is None:
+        return [(slice(None), slice(None))]
+    return [(slice(y0, y1), slice(x0, x1)) for x0, y0, x1, y1 in boxes_to_pixels(boxes, width, height)]
@@ -1,186 +1,388 @@
-import logging
-import os
-from pdf2image import convert_from_path
-from PIL import Image
-import numpy as np
-from tqdm import tqdm
-from datetime import datetime
-import ast
-import tkinter as tk
-from tkinter import simpledialog
-from tkinter import messagebox
-
-
-# Configure the logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-
-def hex_to_rgb(hex_color):
-    """
-    Convert HEX color code (e.g., #RRGGBB) to RGB tuple (R, G, B).
-    """
-    if hex_color.startswith('#'):
-        hex_color = hex_color[1:]
-    
-    if len(hex_color) == 6:
-        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-    else:
-        raise ValueError(f"Invalid HEX color code: {hex_color}")
-
-
-def replace_color(image, target_color, tolerance=50):
-    """
-    Replace a specific color in the image with white, given a tolerance range.
-    """
-    logging.info("Starting color replacement process.")
-    img = image.convert("RGBA")
-    data = np.array(img)
-    
-    lower_bound = np.array([max(0, c - tolerance) for c in target_color])
-    upper_bound = np.array([min(255, c + tolerance) for c in target_color])
-    
-    mask = np.all(np.logical_and(data[..., :3] >= lower_bound, data[..., :3] <= upper_bound), axis=-1)
-    data[mask] = [255, 255, 255, 255]  # White
-    image_with_replacement = Image.fromarray(data)
-    
-    logging.info(f"Color replacement completed for image with target color {target_color}.")
-    return image_with_replacement
-
-
-def convert_pdf_to_jpg(input_pdf_path):
-    """
-    Convert a PDF to JPG images with a progress bar.
-    """
-    images = convert_from_path(input_pdf_path, dpi=300)
-    for i in tqdm(range(len(images)), desc="Converting PDF to Images", unit="page"):
-        logging.info(f"Page {i + 1} converted to image.")
-    return images
-
-
-def save_image(image, output_folder, image_counter):
-    """
-    Save the processed image as a JPG file.
-    """
-    image_rgb = image.convert("RGB")  # Convert RGBA to RGB (removes alpha channel)
-    output_image_path = os.path.join(output_folder, f"page_{image_counter}.jpg")
-    image_rgb.save(output_image_path, "JPEG")
-    logging.info(f"Processed image {image_counter} saved to {output_image_path}")
-
-
-def process_pdf(input_pdf_path, output_folder, target_color=(0, 0, 0), tolerance=50):
-    """
-    Full process: Convert PDF to JPGs, replace color, and save the images in the output folder.
-    """
-    images = convert_pdf_to_jpg(input_pdf_path)
-    image_counter = 1  # Start from image 1
-    for image in tqdm(images, desc="Processing Pages", unit="page"):
-        image_with_replaced_color = replace_color(image, target_color, tolerance)
-        save_image(image_with_replaced_color, output_folder, image_counter)
-        image_counter += 1
-
-
-def process_multiple_pdfs(input_pdf_paths, output_folder, target_color=(0, 0, 0), tolerance=50):
-    """
-    Process multiple PDF files and save the output images in the specified output folder.
-    """
-    # Ensure the output folder exists
-    os.makedirs(output_folder, exist_ok=True)
-    
-    image_counter = 1  # Counter to keep track of image names across all PDFs
-    for input_pdf_path in input_pdf_paths:
-        images = convert_pdf_to_jpg(input_pdf_path)
-        for image in images:
-            image_with_replacement = replace_color(image, target_color, tolerance)
-            save_image(image_with_replacement, output_folder, image_counter)
-            image_counter += 1
-
-
-def read_pdf_list_from_txt(file_path):
-    """
-    Read a list of PDFs from a .txt file (with the format ['input1.pdf', 'input2.pdf', ...]).
-    """
-    with open(file_path, 'r') as file:
-        pdf_list_str = file.read().strip()
-    try:
-        pdf_list = ast.literal_eval(pdf_list_str)
-        if not isinstance(pdf_list, list):
-            raise ValueError("The file content is not a valid list.")
-    except (SyntaxError, ValueError) as e:
-        logging.error(f"Error reading the list from the file: {e}")
-        pdf_list = []
-    return pdf_list
-
-
-def open_ui():
-    """
-    Open a simple Tkinter UI to allow the user to set target color and tolerance.
-    """
-    def on_start_button_click():
-        # Set default values for PDF list and output folder
-        input_pdfs = read_pdf_list_from_txt("output.txt")  # Default PDF list file
-        output_folder = "output_images"  # Default output folder
-        
-        # Get the color input
-        color_input = color_entry.get().strip()
-        
-        try:
-            # If the input starts with "#" it's HEX, otherwise it's assumed to be RGB
-            if color_input.startswith('#'):
-                target_color = hex_to_rgb(color_input)
-            else:
-                # Default to RGB input format
-                target_color = tuple(map(int, color_input.split(',')))
-        except ValueError as e:
-            messagebox.showerror("Error", f"Invalid color input: {e}")
-            return
-        
-        # Get the tolerance value
-        try:
-            tolerance = int(tolerance_entry.get())
-        except ValueError:
-            messagebox.showerror("Error", "Invalid tolerance value.")
-            return
-        
-        if input_pdfs:
-            logging.info("Starting PDF processing for multiple files...")
-            process_multiple_pdfs(input_pdfs, output_folder, target_color, tolerance)
-            window.quit()  # Quit the application after completion
-        else:
-            messagebox.showerror("Error", "No valid PDF files found to process.")
-    
-    window = tk.Tk()
-    window.title("Watermark remover tool")
-    
-    # Set window size to make it larger
-    window.geometry("500x400")  # Width x Height
-
-    # Color input instructions
-    tk.Label(window, text="Enter Watermark Color (HEX or RGB):", font=("Arial", 12)).pack(pady=10)
-    
-    # Entry field for color (either HEX or RGB)
-    color_entry = tk.Entry(window, width=20, font=("Arial", 14))
-    color_entry.insert(0, "#000000")  # Default HEX value (black)
-    color_entry.pack(pady=5)
-
-    # Input for the tolerance
-    tk.Label(window, text="Tolerance:", font=("Arial", 12)).pack(pady=10)
-    tolerance_entry = tk.Entry(window, width=10, font=("Arial", 14))
-    tolerance_entry.insert(0, "50")
-    tolerance_entry.pack(pady=10)
-
-    # Start button
-    start_button = tk.Button(window, text="Start Processing", font=("Arial", 14), command=on_start_button_click)
-    start_button.pack(pady=20)
-
-    # User shouldn't close instruction
-    tk.Label(window, text="This window might look freezed,it's normal", font=("Arial", 12)).pack(pady=10)
-    tk.Label(window, text="DON'T CLOSE IT,it will close itself", font=("Arial", 12)).pack(pady=10)
-
-
-    window.mainloop()
-
-def run():
-    open_ui()
-
-if __name__ == "__main__":
+import logging
+import os
+import renderer  # Render backends (PyMuPDF / poppler)
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import profiler  # Per-page trace timeline when WMREM_PROFILE is set
+import watermark_detect  # Finds the watermark regions, so only those are cleaned
+import kernels  # Mask and fill kernels: NumPy, numexpr or Numba
+import color_detect  # Guesses the watermark color from a few pages
+from PIL import Image
+import numpy as np
+from tqdm import tqdm
+from datetime import datetime
+import ast
+import queue
+import threading
+import tkinter as tk
+from tkinter import simpledialog
+from tkinter import messagebox
+from tkinter import ttk  # Import ttk for the progress bar
+
+
+# Configure the logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DPI = 300  # Render resolution, and the resolution of pages without a scan in native resolution mode
+
+
+def hex_to_rgb(hex_color):
+    """
+    Convert HEX color code (e.g., #RRGGBB) to RGB tuple (R, G, B).
+    """
+    if hex_color.startswith('#'):
+        hex_color = hex_color[1:]
+    
+    if len(hex_color) == 6:
+        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    else:
+        raise ValueError(f"Invalid HEX color code: {hex_color}")
+
+
+def to_gray(color):
+    """
+    Convert an RGB color to its gray level, with the same weights PIL uses for "L" images.
+    """
+    r, g, b = color
+    return (r * 299 + g * 587 + b * 114) // 1000
+
+
+def replace_color(image, target_color, tolerance=50, boxes=None):
+    """
+    Replace a specific color in the image with white, given a tolerance range.
+    Grayscale ("L") images stay grayscale, the mask is computed on the single channel.
+    With boxes (fractions of the page, see watermark_detect) only the inside of the boxes is cleaned.
+    """
+    logging.info("Starting color replacement process.")
+    slices = watermark_detect.box_slices(boxes, image.width, image.height)
+    backend = kernels.get_backend()  # NumPy, numexpr or Numba, whichever is fastest here
+    if image.mode == "L":
+        data = np.array(image)
+        areas = [data[rows, cols] for rows, cols in slices]
+        target = to_gray(target_color)
+        with metrics.stage("mask", pages=1, bytes_in=sum(area.nbytes for area in areas)):
+            masks = [backend.mask(area, max(0, target - tolerance), min(255, target + tolerance)) for area in areas]
+        with metrics.stage("fill", pages=1):
+            for area, mask in zip(areas, masks):
+                backend.fill(area, mask, 255)  # White
+        logging.info(f"Color replacement completed for grayscale image with target gray level {target}.")
+        return Image.fromarray(data)
+
+    img = image.convert("RGBA")
+    data = np.array(img)
+    areas = [data[rows, cols] for rows, cols in slices]  # Views, not copies
+    
+    lower_bound = [max(0, c - tolerance) for c in target_color]
+    upper_bound = [min(255, c + tolerance) for c in target_color]
+    
+    with metrics.stage("mask", pages=1, bytes_in=sum(area.nbytes for area in areas)):
+        masks = [backend.mask(area, lower_bound, upper_bound) for area in areas]  # RGB channels, not alpha
+    with metrics.stage("fill", pages=1):
+        for area, mask in zip(areas, masks):
+            backend.fill(area, mask, (255, 255, 255, 255))  # White
+    image_with_replacement = Image.fromarray(data)
+    
+    logging.info(f"Color replacement completed for image with target color {target_color}.")
+    return image_with_replacement
+
+
+def convert_pdf_to_jpg(input_pdf_path, grayscale=False, dpi=DPI):
+    """
+    Convert a PDF to images.
+    dpi can be "auto:<DPI>" to render every page at the resolution of its scan (see renderer.parse_dpi).
+    """
+    images = renderer.render_pages(input_pdf_path, dpi=dpi, grayscale=grayscale)
+    logging.info(f"{len(images)} pages of {input_pdf_path} converted to images.")
+    return images
+
+
+def save_image(image, output_folder, image_counter):
+    """
+    Save the processed image as a JPG file.
+    """
+    if image.mode != "L":
+        image = image.convert("RGB")  # Convert RGBA to RGB (removes alpha channel), grayscale stays grayscale
+    output_image_path = os.path.join(output_folder, f"page_{image_counter}.jpg")
+    with metrics.stage("encode", pages=1, bytes_in=metrics.image_bytes(image)) as measurement:
+        image.save(output_image_path, "JPEG")
+        measurement["bytes_out"] = os.path.getsize(output_image_path)
+    logging.info(f"Processed image {image_counter} saved to {output_image_path}")
+
+
+def process_pdf(input_pdf_path, output_folder, target_color=(0, 0, 0), tolerance=50, grayscale=False, dpi=DPI, boxes=None):
+    """
+    Full process: Convert PDF to JPGs, replace color, and save the images in the output folder.
+    """
+    images = convert_pdf_to_jpg(input_pdf_path, grayscale, dpi)
+    image_counter = 1  # Start from image 1
+    for image in tqdm(images, desc="Processing Pages", unit="page"):
+        with profiler.page(f"{os.path.basename(input_pdf_path)}#{image_counter}"):
+            image_with_replaced_color = replace_color(image, target_color, tolerance, boxes)
+            save_image(image_with_replaced_color, output_folder, image_counter)
+        image_counter += 1
+
+
+class Cancelled(Exception):
+    """
+    Raised by process_multiple_pdfs when the user cancelled the job.
+    """
+
+
+def process_multiple_pdfs(input_pdf_paths, output_folder, target_color=(0, 0, 0), tolerance=50, grayscale=False, progress_callback=None, cancel_event=None, dpi=DPI, boxes=None):
+    """
+    Process multiple PDF files and save the output images in the specified output folder.
+    progress_callback(pdfs_done, pdfs_total) is called after every page, when cancel_event is set
+    Cancelled is raised before the next page (the pages saved so far are kept).
+    With boxes (from watermark_detect.detect_watermark_boxes) only those parts of the pages are cleaned.
+    """
+    # Ensure the output folder exists
+    os.makedirs(output_folder, exist_ok=True)
+    
+    image_counter = 1  # Counter to keep track of image names across all PDFs
+    for pdf_index, input_pdf_path in enumerate(input_pdf_paths):
+        images = convert_pdf_to_jpg(input_pdf_path, grayscale, dpi)
+        for page_index, image in enumerate(images):
+            if cancel_event is not None and cancel_event.is_set():
+                raise Cancelled(f"Cancelled at page {page_index + 1} of {input_pdf_path}")
+            with profiler.page(f"{os.path.basename(input_pdf_path)}#{page_index + 1}"):
+                image_with_replacement = replace_color(image, target_color, tolerance, boxes)
+                save_image(image_with_replacement, output_folder, image_counter)
+            if progress_callback:
+                progress_callback(pdf_index + (page_index + 1) / len(images), len(input_pdf_paths))
+            image_counter += 1
+
+
+def read_pdf_list_from_txt(file_path):
+    """
+    Read a list of PDFs from a .txt file (with the format ['input1.pdf', 'input2.pdf', ...]).
+    """
+    with open(file_path, 'r') as file:
+        pdf_list_str = file.read().strip()
+    try:
+        pdf_list = ast.literal_eval(pdf_list_str)
+        if not isinstance(pdf_list, list):
+            raise ValueError("The file content is not a valid list.")
+    except (SyntaxError, ValueError) as e:
+        logging.error(f"Error reading the list from the file: {e}")
+        pdf_list = []
+    return pdf_list
+
+
+def open_ui(list_file="output.txt", output_folder="output_images"):
+    """
+    Open a simple Tkinter UI to allow the user to set target color and tolerance.
+    The PDFs are read from list_file (written by the splitter), the pages go to output_folder.
+    The processing runs in a worker thread, progress and the outcome come back through a queue.
+    Returns "done", "cancelled" or None if the window was closed before starting.
+    """
+    events = queue.Queue()
+    cancel_event = threading.Event()
+    worker = None
+    outcome = {"state": None}
+
+    def run_worker(input_pdfs, output_folder, target_color, tolerance, grayscale, dpi, detect_region):
+        try:
+            boxes = None
+            if detect_region:
+                events.put(("status", "Finding the watermark..."))
+                boxes = watermark_detect.detect_watermark_boxes(input_pdfs, target_color, tolerance)
+                events.put(("status", "Processing..." if boxes else "No watermark region found, cleaning whole pages..."))
+            process_multiple_pdfs(input_pdfs, output_folder, target_color, tolerance, grayscale,
+                                  lambda done, total: events.put(("progress", done / total * 100)), cancel_event, dpi, boxes)
+            events.put(("done", None))
+        except Cancelled as e:
+            logging.info(str(e))
+            events.put(("cancelled", None))
+        except Exception as e:
+            logging.error(f"Processing failed: {e}")
+            events.put(("error", str(e)))
+
+    def poll_events():
+        try:
+            while True:
+                kind, value = events.get_nowait()
+                if kind == "progress":
+                    progress_bar['value'] = value
+                elif kind == "status":
+                    status_label.config(text=value)
+                elif kind in ("done", "cancelled"):
+                    outcome["state"] = kind
+                    window.quit()  # Quit the application after completion
+                    return
+                elif kind == "error":
+                    messagebox.showerror("Error", f"Processing failed: {value}")
+                    start_button.config(state="normal")
+                    cancel_button.config(state="disabled")
+                    return
+        except queue.Empty:
+            pass
+        window.after(100, poll_events)
+
+    def on_cancel_button_click():
+        cancel_event.set()
+        cancel_button.config(state="disabled")
+        status_label.config(text="Cancelling after the current page...")
+
+    def on_close():
+        if worker is not None and worker.is_alive():
+            on_cancel_button_click()  # The window closes once the worker stopped
+        else:
+            window.quit()
+
+    def on_detect_color_click():
+        # Analyze a few pages and put the most likely watermark color and its tolerance in the fields
+        try:
+            input_pdfs = read_pdf_list_from_txt(list_file)
+            if not input_pdfs:
+                messagebox.showerror("Error", "No valid PDF files found to analyze.")
+                return
+            status_label.config(text="Detecting the watermark color...")
+            window.update_idletasks()
+            candidates = color_detect.detect_colors(input_pdfs)
+        except Exception as e:
+            messagebox.showerror("Error", f"Color detection failed: {e}")
+            status_label.config(text="")
+            return
+
+        if candidates:
+            color_entry.delete(0, tk.END)
+            color_entry.insert(0, color_detect.to_hex(candidates[0]["color"]))
+            tolerance_entry.delete(0, tk.END)
+            tolerance_entry.insert(0, str(candidates[0]["tolerance"]))
+        status_label.config(text=color_detect.describe(candidates))
+
+    def on_preview_button_click():
+        # Clean the first, last and a few random pages at a low DPI with the current settings,
+        # and open the before/after contact sheet
+        import preview  # preview.py imports this module
+        try:
+            input_pdfs = read_pdf_list_from_txt(list_file)
+            if not input_pdfs:
+                messagebox.showerror("Error", "No valid PDF files found to preview.")
+                return
+            target_color = preview.parse_color(color_entry.get())
+            tolerance = int(tolerance_entry.get())
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid setting: {e}")
+            return
+
+        status_label.config(text="Making the preview...")
+        window.update_idletasks()
+        sheet_path = os.path.join(os.path.dirname(os.path.abspath(output_folder)), "preview.png")
+        dpi = f"{renderer.AUTO_DPI}:{preview.PREVIEW_DPI}" if native_dpi_var.get() else preview.PREVIEW_DPI
+        try:
+            boxes = None
+            if detect_region_var.get():
+                boxes = watermark_detect.detect_watermark_boxes(input_pdfs, target_color, tolerance)
+            pages = preview.preview(input_pdfs, sheet_path, target_color, tolerance, dpi, grayscale_var.get(), boxes)
+        except Exception as e:
+            messagebox.showerror("Error", f"Preview failed: {e}")
+            status_label.config(text="")
+            return
+        status_label.config(text=f"Preview of pages {', '.join(map(str, pages))}: {sheet_path}")
+        Image.open(sheet_path).show()
+
+    def on_start_button_click():
+        nonlocal worker
+        input_pdfs = read_pdf_list_from_txt(list_file)
+        
+        # Get the color input
+        color_input = color_entry.get().strip()
+        
+        try:
+            # If the input starts with "#" it's HEX, otherwise it's assumed to be RGB
+            if color_input.startswith('#'):
+                target_color = hex_to_rgb(color_input)
+            else:
+                # Default to RGB input format
+                target_color = tuple(map(int, color_input.split(',')))
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid color input: {e}")
+            return
+        
+        # Get the tolerance value
+        try:
+            tolerance = int(tolerance_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Invalid tolerance value.")
+            return
+        
+        if input_pdfs:
+            logging.info("Starting PDF processing for multiple files...")
+            start_button.config(state="disabled")
+            cancel_button.config(state="normal")
+            status_label.config(text="Processing...")
+
+            # Native resolution: scanned pages at the DPI of their scan, the other pages at DPI
+            dpi = f"{renderer.AUTO_DPI}:{DPI}" if native_dpi_var.get() else DPI
+
+            # Run the cleaning in the background so the window stays responsive
+            worker = threading.Thread(target=run_worker, args=(input_pdfs, output_folder, target_color, tolerance, grayscale_var.get(), dpi, detect_region_var.get()), daemon=True)
+            worker.start()
+            window.after(100, poll_events)
+        else:
+            messagebox.showerror("Error", "No valid PDF files found to process.")
+    
+    window = tk.Tk()
+    window.title("Watermark remover tool")
+    
+    # Set window size to make it larger
+    window.geometry("500x610")  # Width x Height
+
+    # Color input instructions
+    tk.Label(window, text="Enter Watermark Color (HEX or RGB):", font=("Arial", 12)).pack(pady=10)
+    
+    # Entry field for color (either HEX or RGB)
+    color_entry = tk.Entry(window, width=20, font=("Arial", 14))
+    color_entry.insert(0, "#000000")  # Default HEX value (black)
+    color_entry.pack(pady=5)
+
+    # Fill in the color and tolerance from a few pages rendered at a low DPI
+    tk.Button(window, text="Detect color", font=("Arial", 10), command=on_detect_color_click).pack(pady=2)
+
+    # Input for the tolerance
+    tk.Label(window, text="Tolerance:", font=("Arial", 12)).pack(pady=10)
+    tolerance_entry = tk.Entry(window, width=10, font=("Arial", 14))
+    tolerance_entry.insert(0, "50")
+    tolerance_entry.pack(pady=10)
+
+    # Grayscale mode, for black & white scans (less memory, smaller output)
+    grayscale_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(window, text="Grayscale mode (for black & white documents)", variable=grayscale_var, font=("Arial", 10)).pack(pady=5)
+
+    # Native resolution, for scans: no upsampling of low resolution scans to 300 DPI
+    native_dpi_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(window, text="Native resolution for scanned pages (auto DPI)", variable=native_dpi_var, font=("Arial", 10)).pack(pady=5)
+
+    # Find where the watermark is first and clean only there (faster, and text of the same color elsewhere is kept)
+    detect_region_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(window, text="Clean only where the watermark is (auto-detect)", variable=detect_region_var, font=("Arial", 10)).pack(pady=5)
+
+    # Progress bar and status of the running job
+    progress_bar = ttk.Progressbar(window, length=400, mode="determinate")
+    progress_bar.pack(pady=10)
+    status_label = tk.Label(window, text="", font=("Arial", 12), wraplength=450)
+    status_label.pack(pady=5)
+
+    # Start button
+    start_button = tk.Button(window, text="Start Processing", font=("Arial", 14), command=on_start_button_click)
+    start_button.pack(pady=20)
+
+    # A few pages cleaned at a low DPI, before/after on one image, to check the settings first
+    tk.Button(window, text="Preview", font=("Arial", 12), command=on_preview_button_click).pack(pady=5)
+
+    # Cancel button, keeps the pages cleaned so far
+    cancel_button = tk.Button(window, text="Cancel", font=("Arial", 14), command=on_cancel_button_click, state="disabled")
+    cancel_button.pack(pady=5)
+
+    # Closing the window while processing cancels the job
+    window.protocol("WM_DELETE_WINDOW", on_close)
+
+    window.mainloop()
+    window.destroy()
+    return outcome["state"]
+
+def run(list_file="output.txt", output_folder="output_images"):
+    return open_ui(list_file, output_folder)
+
+if __name__ == "__main__":
     run()
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+Per-job working folder: every run of main.py gets its own folder for the splits, the list of
+splits, the cleaned pages and the PDF batches, instead of temp_cut, output.txt, output_images
+and temp_sticking in the current folder. Several jobs can then run at the same time on one
+machine without deleting each other's files.
+
+The job folders are created in the system temp folder, or in WMREM_WORKSPACE_ROOT if it is
+set. With WMREM_WORKSPACE_ROOT=shm (or in_memory=True) they go to /dev/shm, so the
+intermediate files stay in RAM (Linux, mind the size of big jobs).
+"""
+import os
+import shutil
+import tempfile
+
+ROOT_ENV = "WMREM_WORKSPACE_ROOT"
+SHM_DIR = "/dev/shm"  # tmpfs on Linux
+
+
+def workspace_root(in_memory=False):
+    """
+    Where the job folders go: WMREM_WORKSPACE_ROOT, /dev/shm for in_memory, or None for the
+    system temp folder.
+    """
+    root = os.environ.get(ROOT_ENV)
+    if root == "shm":
+        in_memory, root = True, None
+    if root:
+        return root
+    if in_memory and os.path.isdir(SHM_DIR):
+        return SHM_DIR
+    return None
+
+
+class Workspace:
+    def __init__(self, root=None, in_memory=False):
+        root = root or workspace_root(in_memory)
+        if root:
+            os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix="wmrem-job-", dir=root)
+
+        # The paths every stage used to have hardcoded in the current folder
+        self.temp_cut = os.path.join(self.path, "temp_cut")
+        self.pdf_list = os.path.join(self.path, "output.txt")
+        self.output_images = os.path.join(self.path, "output_images")
+        self.temp_sticking = os.path.join(self.path, "temp_sticking")
+        self.spool = os.path.join(self.path, "output_pages.spool")
+        self.output_pdf = os.path.join(self.path, "output.pdf")
+
+    def deliver(self, folder, name="output.pdf"):
+        """
+        Move the finished PDF out of the workspace into folder, as name, or name-2.pdf,
+        name-3.pdf... when another job already left a PDF there. Returns the new path.
+        """
+        stem, extension = os.path.splitext(name)
+        number = 1
+        while True:
+            path = os.path.join(folder, name if number == 1 else f"{stem}-{number}{extension}")
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))  # Claim the name, atomic
+                break
+            except FileExistsError:
+                number += 1
+        shutil.move(self.output_pdf, path)
+        return path
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,245 @@
+"""
+Benchmarks: run the three cleaners headless over the synthetic corpus (see corpus.py) and
+store the timings as JSON, so two commits can be compared.
+
+    python benchmarks/bench.py                         full matrix, results/<commit>.json
+    python benchmarks/bench.py --quick                 small matrix, a couple of minutes
+    python benchmarks/bench.py --engines betterinpage --pages 20 --dpis 150 300
+    python benchmarks/bench.py --compare results/old.json results/new.json
+
+Every case (engine, document, DPI) runs in its own fresh Python process, in a copy of the
+engine's folder: the three folders have modules with the same names, the scripts write their
+temp folders next to themselves, and the peak memory of a process is only meaningful once.
+The per-stage numbers come from metrics.py, so they are the same stages the program exports
+(split, render, mask, fill, encode, assemble).
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import corpus
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+ENGINES = {
+    "inpage": "InPage",
+    "betterinpage": "betterInPage",
+    "upcleaner": "upcleaner",
+    "upcleaner-nearest": "upcleaner",  # upcleaner with the distance transform fill
+}
+INPAGE_DPI = 300  # InPage always renders at 300 DPI, the --dpis option doesn't apply to it
+
+FULL_MATRIX = {"kinds": ["text", "scanned"], "watermarks": ["full", "stamp"], "pages": [10, 50], "dpis": [100, 150]}
+QUICK_MATRIX = {"kinds": ["text", "scanned"], "watermarks": ["full", "stamp"], "pages": [4], "dpis": [100]}
+
+
+def run_pipeline(engine, pdf_path, watermark, dpi):
+    """
+    Runs in the case process, from the copy of the engine folder: split, clean, build the PDF,
+    the way main.py does it but without the windows. Returns the size of the output PDF.
+    """
+    import splitter
+    import pdfer
+
+    color = corpus.WATERMARKS[watermark]["color"]
+    split_files, _ = splitter.split_pdf_file(pdf_path, "temp_cut")
+
+    if engine == "inpage":
+        import wmremv2
+        wmremv2.process_multiple_pdfs(split_files, "output_images", color, tolerance=50)
+        pdfer.run()
+    elif engine == "betterinpage":
+        import betterinpage
+        total_images = 0
+        for split_pdf in split_files:
+            total_images = betterinpage.clean_pdf(split_pdf, "output_images", color, (255, 255, 255), 50, dpi, total_images)
+        pdfer.run("output_images", "output.pdf", "temp_sticking")
+    elif engine in ("upcleaner", "upcleaner-nearest"):
+        import remover
+        region = corpus.WATERMARKS[watermark]["box"]  # In points, like the regions upcleaner keeps
+        fill = "nearest" if engine == "upcleaner-nearest" else "blend"
+        remover.clean_pdfs(split_files, [remover.region_entry(region, color)], "output_images", dpi=dpi, fill=fill)
+        pdfer.run()
+    return os.path.getsize("output.pdf")
+
+
+def run_case_process(args):
+    """
+    Entry point of a case process (--case): run one pipeline, print the result as JSON.
+    """
+    case = json.loads(args.case)
+    sys.path.insert(0, os.getcwd())  # The copy of the engine folder
+    import metrics
+    import kernels
+
+    # Pick (benchmark, compile) the pixel kernels before the clock starts, like the job server's warm-up
+    backend = kernels.get_backend()
+
+    started = time.perf_counter()
+    output_bytes = run_pipeline(case["engine"], case["pdf"], case["watermark"], case["dpi"])
+    seconds = time.perf_counter() - started
+
+    snapshot = metrics.snapshot()
+    print(json.dumps({
+        "seconds": seconds,
+        "pages_per_second": case["pages"] / seconds,
+        "peak_rss_bytes": snapshot["peak_rss_bytes"],
+        "output_bytes": output_bytes,
+        "kernels": backend.name,
+        "stages": snapshot["stages"],
+    }))
+
+
+def run_case(case, repeat=1):
+    """
+    Run one case repeat times, each in a fresh process and a fresh copy of the engine folder.
+    The fastest run is kept, that's the one with the least noise from the rest of the machine.
+    """
+    best = None
+    for _ in range(repeat):
+        workdir = tempfile.mkdtemp(prefix=f"wmrem-bench-{case['engine']}-")
+        try:
+            engine_dir = os.path.join(REPO_ROOT, ENGINES[case["engine"]])
+            for name in os.listdir(engine_dir):
+                if name.endswith(".py"):
+                    shutil.copy(os.path.join(engine_dir, name), workdir)
+
+            env = dict(os.environ, PYTHONPATH=BENCH_DIR)
+            env.pop("WMREM_METRICS_FILE", None)  # The benchmark reads the metrics itself
+            completed = subprocess.run(
+                [sys.executable, os.path.join(BENCH_DIR, "bench.py"), "--case", json.dumps(case)],
+                cwd=workdir, env=env, capture_output=True, text=True,
+            )
+            if completed.returncode != 0:
+                raise RuntimeError(f"Case {case_name(case)} failed:\n{completed.stderr[-2000:]}")
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return dict(case, **best)
+
+
+def case_name(case):
+    return f"{case['engine']}/{case['kind']}-{case['watermark']}-{case['pages']}p@{case['dpi']}dpi"
+
+
+def build_cases(engines, matrix):
+    cases = []
+    for engine in engines:
+        for kind in matrix["kinds"]:
+            for watermark in matrix["watermarks"]:
+                for pages in matrix["pages"]:
+                    pdf_path = corpus.ensure_pdf(CORPUS_DIR, kind, watermark, pages)
+                    dpis = [INPAGE_DPI] if engine == "inpage" else matrix["dpis"]
+                    for dpi in dpis:
+                        cases.append({"engine": engine, "kind": kind, "watermark": watermark, "pages": pages,
+                                      "dpi": dpi, "pdf": pdf_path})
+    return cases
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def compare(old_path, new_path):
+    """
+    Print the cases of two result files side by side: seconds, the change in %, and the
+    stages that changed the most.
+    """
+    with open(old_path, encoding="utf-8") as old_file, open(new_path, encoding="utf-8") as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    old_cases = {case_name(case): case for case in old["cases"]}
+
+    print(f"{old['commit']} -> {new['commit']}")
+    print(f"{'case':<48} {'old s':>9} {'new s':>9} {'change':>8}   peak MB")
+    for case in new["cases"]:
+        name = case_name(case)
+        if name not in old_cases:
+            print(f"{name:<48} {'-':>9} {case['seconds']:>9.2f} {'new':>8}")
+            continue
+        before = old_cases[name]
+        change = (case["seconds"] - before["seconds"]) / before["seconds"] * 100
+        peak = f"{(before['peak_rss_bytes'] or 0) / 1024 ** 2:.0f} -> {(case['peak_rss_bytes'] or 0) / 1024 ** 2:.0f}"
+        print(f"{name:<48} {before['seconds']:>9.2f} {case['seconds']:>9.2f} {change:>+7.1f}%   {peak}")
+
+        # The stages that moved by more than 10%, stages under 50 ms are mostly noise
+        for stage_name, stats in sorted(case["stages"].items()):
+            old_stats = before["stages"].get(stage_name)
+            if old_stats and old_stats["seconds"] >= 0.05 and abs(stats["seconds"] / old_stats["seconds"] - 1) > 0.1:
+                print(f"    {stage_name:<44} {old_stats['seconds']:>9.2f} {stats['seconds']:>9.2f} "
+                      f"{(stats['seconds'] / old_stats['seconds'] - 1) * 100:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cleaners on a synthetic watermarked corpus.")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument("--quick", action="store_true", help="small matrix, for a quick check")
+    parser.add_argument("--kinds", nargs="+", choices=["text", "scanned"])
+    parser.add_argument("--watermarks", nargs="+", choices=list(corpus.WATERMARKS))
+    parser.add_argument("--pages", nargs="+", type=int)
+    parser.add_argument("--dpis", nargs="+", type=int)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, the fastest is kept")
+    parser.add_argument("--output", help="result file (default: results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--case", help=argparse.SUPPRESS)  # Internal: run one case in this process
+    args = parser.parse_args()
+
+    if args.case:
+        run_case_process(args)
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    matrix = dict(QUICK_MATRIX if args.quick else FULL_MATRIX)
+    for key in ("kinds", "watermarks", "pages", "dpis"):
+        if getattr(args, key):
+            matrix[key] = getattr(args, key)
+
+    commit, dirty = git_commit()
+    results = {
+        "commit": commit + ("-dirty" if dirty else ""),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "matrix": matrix,
+        "repeat": args.repeat,
+        "cases": [],
+    }
+
+    cases = build_cases(args.engines, matrix)
+    print(f"{len(cases)} cases")
+    for case in cases:
+        result = run_case(case, args.repeat)
+        result["pdf"] = os.path.basename(result["pdf"])
+        results["cases"].append(result)
+        print(f"{case_name(case):<48} {result['seconds']:>8.2f} s {result['pages_per_second']:>7.2f} pages/s "
+              f"{(result['peak_rss_bytes'] or 0) / 1024 ** 2:>7.0f} MB peak")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
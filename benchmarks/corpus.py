@@ -0,0 +1,138 @@
+"""
+Synthetic watermarked PDFs for the benchmarks.
+
+Every document is generated from a seed, so the same name always gives the same file
+(on the same PyMuPDF version), and comes with its watermark-free twin:
+
+    kind        "text"     vector text pages
+                "scanned"  one full-page JPEG per page, like a scanner makes
+    watermark   "full"     big diagonal gray text over the whole page
+                "stamp"    small red stamp in the footer
+                None       no watermark (the clean twin)
+
+The watermark color and the stamp box (in PDF points) are in WATERMARKS, the benchmarks
+use them as the color/region a user would have picked.
+"""
+import io
+import os
+import random
+
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+SCAN_DPI = 150  # Resolution of the "scanned" page images
+
+WATERMARKS = {
+    "full": {"color": (190, 190, 190), "box": (0, 0, PAGE_WIDTH, PAGE_HEIGHT)},
+    "stamp": {"color": (220, 40, 40), "box": (200, 770, 395, 820)},
+}
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+         "et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi").split()
+
+
+def document_name(kind, watermark, pages, seed=0):
+    return f"{kind}-{watermark or 'clean'}-{pages}p-s{seed}.pdf"
+
+
+def random_lines(rng, count):
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 13))) for _ in range(count)]
+
+
+def text_page(doc, rng, page_num):
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_text((60, 60), f"Chapter {page_num // 10 + 1}", fontsize=18)
+    page.insert_text((60, 95), "\n".join(random_lines(rng, 42)), fontsize=10, lineheight=1.6)
+    page.insert_text((PAGE_WIDTH / 2 - 10, PAGE_HEIGHT - 40), str(page_num + 1), fontsize=9)
+    return page
+
+
+def draw_text_watermark(page, watermark):
+    color = tuple(c / 255 for c in WATERMARKS[watermark]["color"])
+    if watermark == "full":
+        # Diagonal text, drawn three times down the page
+        for y in (330, 560, 790):
+            page.insert_text((60, y), "WATERMARK SAMPLE", fontsize=44, color=color,
+                             morph=(fitz.Point(60, y), fitz.Matrix(30)))
+    else:
+        box = fitz.Rect(WATERMARKS["stamp"]["box"])
+        page.draw_rect(box, color=color, width=2)
+        page.insert_text((box.x0 + 12, box.y1 - 16), "CONFIDENTIAL", fontsize=22, color=color)
+
+
+def scanned_image(rng, page_num, watermark):
+    """
+    A grayish scanned page: paper noise, lines of "text" blocks, the watermark baked in.
+    """
+    scale = SCAN_DPI / 72
+    width, height = int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)
+    noise = np.random.default_rng(rng.randint(0, 2 ** 31)).normal(242, 6, (height, width))
+    image = Image.fromarray(np.clip(noise, 0, 255).astype(np.uint8)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+
+    if watermark == "full":
+        # Under the text, like a watermark printed on the paper
+        layer = Image.new("L", (width, height), 0)
+        layer_draw = ImageDraw.Draw(layer)
+        for y in (330, 560, 790):
+            layer_draw.text((60 * scale, (y - 44) * scale), "WATERMARK SAMPLE", fill=255,
+                            font=ImageFont.load_default(size=int(44 * scale)))
+        image.paste(WATERMARKS["full"]["color"], mask=layer.rotate(30, center=(width // 2, height // 2)))
+
+    # Words as dark boxes, that's all a color replacement engine sees of them
+    y = int(60 * scale)
+    while y < height - 80 * scale:
+        x = int(60 * scale)
+        while x < width - 120 * scale:
+            word = rng.randint(15, 70)
+            draw.rectangle((x, y, x + word, y + int(7 * scale)), fill=(35, 35, 35))
+            x += word + int(5 * scale)
+        y += int(16 * scale)
+
+    if watermark == "stamp":
+        x0, y0, x1, y1 = (int(v * scale) for v in WATERMARKS["stamp"]["box"])
+        color = WATERMARKS["stamp"]["color"]
+        draw.rectangle((x0, y0, x1, y1), outline=color, width=int(2 * scale))
+        draw.text((x0 + 12 * scale, y0 + 10 * scale), "CONFIDENTIAL", fill=color,
+                  font=ImageFont.load_default(size=int(22 * scale)))
+
+    draw.text((width // 2, height - int(40 * scale)), str(page_num + 1), fill=(35, 35, 35))
+    return image
+
+
+def make_pdf(path, kind, watermark, pages, seed=0):
+    """
+    Write one synthetic document. The same (kind, pages, seed) gives the same pages with
+    any watermark, so a watermark=None document is the ground truth for the others.
+    """
+    rng = random.Random(f"{kind}:{seed}")  # Not seeded by the watermark, the twins share their text
+    doc = fitz.open()
+    for page_num in range(pages):
+        page_rng = random.Random(rng.random())
+        if kind == "text":
+            page = text_page(doc, page_rng, page_num)
+            if watermark:
+                draw_text_watermark(page, watermark)
+        elif kind == "scanned":
+            buffer = io.BytesIO()
+            scanned_image(page_rng, page_num, watermark).save(buffer, "JPEG", quality=85)
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            page.insert_image(page.rect, stream=buffer.getvalue())
+        else:
+            raise ValueError(f"Unknown document kind: {kind}")
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return path
+
+
+def ensure_pdf(corpus_dir, kind, watermark, pages, seed=0):
+    """
+    Path of a corpus document, generated the first time it is asked for.
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    path = os.path.join(corpus_dir, document_name(kind, watermark, pages, seed))
+    if not os.path.exists(path):
+        make_pdf(path, kind, watermark, pages, seed)
+    return path
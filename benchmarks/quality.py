@@ -0,0 +1,251 @@
+"""
+Quality vs speed: run the cleaning engines over watermarked pages of the corpus and compare
+the result with the same page without the watermark (see corpus.py).
+
+For every engine, setting and document class (text/scanned, full/stamp watermark):
+
+    psnr        dB against the clean page, higher is better
+    ssim        structural similarity against the clean page (grayscale), 1.0 is identical
+    residual    share of the watermark pixels that still differ from the clean page
+    collateral  share of the other pixels the engine changed (text it whitened, etc.)
+    s/page      seconds spent in the engine per page (rendering not included)
+
+With --min-ssim / --max-residual it also prints, per document class, the fastest setting
+that meets the bar.
+
+    python benchmarks/quality.py
+    python benchmarks/quality.py --engines betterinpage --tolerances 20 40 60 --dpis 100 150 200
+    python benchmarks/quality.py --min-ssim 0.9 --max-residual 0.05
+
+Like bench.py, every engine runs in its own process, with its own folder on the path.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+import corpus
+from bench import BENCH_DIR, CORPUS_DIR, ENGINES, REPO_ROOT, RESULTS_DIR, git_commit
+
+CHANGED = 30  # A pixel "differs" when a channel is off by more than this (JPEG noise stays under it)
+
+
+def psnr(output, clean):
+    mse = np.mean((output.astype(np.float64) - clean.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def ssim(output, clean):
+    """
+    Mean SSIM of the grayscale images, gaussian window (sigma 1.5) like the original paper.
+    """
+    def gray(image):
+        image = image.astype(np.float64)
+        return image if image.ndim == 2 else image[..., :3] @ [0.299, 0.587, 0.114]
+
+    x, y = gray(output), gray(clean)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_x, mu_y = gaussian_filter(x, 1.5), gaussian_filter(y, 1.5)
+    var_x = gaussian_filter(x * x, 1.5) - mu_x ** 2
+    var_y = gaussian_filter(y * y, 1.5) - mu_y ** 2
+    cov = gaussian_filter(x * y, 1.5) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(ssim_map.mean())
+
+
+def differs(a, b):
+    diff = np.abs(a.astype(np.int16) - b.astype(np.int16))
+    return diff.max(axis=-1) > CHANGED if diff.ndim == 3 else diff > CHANGED
+
+
+def score(output, watermarked, clean):
+    """
+    All the quality numbers of one cleaned page.
+    """
+    watermark_pixels = differs(watermarked, clean)
+    other_pixels = ~watermark_pixels
+    still_different = differs(output, clean)
+    return {
+        "psnr": psnr(output, clean),
+        "ssim": ssim(output, clean),
+        "residual": float(still_different[watermark_pixels].mean()) if watermark_pixels.any() else 0.0,
+        "collateral": float(still_different[other_pixels].mean()) if other_pixels.any() else 0.0,
+    }
+
+
+ENGINE_MODULES = {"inpage": "wmremv2", "betterinpage": "betterinpage", "upcleaner": "remover", "upcleaner-nearest": "remover"}
+
+
+def clean_page(engine, image, watermark, setting):
+    """
+    Runs in the engine process: clean one rendered page with one setting, like the engine's
+    own pipeline does it.
+    """
+    color = corpus.WATERMARKS[watermark]["color"]
+    if engine == "inpage":
+        import wmremv2
+        return wmremv2.replace_color(image, color, setting["tolerance"])
+    if engine == "betterinpage":
+        import betterinpage
+        return betterinpage.replace_color(image, color, (255, 255, 255), setting["tolerance"])
+    if engine == "upcleaner":
+        import remover
+        region = remover.points_to_pixels(corpus.WATERMARKS[watermark]["box"], setting["dpi"], image.width, image.height)
+        return remover.replace_color_in_region(image, region, color, setting["tolerance"], setting["iterations"])
+    if engine == "upcleaner-nearest":
+        import remover
+        region = remover.points_to_pixels(corpus.WATERMARKS[watermark]["box"], setting["dpi"], image.width, image.height)
+        return remover.replace_color_in_region(image, region, color, setting["tolerance"], fill="nearest",
+                                               smooth_radius=setting["smooth_radius"])
+    raise ValueError(f"Unknown engine: {engine}")
+
+
+def run_engine_process(args):
+    """
+    Entry point of an engine process (--engine-process): score every job, print the results as JSON.
+    """
+    import contextlib
+    import importlib
+    import kernels
+    import renderer
+
+    engine = args.engine_process
+    # Import the engine and pick (benchmark, compile) the pixel kernels before anything is
+    # timed, or the first setting pays for both
+    importlib.import_module(ENGINE_MODULES[engine])
+    backend = kernels.get_backend()
+    jobs = json.loads(args.jobs)
+    results = []
+    for job in jobs:
+        setting = job["setting"]
+        scores = []
+        seconds = 0.0
+        for page in range(1, job["pages"] + 1):
+            watermarked = renderer.render_pages(job["pdf"], setting["dpi"], page, page)[0]
+            clean = np.array(renderer.render_pages(job["clean_pdf"], setting["dpi"], page, page)[0])
+
+            with contextlib.redirect_stdout(sys.stderr):  # upcleaner prints as it goes, stdout is for the results
+                started = time.perf_counter()
+                output = clean_page(engine, watermarked, job["watermark"], setting)
+                seconds += time.perf_counter() - started
+
+            output = np.array(output.convert("RGB"))
+            scores.append(score(output, np.array(watermarked), clean))
+
+        results.append(dict(
+            job,
+            seconds_per_page=seconds / job["pages"],
+            kernels=backend.name,
+            **{key: float(np.mean([s[key] for s in scores])) for key in scores[0]},
+        ))
+    print(json.dumps(results))
+
+
+def settings_for(engine, args):
+    """
+    Every combination of the knobs the engine has.
+    """
+    grid = {"dpi": args.dpis, "tolerance": args.tolerances}
+    if engine == "upcleaner":
+        grid["iterations"] = args.iterations
+    if engine == "upcleaner-nearest":
+        grid["smooth_radius"] = args.smooth_radii
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+def run_engine(engine, jobs):
+    engine_dir = os.path.join(REPO_ROOT, ENGINES[engine])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([engine_dir, BENCH_DIR]))
+    with tempfile.TemporaryDirectory(prefix=f"wmrem-quality-{engine}-") as workdir:
+        completed = subprocess.run(
+            [sys.executable, os.path.join(BENCH_DIR, "quality.py"), "--engine-process", engine, "--jobs", json.dumps(jobs)],
+            cwd=workdir, env=env, capture_output=True, text=True,
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Engine {engine} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def describe(setting):
+    return " ".join(f"{key}={value}" for key, value in setting.items())
+
+
+def print_table(results):
+    print(f"{'engine':<13} {'document':<14} {'setting':<36} {'psnr':>6} {'ssim':>6} {'residual':>9} {'collat.':>8} {'s/page':>7}")
+    for r in results:
+        print(f"{r['engine']:<13} {r['document']:<14} {describe(r['setting']):<36} {r['psnr']:>6.1f} {r['ssim']:>6.3f} "
+              f"{r['residual']:>9.1%} {r['collateral']:>8.2%} {r['seconds_per_page']:>7.3f}")
+
+
+def print_cheapest(results, min_ssim, max_residual):
+    """
+    Per document class, the fastest engine and setting that meets the quality bar.
+    """
+    print(f"\nFastest setting with ssim >= {min_ssim} and residual <= {max_residual:.0%}:")
+    for document in sorted({r["document"] for r in results}):
+        passing = [r for r in results if r["document"] == document and r["ssim"] >= min_ssim and r["residual"] <= max_residual]
+        if not passing:
+            print(f"  {document:<14} nothing meets the bar")
+            continue
+        best = min(passing, key=lambda r: r["seconds_per_page"])
+        print(f"  {document:<14} {best['engine']} {describe(best['setting'])} ({best['seconds_per_page']:.3f} s/page, "
+              f"ssim {best['ssim']:.3f}, residual {best['residual']:.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the quality and speed of the cleaning engines.")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument("--kinds", nargs="+", choices=["text", "scanned"], default=["text", "scanned"])
+    parser.add_argument("--watermarks", nargs="+", choices=list(corpus.WATERMARKS), default=list(corpus.WATERMARKS))
+    parser.add_argument("--pages", type=int, default=3, help="pages scored per document")
+    parser.add_argument("--dpis", nargs="+", type=int, default=[100, 150])
+    parser.add_argument("--tolerances", nargs="+", type=int, default=[30, 50, 80])
+    parser.add_argument("--iterations", nargs="+", type=int, default=[1, 5], help="upcleaner blending iterations")
+    parser.add_argument("--smooth-radii", nargs="+", type=int, default=[0, 1], help="upcleaner-nearest smoothing pass (0 = none)")
+    parser.add_argument("--min-ssim", type=float, default=0.9)
+    parser.add_argument("--max-residual", type=float, default=0.05)
+    parser.add_argument("--output", help="result file (default: results/quality-<commit>.json)")
+    parser.add_argument("--engine-process", help=argparse.SUPPRESS)  # Internal: score jobs for one engine
+    parser.add_argument("--jobs", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.engine_process:
+        run_engine_process(args)
+        return
+
+    results = []
+    for engine in args.engines:
+        jobs = []
+        for kind, watermark in itertools.product(args.kinds, args.watermarks):
+            pdf_path = corpus.ensure_pdf(CORPUS_DIR, kind, watermark, args.pages)
+            clean_pdf_path = corpus.ensure_pdf(CORPUS_DIR, kind, None, args.pages)
+            for setting in settings_for(engine, args):
+                jobs.append({"engine": engine, "document": f"{kind}-{watermark}", "watermark": watermark, "pages": args.pages,
+                             "pdf": pdf_path, "clean_pdf": clean_pdf_path, "setting": setting})
+        print(f"{engine}: {len(jobs)} settings x documents...")
+        results += run_engine(engine, jobs)
+
+    print_table(results)
+    print_cheapest(results, args.min_ssim, args.max_residual)
+
+    commit, dirty = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"quality-{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    for r in results:
+        r["pdf"], r["clean_pdf"] = os.path.basename(r["pdf"]), os.path.basename(r["clean_pdf"])
+    with open(output, "w", encoding="utf-8") as results_file:
+        json.dump({"commit": commit + ("-dirty" if dirty else ""), "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                   "min_ssim": args.min_ssim, "max_residual": args.max_residual, "results": results}, results_file, indent=2)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
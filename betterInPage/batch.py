@@ -0,0 +1,306 @@
+"""
+Batch mode: clean every PDF of a directory (or a list of files) without the UI, on one pool
+of worker processes shared by all the documents.
+
+Every document is split like the UI flow does it, in a pool task as well (biggest file first),
+and its splits go to the pool as soon as it is split, biggest first among the splits that are
+ready: the long documents start right away and the small ones fill the gaps at the end, so no
+worker sits idle while one big document finishes, or while the others are being split. A
+document's PDF is built as soon as its last split is done, the others keep going.
+
+    python batch.py C:/books --output C:/books_clean --color "#C0C0C0" --workers 8
+    python batch.py book1.pdf book2.pdf --output cleaned --dpi auto
+
+Fully scanned PDFs are cleaned in place (scan_pages.py) unless --no-fast-scans. They are not
+split, but their page ranges are tasks like the splits, biggest first with the others. The
+cleaned scans are put back in the PDF when the last range is done.
+"""
+import argparse
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import time
+from multiprocessing import Pool
+
+import splitter  # Assuming splitter.py is in the same directory
+import betterinpage  # Assuming betterinpage.py is in the same directory
+import pdfer  # Assuming pdfer.py is in the same directory
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import renderer  # Render backends and DPI settings
+import scan_pages  # Fast path for scanned PDFs
+import kernels  # Mask and fill kernels: NumPy, numexpr or Numba
+from job_server import clean_scan_range, clean_shard, warm_up  # Same pool tasks as the job server
+
+
+# Configure the logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_WORK_ROOT = os.path.abspath("batch_work")
+
+
+def find_pdfs(paths, recursive=False):
+    """
+    The PDFs to clean: files as they are, and the PDFs inside every directory.
+    """
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for dirpath, _, filenames in sorted(os.walk(path)):
+                    pdfs += [os.path.join(dirpath, name) for name in sorted(filenames) if name.lower().endswith(".pdf")]
+            else:
+                pdfs += [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith(".pdf")]
+        elif os.path.isfile(path):
+            pdfs.append(path)
+        else:
+            raise ValueError(f"File not found: {path}")
+    return [os.path.abspath(pdf) for pdf in pdfs]
+
+
+def output_path_for(input_pdf, output_dir, taken):
+    """
+    <output_dir>/<name>.pdf, with a number added when two inputs have the same name.
+    """
+    stem = os.path.splitext(os.path.basename(input_pdf))[0]
+    name, number = f"{stem}.pdf", 1
+    while name in taken:
+        number += 1
+        name = f"{stem}-{number}.pdf"
+    taken.add(name)
+    return os.path.join(output_dir, name)
+
+
+def plan(pdfs, output_dir, run_dir):
+    """
+    The documents of the batch, not split yet: that is a pool task, see plan_document.
+    """
+    documents, taken = [], set()
+    for doc_index, input_pdf in enumerate(pdfs):
+        documents.append({
+            "input_pdf": input_pdf,
+            "output_pdf": output_path_for(input_pdf, output_dir, taken),
+            "work_dir": os.path.join(run_dir, f"{doc_index:05d}"),
+            "bytes": os.path.getsize(input_pdf),
+            "pages": 0,
+            "splits": [],  # Page count of every split (cleaned pages of every range when scanned), filled when they are done
+            "remaining": 0,
+            "scanned": False,
+            "error": None,
+            "finished_at": None,
+        })
+    return documents
+
+
+def plan_document(input_pdf, work_dir, workers, fast_scans=True):
+    """
+    Runs in a pool worker: split one document and list its pool tasks, every one a dict with
+    "split", "pages", "bytes" and the split's "pdf", or "first" and "last" for the page ranges
+    of a scanned PDF (read straight from the input PDF, it is cleaned inside the PDF).
+    Returns (page count, scanned, tasks, the worker's metrics).
+    """
+    pages = renderer.page_count(input_pdf)
+    scanned = fast_scans and scan_pages.is_scanned(input_pdf)
+    tasks = []
+    if scanned:
+        page_bytes = os.path.getsize(input_pdf) / max(1, pages)
+        for split_index, (first, last) in enumerate(splitter.page_ranges(input_pdf, workers=workers)):
+            tasks.append({"split": split_index, "first": first, "last": last, "pages": last - first,
+                          "bytes": int(page_bytes * (last - first))})
+    else:
+        split_files, timings = splitter.split_pdf_file(input_pdf, os.path.join(work_dir, "temp_cut"), workers=workers)
+        for split_index, (split_pdf, timing) in enumerate(zip(split_files, timings)):
+            tasks.append({"split": split_index, "pdf": split_pdf, "pages": timing["pages"], "bytes": timing["bytes"]})
+    return pages, scanned, tasks, metrics.snapshot(reset=True)
+
+
+def assemble(document):
+    """
+    Build the PDF of a document from the pages of its splits, in order. A scanned document is
+    written with its cleaned scans put back in place.
+    """
+    if document["scanned"]:
+        scan_pages.apply_pages(document["input_pdf"], document["output_pdf"], [page for pages in document["splits"] for page in pages])
+        return
+    writer = pdfer.IncrementalPdfWriter(document["output_pdf"])
+    for split_index, pages in enumerate(document["splits"]):
+        shard_folder = os.path.join(document["work_dir"], "shards", f"{split_index:05d}")
+        for page in range(pages):
+            writer.add_image(os.path.join(shard_folder, f"image_{page}.jpg"))
+    writer.close()
+
+
+def run_batch(pdfs, output_dir, params, workers=None, work_root=DEFAULT_WORK_ROOT, fast_scans=True, keep_temp=False):
+    """
+    Clean all the PDFs on one pool. Returns the documents, with "error" set on the ones that failed.
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+
+    # A folder of its own in the work root, batches started from the same folder share the root
+    os.makedirs(work_root, exist_ok=True)
+    run_dir = tempfile.mkdtemp(prefix="wmrem-batch-", dir=work_root)
+
+    documents = plan(pdfs, output_dir, run_dir)
+    logging.info(f"{len(documents)} documents on {workers} workers")
+
+    # Everything the pool reports goes through this queue, to the main thread: the callbacks
+    # run in the pool's result thread, they only pass the results on
+    events = queue.Queue()
+    pending = 0  # Tasks in the pool
+
+    def submit(pool, doc_index, task):
+        document = documents[doc_index]
+        if document["scanned"]:
+            arguments = (document["input_pdf"], task["first"], task["last"], params)
+            function = clean_scan_range
+        else:
+            arguments = (task["pdf"], os.path.join(document["work_dir"], "shards", f"{task['split']:05d}"), params)
+            function = clean_shard
+        pool.apply_async(
+            function, arguments,
+            callback=lambda result: events.put(("done", doc_index, task, result)),
+            error_callback=lambda error: events.put(("failed", doc_index, task, error)),
+        )
+
+    def planned(doc_index, result):
+        # Bookkeeping of a document that was just split, returns its tasks
+        pages, scanned, tasks, worker_metrics = result
+        metrics.merge(worker_metrics)
+        document = documents[doc_index]
+        document.update(pages=pages, scanned=scanned, remaining=len(tasks), splits=[None] * len(tasks))
+        return [(doc_index, task) for task in tasks]
+
+    def task_done(doc_index, task, result):
+        # Returns True when it was the document's last task
+        pages, worker_metrics = result
+        metrics.merge(worker_metrics)
+        document = documents[doc_index]
+        document["splits"][task["split"]] = pages  # Page count, the cleaned pages for a scanned document
+        document["remaining"] -= 1
+        return document["remaining"] == 0 and document["error"] is None  # A failed document was reported already
+
+    def finish(document):
+        # Build the PDF of a document whose tasks are all done, or report why it failed
+        name = os.path.basename(document["input_pdf"])
+        if document["error"] is None:
+            try:
+                assemble(document)
+            except Exception as e:
+                document["error"] = str(e)
+        document["finished_at"] = time.perf_counter() - started
+        if document["error"] is None:
+            logging.info(f"{name} done after {document['finished_at']:.1f}s: {document['output_pdf']}")
+            if not keep_temp:
+                shutil.rmtree(document["work_dir"], ignore_errors=True)
+        else:
+            logging.error(f"{name} failed: {document['error']}")
+
+    # The kernel backend is picked once here, the workers all use the same one
+    with Pool(workers, initializer=warm_up, initargs=(kernels.pool_backend(),)) as pool:
+        # Splitting is a pool task too, so the workers don't wait for all the documents to be
+        # split. Biggest file first, the long documents are then the first ones with tasks.
+        for doc_index in sorted(range(len(documents)), key=lambda doc_index: -documents[doc_index]["bytes"]):
+            document = documents[doc_index]
+            pool.apply_async(
+                plan_document, (document["input_pdf"], document["work_dir"], workers, fast_scans),
+                callback=lambda result, doc_index=doc_index: events.put(("planned", doc_index, None, result)),
+                error_callback=lambda error, doc_index=doc_index: events.put(("plan_failed", doc_index, None, error)),
+            )
+            pending += 1
+
+        unfinished = len(documents)
+        while unfinished:
+            # Take everything that came in, the new tasks are then sorted together
+            batch = [events.get()]
+            while True:
+                try:
+                    batch.append(events.get_nowait())
+                except queue.Empty:
+                    break
+
+            ready, finished = [], []
+            for kind, doc_index, task, result in batch:
+                pending -= 1
+                document = documents[doc_index]
+                if kind == "planned":
+                    tasks = planned(doc_index, result)
+                    ready += tasks
+                    if not tasks:
+                        finished.append(doc_index)  # Nothing to clean
+                elif kind == "plan_failed":
+                    document["error"] = f"can't be read: {result}"  # Reported with the others, the batch goes on
+                    finished.append(doc_index)
+                elif kind == "done":
+                    if task_done(doc_index, task, result):
+                        finished.append(doc_index)
+                elif document["error"] is None:
+                    document["error"] = str(result)
+                    finished.append(doc_index)  # Reported now, the document's other tasks are ignored
+
+            # Longest first: the big splits of the big documents, the small ones fill in at the end.
+            # Splits of the same size stay grouped by document, so documents finish one after the other.
+            ready.sort(key=lambda item: (-item[1]["pages"], -documents[item[0]]["pages"], -item[1]["bytes"], item[0], item[1]["split"]))
+            for doc_index, task in ready:
+                submit(pool, doc_index, task)
+            pending += len(ready)
+            metrics.set_queue_depth("batch_tasks", pending)
+
+            for doc_index in finished:
+                finish(documents[doc_index])
+                unfinished -= 1
+
+    if not keep_temp:
+        # Only removed when empty: failed documents keep their folder, to see what went wrong,
+        # and other batches can still be using the work root
+        for folder in (run_dir, work_root):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+
+    seconds = time.perf_counter() - started
+    total_pages = sum(document["pages"] for document in documents)
+    failed = [document for document in documents if document["error"]]
+    print(f"{len(documents) - len(failed)} of {len(documents)} documents cleaned, {total_pages} pages in {seconds:.1f}s "
+          f"({total_pages / seconds:.1f} pages/s)")
+    for document in failed:
+        print(f"  failed: {document['input_pdf']}: {document['error']}")
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean all the PDFs of a directory on one pool of worker processes.")
+    parser.add_argument("inputs", nargs="+", help="PDF files and/or directories of PDFs")
+    parser.add_argument("--output", required=True, help="folder for the cleaned PDFs")
+    parser.add_argument("--recursive", action="store_true", help="also take the PDFs in the subfolders")
+    parser.add_argument("--color", default="#000000", help="watermark color, HEX or R,G,B")
+    parser.add_argument("--replacement", default="#FFFFFF", help="replacement color, HEX or R,G,B")
+    parser.add_argument("--tolerance", type=int, default=50)
+    parser.add_argument("--dpi", type=renderer.parse_dpi, default=150, help='a number, or "auto" for the resolution of the scans')
+    parser.add_argument("--grayscale", action="store_true", help="render, clean and save pages in grayscale")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: number of CPU cores)")
+    parser.add_argument("--work-root", default=DEFAULT_WORK_ROOT, help="folder for the splits and cleaned pages (every run makes its own folder in it)")
+    parser.add_argument("--no-fast-scans", action="store_true", help="render scanned PDFs like the others")
+    parser.add_argument("--keep-temp", action="store_true", help="keep the splits and pages of every document")
+    args = parser.parse_args()
+
+    params = {
+        "target_color": betterinpage.parse_color(args.color),
+        "replacement_color": betterinpage.parse_color(args.replacement),
+        "tolerance": args.tolerance,
+        "dpi": args.dpi,
+        "grayscale": args.grayscale,
+    }
+    metrics.start_exporter()
+    try:
+        run_batch(find_pdfs(args.inputs, args.recursive), args.output, params, args.workers, args.work_root,
+                  not args.no_fast_scans, args.keep_temp)
+    finally:
+        metrics.export()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,246 +1,656 @@
-import logging
-import os
-import ast
-from pdf2image import convert_from_path
-from PIL import Image
-import numpy as np
-from tqdm import tqdm
-import tkinter as tk
-from tkinter import messagebox
-from tkinter import ttk  # Import ttk for the progress bar
-
-
-# Configure the logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-class BetterInpage:
-    def __init__(self, root):
-        self.root = root
-        root.title("Watermark remover tool")
-        # Set window size to make it larger
-        root.geometry("500x800")  # Width x Height
-
-        # Variable to track process completion
-        self.process_done = False
-
-        # Create UI elements
-        self.create_widgets()
-
-    def create_widgets(self):
-        # Color input instructions (Target Color)
-        tk.Label(self.root, text="Enter Watermark Color (HEX or RGB):", font=("Arial", 12)).pack(pady=10)
-        self.color_entry = tk.Entry(self.root, width=20, font=("Arial", 14))
-        self.color_entry.insert(0, "#000000")  # Default HEX value (black)
-        self.color_entry.pack(pady=5)
-
-        # Replacement color input instructions
-        tk.Label(self.root, text="Enter Replacement Color (HEX or RGB):", font=("Arial", 12)).pack(pady=10)
-        self.replacement_color_entry = tk.Entry(self.root, width=20, font=("Arial", 14))
-        self.replacement_color_entry.insert(0, "#FFFFFF")  # Default HEX value (white)
-        self.replacement_color_entry.pack(pady=5)
-
-        # Input for the tolerance
-        tk.Label(self.root, text="Tolerance:", font=("Arial", 12)).pack(pady=10)
-        self.tolerance_entry = tk.Entry(self.root, width=10, font=("Arial", 14))
-        self.tolerance_entry.insert(0, "50")
-        self.tolerance_entry.pack(pady=10)
-
-        # DPI input field
-        tk.Label(self.root, text="Enter DPI for PDF Conversion:", font=("Arial", 12)).pack(pady=10)
-        self.dpi_entry = tk.Entry(self.root, width=10, font=("Arial", 14))
-        self.dpi_entry.insert(0, "150")  # Default DPI value
-        self.dpi_entry.pack(pady=5)
-
-        # Add a progress bar to the window(root)
-        self.progress_bar = ttk.Progressbar(self.root, length=400, mode="determinate")
-        self.progress_bar.pack(pady=20)
-
-        # Start button
-        self.start_button = tk.Button(self.root, text="Start Processing", font=("Arial", 14), command=self.on_start_button_click)
-        self.start_button.pack(pady=20)
-
-        # User shouldn't close instruction
-        tk.Label(self.root, text="This window might look freezed, it's normal", font=("Arial", 12)).pack(pady=10)
-        tk.Label(self.root, text="DON'T CLOSE IT, it will close itself", font=("Arial", 12)).pack(pady=10)
-
-    def hex_to_rgb(self, hex_color):
-        """
-        Convert HEX color code (e.g., #RRGGBB) to RGB tuple (R, G, B).
-        """
-        if hex_color.startswith('#'):
-            hex_color = hex_color[1:]
-        
-        if len(hex_color) == 6:
-            return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-        else:
-            raise ValueError(f"Invalid HEX color code: {hex_color}")
-
-    def replace_color(self, image, target_color, replacement_color, tolerance=50):
-        """
-        Replace a specific color in the image with the replacement color, given a tolerance range.
-        Optimized to speed up the process using vectorized NumPy operations.
-        """
-        logging.info("Starting color replacement process.")
-        
-        # Convert the image to RGBA format
-        img = image.convert("RGBA")
-        data = np.array(img)
-        
-        # Create bounds for the target color based on tolerance
-        lower_bound = np.array([max(0, c - tolerance) for c in target_color])
-        upper_bound = np.array([min(255, c + tolerance) for c in target_color])
-        
-        # Use NumPy to create a mask for the target color range
-        mask = np.all(np.logical_and(data[..., :3] >= lower_bound, data[..., :3] <= upper_bound), axis=-1)
-        
-        # Replace matched pixels with the replacement color (e.g., white)
-        data[mask] = replacement_color + (255,)  # Set alpha to fully opaque
-        
-        image_with_replacement = Image.fromarray(data)
-        logging.info(f"Color replacement completed for image with target color {target_color}.")
-        return image_with_replacement
-
-    def convert_pdf_to_jpg(self, input_pdf_path, dpi):
-        """
-        Convert a PDF to JPG images with a progress bar.
-        Optimized by reducing DPI (less resolution = faster conversion).
-        """
-        images = convert_from_path(input_pdf_path, dpi=dpi)  # Reduced DPI to speed up conversion
-        for i in tqdm(range(len(images)), desc="Converting PDF to Images", unit="page"):
-            logging.info(f"Page {i + 1} converted to image.")
-        return images
-
-    def save_image(self, image, output_folder, image_counter):
-        """
-        Save the processed image as a JPG file.
-        """
-        image_rgb = image.convert("RGB")  # Convert RGBA to RGB (removes alpha channel)
-        output_image_path = os.path.join(output_folder, f"image_{image_counter}.jpg")  # Unique filename
-        image_rgb.save(output_image_path, "JPEG")
-        logging.info(f"Processed image {image_counter} saved to {output_image_path}")
-
-    def process_pdf(self, input_pdf_path, output_folder, target_color=(0, 0, 0), replacement_color=(255, 255, 255), tolerance=50, progress_bar=None, total_images=None):
-        """
-        Full process: Convert PDF to JPGs, replace color, and save the images in the output folder.
-        Optimized to process PDFs in parallel.
-        """
-        # Get DPI value from the entry widget
-        dpi = int(self.dpi_entry.get())  # Get the DPI entered by the user
-
-        images = self.convert_pdf_to_jpg(input_pdf_path, dpi)  # Pass DPI to the conversion function
-        image_counter = total_images  # Start from the passed counter for global image tracking
-        total_images += len(images)  # Update total image count
-
-        for i, image in enumerate(tqdm(images, desc="Processing Pages", unit="page", total=len(images))):
-            image_with_replaced_color = self.replace_color(image, target_color, replacement_color, tolerance)
-            self.save_image(image_with_replaced_color, output_folder, image_counter)
-            image_counter += 1
-
-            if progress_bar:
-                progress_bar['value'] = (image_counter / total_images) * 100  # Update the progress bar
-                progress_bar.update()  # Force the update to be displayed
-
-        return total_images
-
-
-    def process_multiple_pdfs(self, input_pdf_paths, output_folder, target_color=(0, 0, 0), replacement_color=(255, 255, 255), tolerance=50, progress_bar=None):
-        """
-        Process multiple PDF files and save the output images in the specified output folder.
-        """
-        # Ensure the output folder exists
-        os.makedirs(output_folder, exist_ok=True)
-
-        total_images = 0  # Total image counter across all PDFs
-        for input_pdf_path in input_pdf_paths:
-            logging.info(f"Processing PDF: {input_pdf_path}")
-            total_images = self.process_pdf(input_pdf_path, output_folder, target_color, replacement_color, tolerance, progress_bar, total_images)
-
-        return total_images
-
-    def read_pdf_list_from_txt(self, file_path):
-        """
-        Read a list of PDFs from a .txt file (with the format ['input1.pdf', 'input2.pdf', ...]).
-        """
-        with open(file_path, 'r') as file:
-            pdf_list_str = file.read().strip()
-        try:
-            pdf_list = ast.literal_eval(pdf_list_str)  # Safe evaluation of the string into a list
-            if not isinstance(pdf_list, list):
-                raise ValueError("The file content is not a valid list.")
-        except (SyntaxError, ValueError) as e:
-            logging.error(f"Error reading the list from the file: {e}")
-            pdf_list = []
-        return pdf_list
-
-    def on_start_button_click(self):
-        # Set default values for PDF list and output folder
-        input_pdfs = self.read_pdf_list_from_txt("output.txt")  # Default PDF list file
-        output_folder = "output_images"  # Default output folder
-        
-        # Get the color input (target color)
-        color_input = self.color_entry.get().strip()
-        
-        try:
-            # If the input starts with "#" it's HEX, otherwise it's assumed to be RGB
-            if color_input.startswith('#'):
-                target_color = self.hex_to_rgb(color_input)
-            else:
-                # Default to RGB input format
-                target_color = tuple(map(int, color_input.split(',')))
-        except ValueError as e:
-            messagebox.showerror("Error", f"Invalid color input: {e}")
-            return
-        
-        # Get the replacement color input
-        replacement_color_input = self.replacement_color_entry.get().strip()
-        try:
-            # If the input starts with "#" it's HEX, otherwise it's assumed to be RGB
-            if replacement_color_input.startswith('#'):
-                replacement_color = self.hex_to_rgb(replacement_color_input)
-            else:
-                # Default to RGB input format
-                replacement_color = tuple(map(int, replacement_color_input.split(',')))
-        except ValueError as e:
-            messagebox.showerror("Error", f"Invalid replacement color input: {e}")
-            return
-        
-        # Get the tolerance value
-        try:
-            tolerance = int(self.tolerance_entry.get())
-        except ValueError:
-            messagebox.showerror("Error", "Invalid tolerance value.")
-            return
-        
-        if input_pdfs:
-            # Initialize the progress bar with the total number of images (initially unknown)
-            self.progress_bar['value'] = 0
-            self.progress_bar['maximum'] = 100  # Start with a percentage-based bar
-            
-            logging.info("Starting PDF processing for multiple files...")
-            total_images = self.process_multiple_pdfs(input_pdfs, output_folder, target_color, replacement_color, tolerance, self.progress_bar)
-
-
-            # Set process_done to True after all PDFs are processed
-            self.process_done = True
-            
-
-            self.progress_bar['maximum'] = total_images  # Update to the total number of pages
-            self.root.destroy()  # Quit the application after completion
-            
-        else:
-            messagebox.showerror("Error", "No valid PDF files found to process.")
-
-    def open(self):
-        """
-        Open the main application UI.
-        """
-        self.root.mainloop()
-
-def run():
-    root = tk.Tk()
-    app = BetterInpage(root)
-    app.open()
-    return app 
-
-if __name__ == "__main__":
-    run()
+import logging
+import os
+import ast
+import queue
+import threading
+import fitz  # PyMuPDF, used to fingerprint pages for the cache
+import renderer  # Render backends (PyMuPDF / poppler)
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import profiler  # Per-page trace timeline when WMREM_PROFILE is set
+from PIL import Image
+import numpy as np
+from tqdm import tqdm
+import tkinter as tk
+from tkinter import messagebox
+from tkinter import ttk  # Import ttk for the progress bar
+from page_cache import PageCache, page_fingerprint, cache_key
+import scan_pages  # Fast path for scanned PDFs: clean the scans inside the PDF
+import watermark_detect  # Finds the watermark regions, so only those are cleaned
+import page_spool  # Uncompressed pages in one memory-mapped file, instead of JPEGs
+import kernels  # Mask and fill kernels: NumPy, numexpr or Numba
+import color_detect  # Guesses the watermark color from a few pages
+
+
+# Configure the logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Bump this when the cleaning output changes, so old pages in the cache are not used anymore
+ENGINE_VERSION = "betterinpage-1"
+
+def hex_to_rgb(hex_color):
+    """
+    Convert HEX color code (e.g., #RRGGBB) to RGB tuple (R, G, B).
+    """
+    if hex_color.startswith('#'):
+        hex_color = hex_color[1:]
+    
+    if len(hex_color) == 6:
+        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    else:
+        raise ValueError(f"Invalid HEX color code: {hex_color}")
+
+
+def parse_color(color_input):
+    """
+    Parse a color typed by the user, either HEX (#RRGGBB) or RGB (R,G,B).
+    """
+    color_input = color_input.strip()
+    if color_input.startswith('#'):
+        return hex_to_rgb(color_input)
+    return tuple(map(int, color_input.split(',')))
+
+
+def to_gray(color):
+    """
+    Convert an RGB color to its gray level, with the same weights PIL uses for "L" images.
+    """
+    r, g, b = color
+    return (r * 299 + g * 587 + b * 114) // 1000
+
+
+def replace_gray(image, target_color, replacement_color, tolerance=50, boxes=None):
+    """
+    Grayscale version of replace_color, for single channel ("L") images.
+    The colors are still RGB, they are turned into gray levels first.
+    """
+    data = np.array(image)
+    target = to_gray(target_color)
+    areas = [data[rows, cols] for rows, cols in watermark_detect.box_slices(boxes, image.width, image.height)]
+    backend = kernels.get_backend()
+    
+    # One channel, so one comparison per pixel instead of three
+    with metrics.stage("mask", pages=1, bytes_in=sum(area.nbytes for area in areas)):
+        masks = [backend.mask(area, max(0, target - tolerance), min(255, target + tolerance)) for area in areas]
+    with metrics.stage("fill", pages=1):
+        for area, mask in zip(areas, masks):
+            backend.fill(area, mask, to_gray(replacement_color))
+    
+    logging.info(f"Color replacement completed for grayscale image with target gray level {target}.")
+    return Image.fromarray(data)
+
+
+def replace_color(image, target_color, replacement_color, tolerance=50, boxes=None):
+    """
+    Replace a specific color in the image with the replacement color, given a tolerance range.
+    Optimized to speed up the process using vectorized NumPy operations.
+    Grayscale ("L") images stay grayscale.
+    With boxes (fractions of the page, see watermark_detect) only the inside of the boxes is cleaned.
+    """
+    logging.info("Starting color replacement process.")
+    
+    if image.mode == "L":
+        return replace_gray(image, target_color, replacement_color, tolerance, boxes)
+    
+    # Convert the image to RGBA format
+    img = image.convert("RGBA")
+    data = np.array(img)
+    areas = [data[rows, cols] for rows, cols in watermark_detect.box_slices(boxes, image.width, image.height)]  # Views, not copies
+    backend = kernels.get_backend()  # NumPy, numexpr or Numba, whichever is fastest here
+    
+    # Create bounds for the target color based on tolerance
+    lower_bound = [max(0, c - tolerance) for c in target_color]
+    upper_bound = [min(255, c + tolerance) for c in target_color]
+    
+    # Mask of the pixels in the target color range (the RGB channels, not alpha)
+    with metrics.stage("mask", pages=1, bytes_in=sum(area.nbytes for area in areas)):
+        masks = [backend.mask(area, lower_bound, upper_bound) for area in areas]
+    
+    # Replace matched pixels with the replacement color (e.g., white)
+    with metrics.stage("fill", pages=1):
+        for area, mask in zip(areas, masks):
+            backend.fill(area, mask, tuple(replacement_color) + (255,))  # Set alpha to fully opaque
+    
+    image_with_replacement = Image.fromarray(data)
+    logging.info(f"Color replacement completed for image with target color {target_color}.")
+    return image_with_replacement
+
+
+def convert_pdf_to_jpg(input_pdf_path, dpi, grayscale=False):
+    """
+    Convert a PDF to images.
+    Optimized by reducing DPI (less resolution = faster conversion).
+    """
+    images = renderer.render_pages(input_pdf_path, dpi, grayscale=grayscale)  # Reduced DPI to speed up conversion
+    logging.info(f"{len(images)} pages of {input_pdf_path} converted to images.")
+    return images
+
+
+def save_image(image, output_folder, image_counter):
+    """
+    Save the processed image as a JPG file.
+    """
+    if image.mode != "L":
+        image = image.convert("RGB")  # Convert RGBA to RGB (removes alpha channel), grayscale stays grayscale
+    output_image_path = os.path.join(output_folder, f"image_{image_counter}.jpg")  # Unique filename
+    with metrics.stage("encode", pages=1, bytes_in=metrics.image_bytes(image)) as measurement:
+        image.save(output_image_path, "JPEG")
+        measurement["bytes_out"] = os.path.getsize(output_image_path)
+    logging.info(f"Processed image {image_counter} saved to {output_image_path}")
+    return output_image_path
+
+
+def convert_pages_to_jpg(input_pdf_path, dpi, page_numbers, grayscale=False):
+    """
+    Convert only some pages (0-based page numbers) of a PDF to images.
+    Pages next to each other are converted in one go. Returns {page_number: image}.
+    """
+    images = {}
+    runs = []
+    for page_num in sorted(page_numbers):
+        if runs and runs[-1][1] == page_num - 1:
+            runs[-1][1] = page_num
+        else:
+            runs.append([page_num, page_num])
+
+    for first, last in runs:
+        converted = renderer.render_pages(input_pdf_path, dpi, first + 1, last + 1, grayscale=grayscale)
+        for offset, image in enumerate(converted):
+            images[first + offset] = image
+    return images
+
+
+class Cancelled(Exception):
+    """
+    Raised by clean_pdf when the user cancelled the job.
+    """
+
+
+def clean_pdf(input_pdf_path, output_folder, target_color=(0, 0, 0), replacement_color=(255, 255, 255), tolerance=50, dpi=150, total_images=0, progress_callback=None, cache=None, grayscale=False, cancel_event=None, boxes=None, spool=None):
+    """
+    Headless version of the cleaning step: convert one PDF to images, replace the color and
+    save the pages as image_<n>.jpg, numbered from total_images on.
+    progress_callback(image_counter, total_images) is called after every page.
+    With a PageCache, pages that were cleaned before with the same settings are copied from
+    the cache and never rendered.
+    With grayscale=True pages are rendered, cleaned and saved single channel.
+    dpi can also be "auto" (or "auto:<DPI>"), every page is then rendered at the resolution of
+    its scan, see renderer.parse_dpi.
+    With boxes (from watermark_detect.detect_watermark_boxes) only those parts of the pages are cleaned.
+    With a page_spool.PageSpool the pages are added to the spool uncompressed instead of being
+    saved as JPEGs (the page cache still gets a JPEG of every new page).
+    When cancel_event (a threading.Event) is set, Cancelled is raised before the next page,
+    the pages saved so far stay in output_folder.
+    Returns the new total image count.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    if cache is None:
+        images = convert_pdf_to_jpg(input_pdf_path, dpi, grayscale)  # Pass DPI to the conversion function
+        keys = [None] * len(images)
+    else:
+        doc = fitz.open(input_pdf_path)
+        hashes = {}  # Objects already hashed, fonts and images are shared by pages
+        with metrics.stage("hash", pages=len(doc)):
+            keys = [
+                cache_key(page_fingerprint(doc, page_num, hashes), engine=ENGINE_VERSION, dpi=dpi, target_color=target_color,
+                          replacement_color=replacement_color, tolerance=tolerance, grayscale=grayscale, boxes=boxes)
+                for page_num in range(len(doc))
+            ]
+        doc.close()
+        # Only convert the pages the cache doesn't have. The cached ones are copied one at a
+        # time below, a page evicted by another worker in the meantime is converted then
+        images = convert_pages_to_jpg(input_pdf_path, dpi, [n for n, key in enumerate(keys) if not cache.contains(key)], grayscale)
+
+    image_counter = total_images  # Start from the passed counter for global image tracking
+    total_images += len(keys)  # Update total image count
+
+    for page_num in tqdm(range(len(keys)), desc="Processing Pages", unit="page"):
+        with profiler.page(f"{os.path.basename(input_pdf_path)}#{page_num + 1}"):
+            if cancel_event is not None and cancel_event.is_set():
+                raise Cancelled(f"Cancelled at page {page_num + 1} of {input_pdf_path}")
+
+            cached_image_path = os.path.join(output_folder, f"image_{image_counter}.jpg")
+            if cache is not None and cache.copy_to(keys[page_num], cached_image_path):
+                if spool is not None:
+                    with Image.open(cached_image_path) as cached_image:
+                        spool.append(cached_image)
+                    os.remove(cached_image_path)  # Only copied to be read into the spool
+                    logging.info(f"Page {page_num + 1} taken from the cache as spool page {image_counter}")
+                else:
+                    logging.info(f"Page {page_num + 1} taken from the cache as image {image_counter}")
+            else:
+                if cache is not None and page_num not in images:  # Evicted after it was planned as a cache hit
+                    images.update(convert_pages_to_jpg(input_pdf_path, dpi, [page_num], grayscale))
+                image_with_replaced_color = replace_color(images[page_num], target_color, replacement_color, tolerance, boxes)
+                if spool is not None:
+                    with metrics.stage("spool", pages=1, bytes_in=metrics.image_bytes(image_with_replaced_color)):
+                        spool.append(image_with_replaced_color)
+                    if cache is not None:
+                        cache_image_path = save_image(image_with_replaced_color, output_folder, image_counter)
+                        cache.store(keys[page_num], cache_image_path)
+                        os.remove(cache_image_path)  # The page is in the spool, the JPEG was only for the cache
+                else:
+                    output_image_path = save_image(image_with_replaced_color, output_folder, image_counter)
+                    if cache is not None:
+                        cache.store(keys[page_num], output_image_path)
+            image_counter += 1
+
+            if progress_callback:
+                progress_callback(image_counter, total_images)
+
+    if cache is not None:
+        cache.log_stats()
+
+    return total_images
+
+
+def scan_cleaner(target_color=(0, 0, 0), replacement_color=(255, 255, 255), tolerance=50, grayscale=False, cancel_event=None, boxes=None):
+    """
+    The clean_image function of the scanned PDF fast path (see scan_pages.py).
+    """
+    def clean_image(image):
+        if cancel_event is not None and cancel_event.is_set():
+            raise Cancelled("Cancelled while cleaning the scans")
+        if grayscale and image.mode != "L":
+            image = image.convert("L")
+        return replace_color(image, target_color, replacement_color, tolerance, boxes)
+
+    return clean_image
+
+
+def clean_scanned_pdf(input_pdf_path, output_pdf_path, target_color=(0, 0, 0), replacement_color=(255, 255, 255), tolerance=50, dpi=150, progress_callback=None, grayscale=False, cancel_event=None, boxes=None):
+    """
+    Fast path for scanned PDFs (see scan_pages.py): replace the color in the scans inside the
+    PDF and write the cleaned PDF directly, without rendering pages or building the PDF from
+    images. Pages that are not a plain scan are rendered at dpi.
+    Returns (pages cleaned in place, pages rendered).
+    """
+    clean_image = scan_cleaner(target_color, replacement_color, tolerance, grayscale, cancel_event, boxes)
+    return scan_pages.clean_in_place(input_pdf_path, output_pdf_path, clean_image, dpi, progress_callback)
+
+
+def clean_scanned_pages(input_pdf_path, first, last, target_color=(0, 0, 0), replacement_color=(255, 255, 255), tolerance=50, dpi=150, grayscale=False, boxes=None):
+    """
+    clean_scanned_pdf for the pages first..last-1 of the PDF only, in a pool worker: returns the
+    cleaned pages for scan_pages.apply_pages, which writes the PDF in the parent.
+    """
+    clean_image = scan_cleaner(target_color, replacement_color, tolerance, grayscale, boxes=boxes)
+    return scan_pages.clean_pages(input_pdf_path, first, last, clean_image, dpi)
+
+
+class BetterInpage:
+    def __init__(self, root, list_file="output.txt", output_folder="output_images", spool_path=page_spool.DEFAULT_PATH):
+        self.root = root
+        # Where the split PDFs are listed and where the cleaned pages go (the job's workspace from main.py)
+        self.list_file = list_file
+        self.output_folder = output_folder
+        self.spool_file = spool_path
+        root.title("Watermark remover tool")
+        # Set window size to make it larger
+        root.geometry("500x920")  # Width x Height
+
+        # Variable to track process completion
+        self.process_done = False
+        self.cancelled = False
+
+        # The cleaning runs in a worker thread, it talks to the UI only through this queue
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.worker = None
+
+        # Values read from the UI when processing starts (the worker thread can't touch Tk)
+        self.dpi = 150
+        self.grayscale = False
+        self.detect_region = False
+        self.boxes = None  # Watermark regions, when the user asked to find them
+        self.use_spool = False
+        self.spool = None
+        self.spool_path = None  # Set when the pages went to a page spool instead of output_images
+
+        # Page cache, created when processing starts if the user enabled it
+        self.page_cache = None
+
+        # Create UI elements
+        self.create_widgets()
+
+    def create_widgets(self):
+        # Color input instructions (Target Color)
+        tk.Label(self.root, text="Enter Watermark Color (HEX or RGB):", font=("Arial", 12)).pack(pady=10)
+        self.color_entry = tk.Entry(self.root, width=20, font=("Arial", 14))
+        self.color_entry.insert(0, "#000000")  # Default HEX value (black)
+        self.color_entry.pack(pady=5)
+
+        # Fill in the color and tolerance from a few pages rendered at a low DPI
+        tk.Button(self.root, text="Detect color", font=("Arial", 10), command=self.on_detect_color_click).pack(pady=2)
+
+        # Replacement color input instructions
+        tk.Label(self.root, text="Enter Replacement Color (HEX or RGB):", font=("Arial", 12)).pack(pady=10)
+        self.replacement_color_entry = tk.Entry(self.root, width=20, font=("Arial", 14))
+        self.replacement_color_entry.insert(0, "#FFFFFF")  # Default HEX value (white)
+        self.replacement_color_entry.pack(pady=5)
+
+        # Input for the tolerance
+        tk.Label(self.root, text="Tolerance:", font=("Arial", 12)).pack(pady=10)
+        self.tolerance_entry = tk.Entry(self.root, width=10, font=("Arial", 14))
+        self.tolerance_entry.insert(0, "50")
+        self.tolerance_entry.pack(pady=10)
+
+        # DPI input field
+        tk.Label(self.root, text="Enter DPI for PDF Conversion (auto = resolution of the scans):", font=("Arial", 12)).pack(pady=10)
+        self.dpi_entry = tk.Entry(self.root, width=10, font=("Arial", 14))
+        self.dpi_entry.insert(0, "150")  # Default DPI value
+        self.dpi_entry.pack(pady=5)
+
+        # Grayscale mode, for black & white scans (less memory, smaller output)
+        self.grayscale_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.root, text="Grayscale mode (for black & white documents)", variable=self.grayscale_var, font=("Arial", 10)).pack(pady=5)
+
+        # Find where the watermark is first and clean only there (faster, and text of the same color elsewhere is kept)
+        self.detect_region_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.root, text="Clean only where the watermark is (auto-detect)", variable=self.detect_region_var, font=("Arial", 10)).pack(pady=5)
+
+        # Keep the pages uncompressed until the PDF is built: they are compressed once instead of three times
+        self.use_spool_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.root, text="Raw page spool (better quality, needs ~6 MB of disk per page)", variable=self.use_spool_var, font=("Arial", 10)).pack(pady=5)
+
+        # Reuse pages that were already cleaned with the same settings
+        self.use_cache_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(self.root, text="Use page cache (faster for new versions of the same PDF)", variable=self.use_cache_var, font=("Arial", 10)).pack(pady=5)
+
+        # Add a progress bar to the window(root)
+        self.progress_bar = ttk.Progressbar(self.root, length=400, mode="determinate")
+        self.progress_bar.pack(pady=20)
+
+        # Status of the running job
+        self.status_label = tk.Label(self.root, text="", font=("Arial", 12), wraplength=450)
+        self.status_label.pack(pady=5)
+
+        # Start button
+        self.start_button = tk.Button(self.root, text="Start Processing", font=("Arial", 14), command=self.on_start_button_click)
+        self.start_button.pack(pady=20)
+
+        # A few pages cleaned at a low DPI, before/after on one image, to check the settings first
+        self.preview_button = tk.Button(self.root, text="Preview", font=("Arial", 12), command=self.on_preview_button_click)
+        self.preview_button.pack(pady=5)
+
+        # Cancel button, keeps the pages cleaned so far
+        self.cancel_button = tk.Button(self.root, text="Cancel", font=("Arial", 14), command=self.on_cancel_button_click, state="disabled")
+        self.cancel_button.pack(pady=5)
+
+        # Closing the window while processing cancels the job
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_detect_color_click(self):
+        """
+        Analyze a few pages and put the most likely watermark color and its tolerance in the fields.
+        """
+        try:
+            input_pdfs = self.read_pdf_list_from_txt(self.list_file)
+            if not input_pdfs:
+                messagebox.showerror("Error", "No valid PDF files found to analyze.")
+                return
+            self.status_label.config(text="Detecting the watermark color...")
+            self.root.update_idletasks()
+            candidates = color_detect.detect_colors(input_pdfs)
+        except Exception as e:
+            messagebox.showerror("Error", f"Color detection failed: {e}")
+            self.status_label.config(text="")
+            return
+
+        if candidates:
+            self.color_entry.delete(0, tk.END)
+            self.color_entry.insert(0, color_detect.to_hex(candidates[0]["color"]))
+            self.tolerance_entry.delete(0, tk.END)
+            self.tolerance_entry.insert(0, str(candidates[0]["tolerance"]))
+        self.status_label.config(text=color_detect.describe(candidates))
+
+    def hex_to_rgb(self, hex_color):
+        """
+        Convert HEX color code (e.g., #RRGGBB) to RGB tuple (R, G, B).
+        """
+        return hex_to_rgb(hex_color)
+
+    def replace_color(self, image, target_color, replacement_color, tolerance=50):
+        """
+        Replace a specific color in the image with the replacement color, given a tolerance range.
+        """
+        return replace_color(image, target_color, replacement_color, tolerance)
+
+    def convert_pdf_to_jpg(self, input_pdf_path, dpi):
+        """
+        Convert a PDF to JPG images.
+        """
+        return convert_pdf_to_jpg(input_pdf_path, dpi, self.grayscale)
+
+    def save_image(self, image, output_folder, image_counter):
+        """
+        Save the processed image as a JPG file.
+        """
+        save_image(image, output_folder, image_counter)
+
+    def process_pdf(self, input_pdf_path, output_folder, target_color=(0, 0, 0), replacement_color=(255, 255, 255), tolerance=50, progress_bar=None, total_images=None):
+        """
+        Full process: Convert PDF to JPGs, replace color, and save the images in the output folder.
+        Runs in the worker thread, progress goes to the UI through the events queue.
+        """
+        def update_progress(image_counter, total):
+            if progress_bar:
+                self.events.put(("progress", (image_counter / total) * 100))
+
+        return clean_pdf(input_pdf_path, output_folder, target_color, replacement_color, tolerance, self.dpi, total_images, update_progress,
+                         self.page_cache, self.grayscale, self.cancel_event, self.boxes, self.spool)
+
+
+    def process_multiple_pdfs(self, input_pdf_paths, output_folder, target_color=(0, 0, 0), replacement_color=(255, 255, 255), tolerance=50, progress_bar=None):
+        """
+        Process multiple PDF files and save the output images in the specified output folder.
+        """
+        # Ensure the output folder exists
+        os.makedirs(output_folder, exist_ok=True)
+
+        self.spool = None
+        if self.use_spool:
+            capacity = sum(renderer.page_count(input_pdf_path) for input_pdf_path in input_pdf_paths)
+            self.spool = page_spool.PageSpool.create(self.spool_file, capacity)
+            self.spool_path = self.spool_file
+
+        total_images = 0  # Total image counter across all PDFs
+        try:
+            for input_pdf_path in input_pdf_paths:
+                logging.info(f"Processing PDF: {input_pdf_path}")
+                total_images = self.process_pdf(input_pdf_path, output_folder, target_color, replacement_color, tolerance, progress_bar, total_images)
+        finally:
+            if self.spool is not None:
+                self.spool.close()
+
+        return total_images
+
+    def read_pdf_list_from_txt(self, file_path):
+        """
+        Read a list of PDFs from a .txt file (with the format ['input1.pdf', 'input2.pdf', ...]).
+        """
+        with open(file_path, 'r') as file:
+            pdf_list_str = file.read().strip()
+        try:
+            pdf_list = ast.literal_eval(pdf_list_str)  # Safe evaluation of the string into a list
+            if not isinstance(pdf_list, list):
+                raise ValueError("The file content is not a valid list.")
+        except (SyntaxError, ValueError) as e:
+            logging.error(f"Error reading the list from the file: {e}")
+            pdf_list = []
+        return pdf_list
+
+    def on_preview_button_click(self):
+        """
+        Clean the first, last and a few random pages at a low DPI with the current settings, and
+        open the before/after contact sheet.
+        """
+        import preview  # preview.py imports this module
+        try:
+            input_pdfs = self.read_pdf_list_from_txt(self.list_file)
+            if not input_pdfs:
+                messagebox.showerror("Error", "No valid PDF files found to preview.")
+                return
+            target_color = parse_color(self.color_entry.get())
+            replacement_color = parse_color(self.replacement_color_entry.get())
+            tolerance = int(self.tolerance_entry.get())
+            dpi = renderer.parse_dpi(self.dpi_entry.get())
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid setting: {e}")
+            return
+        # Lower than the full run, unless the full run is lower already
+        dpi = min(dpi, preview.PREVIEW_DPI) if isinstance(dpi, int) else preview.PREVIEW_DPI
+
+        self.status_label.config(text="Making the preview...")
+        self.root.update_idletasks()
+        sheet_path = os.path.join(os.path.dirname(os.path.abspath(self.output_folder)), "preview.png")
+        try:
+            boxes = None
+            if self.detect_region_var.get():
+                boxes = watermark_detect.detect_watermark_boxes(input_pdfs, target_color, tolerance)
+            pages = preview.preview(input_pdfs, sheet_path, target_color, replacement_color, tolerance, dpi, self.grayscale_var.get(), boxes)
+        except Exception as e:
+            messagebox.showerror("Error", f"Preview failed: {e}")
+            self.status_label.config(text="")
+            return
+        self.status_label.config(text=f"Preview of pages {', '.join(map(str, pages))}: {sheet_path}")
+        Image.open(sheet_path).show()
+
+    def on_start_button_click(self):
+        input_pdfs = self.read_pdf_list_from_txt(self.list_file)
+        output_folder = self.output_folder
+        
+        # Get the color input (target color), HEX if it starts with "#", RGB otherwise
+        try:
+            target_color = parse_color(self.color_entry.get())
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid color input: {e}")
+            return
+        
+        # Get the replacement color input
+        try:
+            replacement_color = parse_color(self.replacement_color_entry.get())
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid replacement color input: {e}")
+            return
+        
+        # Get the tolerance value
+        try:
+            tolerance = int(self.tolerance_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Invalid tolerance value.")
+            return
+        
+        # Get the DPI value, a number or "auto" (native resolution of scanned pages)
+        try:
+            self.dpi = renderer.parse_dpi(self.dpi_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Invalid DPI value.")
+            return
+        self.grayscale = self.grayscale_var.get()
+        self.detect_region = self.detect_region_var.get()
+        self.use_spool = self.use_spool_var.get()
+        
+        if input_pdfs:
+            # Initialize the progress bar with the total number of images (initially unknown)
+            self.progress_bar['value'] = 0
+            self.progress_bar['maximum'] = 100  # Start with a percentage-based bar
+            
+            if self.use_cache_var.get():
+                self.page_cache = PageCache()
+
+            self.start_button.config(state="disabled")
+            self.cancel_button.config(state="normal")
+            self.status_label.config(text="Processing...")
+
+            # Run the cleaning in the background so the window stays responsive
+            logging.info("Starting PDF processing for multiple files...")
+            self.worker = threading.Thread(
+                target=self.run_worker,
+                args=(input_pdfs, output_folder, target_color, replacement_color, tolerance),
+                daemon=True,
+            )
+            self.worker.start()
+            self.root.after(100, self.poll_events)
+            
+        else:
+            messagebox.showerror("Error", "No valid PDF files found to process.")
+
+    def run_worker(self, input_pdfs, output_folder, target_color, replacement_color, tolerance):
+        """
+        Worker thread: process all PDFs and report the outcome through the events queue.
+        """
+        try:
+            self.boxes = None
+            if self.detect_region:
+                self.events.put(("status", "Finding the watermark..."))
+                self.boxes = watermark_detect.detect_watermark_boxes(input_pdfs, target_color, tolerance)
+                self.events.put(("status", "Processing..." if self.boxes else "No watermark region found, cleaning whole pages..."))
+            total_images = self.process_multiple_pdfs(input_pdfs, output_folder, target_color, replacement_color, tolerance, self.progress_bar)
+            self.events.put(("done", total_images))
+        except Cancelled as e:
+            logging.info(str(e))
+            self.events.put(("cancelled", None))
+        except Exception as e:
+            logging.error(f"Processing failed: {e}")
+            self.events.put(("error", str(e)))
+
+    def poll_events(self):
+        """
+        Runs in the Tk loop: apply what the worker thread reported since the last poll.
+        """
+        try:
+            while True:
+                kind, value = self.events.get_nowait()
+                if kind == "progress":
+                    self.progress_bar['value'] = value
+                elif kind == "status":
+                    self.status_label.config(text=value)
+                elif kind == "done":
+                    # Set process_done to True after all PDFs are processed
+                    self.process_done = True
+                    self.progress_bar['maximum'] = value  # Update to the total number of pages
+                    self.root.destroy()  # Quit the application after completion
+                    return
+                elif kind == "cancelled":
+                    self.cancelled = True
+                    self.root.destroy()
+                    return
+                elif kind == "error":
+                    messagebox.showerror("Error", f"Processing failed: {value}")
+                    self.start_button.config(state="normal")
+                    self.cancel_button.config(state="disabled")
+                    self.status_label.config(text="")
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_events)
+
+    def on_cancel_button_click(self):
+        """
+        Ask the worker to stop after the page it is working on.
+        """
+        self.cancel_event.set()
+        self.cancel_button.config(state="disabled")
+        self.status_label.config(text="Cancelling after the current page...")
+
+    def on_close(self):
+        if self.worker is not None and self.worker.is_alive():
+            self.on_cancel_button_click()  # The window closes once the worker stopped
+        else:
+            self.root.destroy()
+
+    def open(self):
+        """
+        Open the main application UI.
+        """
+        self.root.mainloop()
+
+def run(list_file="output.txt", output_folder="output_images", spool_path=page_spool.DEFAULT_PATH):
+    root = tk.Tk()
+    app = BetterInpage(root, list_file, output_folder, spool_path)
+    app.open()
+    return app 
+
+if __name__ == "__main__":
+    run()
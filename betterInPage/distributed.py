@@ -0,0 +1,380 @@
+"""
+Distributed mode: a shared directory is used as the work queue, so any machine that can
+see the directory (NFS, SMB, ...) can run workers.
+
+Layout of the shared directory:
+    job.json                      cleaning parameters (colors, tolerance, dpi, grayscale)
+    temp_cut/inputN.pdf           the page ranges made by the splitter, one per shard
+    queue/shard_NNNNN.json        shards waiting for a worker
+    claimed/shard_NNNNN.<worker>.json
+                                  shards a worker is busy with (mtime = last heartbeat)
+    results/shard_NNNNN/          cleaned pages of a finished shard (image_0.jpg, ...)
+    done/shard_NNNNN.json         shards that are finished
+    failed/shard_NNNNN.json       shards that raised an error MAX_ATTEMPTS times (`retry` queues them again)
+
+A worker claims a shard by renaming it from queue/ to claimed/, renames are atomic so two
+workers can never get the same shard. The claim file carries the worker's name: a worker that
+was too slow (its shard was requeued and claimed by another one) sees its claim is gone and
+drops its work, it never touches the new owner's claim.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import splitter  # Assuming splitter.py is in the same directory
+import betterinpage  # Assuming betterinpage.py is in the same directory
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import renderer  # Render backends and DPI settings
+
+
+# Configure the logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+QUEUE_DIRS = ["queue", "claimed", "results", "done", "failed"]
+LEASE_SECONDS = 600  # A claimed shard without heartbeat for this long goes back to the queue
+MAX_ATTEMPTS = 3  # A shard that fails goes back to the queue until it failed this many times
+
+
+def shard_name(index):
+    return f"shard_{index:05d}.json"
+
+
+def claimed_path(shared_dir, shard):
+    """
+    The claim file of a shard, it names the worker that holds it.
+    """
+    return os.path.join(shared_dir, "claimed", f"shard_{shard['index']:05d}.{shard['worker']}.json")
+
+
+def queue_shard(shared_dir, shard):
+    """
+    Put a shard in the queue. Written to a temporary name first so a worker never sees a half
+    written shard.
+    """
+    name = shard_name(shard["index"])
+    tmp_path = os.path.join(shared_dir, "queue", name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as shard_file:
+        json.dump(shard, shard_file)
+    os.rename(tmp_path, os.path.join(shared_dir, "queue", name))
+
+
+def submit(input_pdf, shared_dir, target_color=(0, 0, 0), replacement_color=(255, 255, 255), tolerance=50, dpi=150, pages_per_split=None, workers=None, grayscale=False):
+    """
+    Coordinator: split the PDF into shards and put them in the queue.
+    """
+    for folder in QUEUE_DIRS:
+        os.makedirs(os.path.join(shared_dir, folder), exist_ok=True)
+
+    # Save the cleaning parameters so every worker uses the same ones
+    job = {
+        "input_pdf": os.path.abspath(input_pdf),
+        "target_color": list(target_color),
+        "replacement_color": list(replacement_color),
+        "tolerance": tolerance,
+        "dpi": dpi,
+        "grayscale": grayscale,
+    }
+    with open(os.path.join(shared_dir, "job.json"), "w", encoding="utf-8") as job_file:
+        json.dump(job, job_file, indent=2)
+
+    # The splitter output is the list of shards
+    temp_cut_folder = os.path.join(shared_dir, "temp_cut")
+    output_files, _ = splitter.split_pdf_file(input_pdf, temp_cut_folder, pages_per_split, workers)
+
+    for index, split_pdf in enumerate(output_files, start=1):
+        queue_shard(shared_dir, {"index": index, "pdf": os.path.relpath(split_pdf, shared_dir)})
+
+    logging.info(f"Submitted {len(output_files)} shards to {shared_dir}")
+    return len(output_files)
+
+
+def claim_shard(shared_dir, worker_id):
+    """
+    Try to claim the next shard in the queue. Returns the shard dict or None if the queue is empty.
+    """
+    queue_dir = os.path.join(shared_dir, "queue")
+    for name in sorted(os.listdir(queue_dir)):
+        if not name.endswith(".json"):
+            continue
+        path = claimed_path(shared_dir, {"index": int(name[len("shard_"):-len(".json")]), "worker": worker_id})
+        try:
+            os.rename(os.path.join(queue_dir, name), path)
+        except (FileNotFoundError, OSError):
+            continue  # Another worker was faster
+
+        if os.path.exists(os.path.join(shared_dir, "done", name)):
+            # Requeued, but its first worker finished it after all
+            os.remove(path)
+            continue
+
+        with open(path, "r", encoding="utf-8") as shard_file:
+            shard = json.load(shard_file)
+        shard["worker"] = worker_id
+        shard["claimed_at"] = time.time()
+        with open(path, "w", encoding="utf-8") as shard_file:
+            json.dump(shard, shard_file)
+        return shard
+
+    return None
+
+
+def heartbeat(shared_dir, shard):
+    """
+    Tell the coordinator the worker is still busy with this shard.
+    """
+    try:
+        os.utime(claimed_path(shared_dir, shard))
+    except FileNotFoundError:
+        pass  # The shard was requeued, process_shard drops the work at the end
+
+
+def process_shard(shared_dir, shard, job):
+    """
+    Run the cleaning engine on one shard and publish its pages in results/.
+    Returns False when the shard was requeued meanwhile (lease expired), nothing is published then.
+    """
+    name = shard_name(shard["index"])
+    final_dir = os.path.join(shared_dir, "results", name[:-len(".json")])
+    work_dir = f"{final_dir}.{shard['worker']}.tmp"
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    started = time.perf_counter()
+    pages = betterinpage.clean_pdf(
+        os.path.join(shared_dir, shard["pdf"]),
+        work_dir,
+        tuple(job["target_color"]),
+        tuple(job["replacement_color"]),
+        job["tolerance"],
+        job["dpi"],
+        0,
+        lambda image_counter, total: heartbeat(shared_dir, shard),
+        grayscale=job.get("grayscale", False),
+    )
+
+    if not os.path.exists(claimed_path(shared_dir, shard)):
+        # The lease expired and the shard went back to the queue, another worker does it
+        logging.warning(f"{shard['worker']} lost {name} (no heartbeat for {LEASE_SECONDS}s), its pages are dropped")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return False
+
+    # Publish the results, if another worker already did this shard keep theirs
+    try:
+        os.rename(work_dir, final_dir)
+    except OSError:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    shard["pages"] = pages
+    shard["seconds"] = time.perf_counter() - started
+    with open(os.path.join(shared_dir, "done", name), "w", encoding="utf-8") as shard_file:
+        json.dump(shard, shard_file)
+    try:
+        os.remove(claimed_path(shared_dir, shard))
+    except FileNotFoundError:
+        pass
+
+    logging.info(f"{shard['worker']} finished {name}: {pages} pages in {shard['seconds']:.1f}s")
+    return True
+
+
+def worker(shared_dir, worker_id=None, wait=False, poll_seconds=2.0):
+    """
+    Worker loop: claim shards until the queue is empty.
+    With wait=True the worker keeps polling until every shard is done (or failed).
+    """
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+    with open(os.path.join(shared_dir, "job.json"), "r", encoding="utf-8") as job_file:
+        job = json.load(job_file)
+
+    metrics.start_exporter()
+
+    processed = 0
+    while True:
+        # Every time, waiting or not: the shards of a crashed node go back to the queue
+        requeue_stale(shared_dir)
+        for state, count in status(shared_dir).items():
+            metrics.set_queue_depth(f"shards_{state}", count)
+
+        shard = claim_shard(shared_dir, worker_id)
+        if shard is None:
+            if not wait or is_finished(shared_dir):
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        try:
+            if process_shard(shared_dir, shard, job):
+                processed += 1
+        except Exception as e:
+            logging.error(f"{worker_id} failed on {shard_name(shard['index'])}: {e}")
+            if not os.path.exists(claimed_path(shared_dir, shard)):
+                continue  # Requeued meanwhile, it's another worker's shard now
+            shard["error"] = str(e)
+            shard["attempts"] = shard.get("attempts", 0) + 1
+            if shard["attempts"] < MAX_ATTEMPTS:
+                queue_shard(shared_dir, shard)  # Could be the node (disk full, network...), another try
+            else:
+                with open(os.path.join(shared_dir, "failed", shard_name(shard["index"])), "w", encoding="utf-8") as shard_file:
+                    json.dump(shard, shard_file)
+            try:
+                os.remove(claimed_path(shared_dir, shard))
+            except FileNotFoundError:
+                pass
+
+    logging.info(f"{worker_id} stopped after {processed} shards")
+    metrics.export()
+    return processed
+
+
+def requeue_stale(shared_dir, lease_seconds=LEASE_SECONDS):
+    """
+    Put shards back in the queue when their worker stopped sending heartbeats (crashed node).
+    """
+    claimed_dir = os.path.join(shared_dir, "claimed")
+    requeued = 0
+    for name in os.listdir(claimed_dir):
+        path = os.path.join(claimed_dir, name)
+        try:
+            if time.time() - os.path.getmtime(path) > lease_seconds:
+                os.utime(path)  # A fresh lease for the next worker, the mtime moves with the file
+                queue_name = name.split(".", 1)[0] + ".json"  # Without the worker name
+                os.rename(path, os.path.join(shared_dir, "queue", queue_name))
+                logging.warning(f"Requeued stale shard {name}")
+                requeued += 1
+        except (FileNotFoundError, OSError):
+            continue
+    return requeued
+
+
+def retry(shared_dir):
+    """
+    Put the failed shards back in the queue, with MAX_ATTEMPTS new attempts each.
+    """
+    failed_dir = os.path.join(shared_dir, "failed")
+    retried = 0
+    for name in sorted(os.listdir(failed_dir)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(failed_dir, name), "r", encoding="utf-8") as shard_file:
+            shard = json.load(shard_file)
+        logging.info(f"Retrying {name}, it failed with: {shard.get('error')}")
+        queue_shard(shared_dir, {"index": shard["index"], "pdf": shard["pdf"]})
+        os.remove(os.path.join(failed_dir, name))
+        retried += 1
+    return retried
+
+
+def status(shared_dir):
+    """
+    Count the shards in every state.
+    """
+    counts = {}
+    for folder in ["queue", "claimed", "done", "failed"]:
+        path = os.path.join(shared_dir, folder)
+        counts[folder] = len([n for n in os.listdir(path) if n.endswith(".json")])
+    return counts
+
+
+def is_finished(shared_dir):
+    counts = status(shared_dir)
+    return counts["queue"] == 0 and counts["claimed"] == 0
+
+
+def gather(shared_dir, output_folder="output_images"):
+    """
+    Collect the pages of all shards, in order, into output_folder so pdfer can build the PDF.
+    """
+    counts = status(shared_dir)
+    if counts["queue"] or counts["claimed"] or counts["failed"]:
+        raise RuntimeError(f"Shards are not all done yet: {counts}" + (" (`retry` queues the failed ones again)" if counts["failed"] else ""))
+
+    os.makedirs(output_folder, exist_ok=True)
+
+    image_counter = 0
+    for name in sorted(os.listdir(os.path.join(shared_dir, "done"))):
+        with open(os.path.join(shared_dir, "done", name), "r", encoding="utf-8") as shard_file:
+            shard = json.load(shard_file)
+        result_dir = os.path.join(shared_dir, "results", name[:-len(".json")])
+        for page in range(shard["pages"]):
+            shutil.copyfile(
+                os.path.join(result_dir, f"image_{page}.jpg"),
+                os.path.join(output_folder, f"image_{image_counter}.jpg"),
+            )
+            image_counter += 1
+
+    logging.info(f"Gathered {image_counter} pages into {output_folder}")
+    return image_counter
+
+
+def run_local(shared_dir, processes):
+    """
+    Start several worker processes on this machine (handy for testing the distributed mode).
+    They wait until every shard is done, to pick up the shards of a worker that stopped.
+    """
+    children = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", shared_dir, "--worker-id", f"{socket.gethostname()}-local{i}", "--wait"])
+        for i in range(processes)
+    ]
+    return [child.wait() for child in children]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the watermark remover on several machines through a shared directory.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = commands.add_parser("submit", help="split a PDF and queue its shards")
+    submit_parser.add_argument("input_pdf")
+    submit_parser.add_argument("shared_dir")
+    submit_parser.add_argument("--color", default="#000000", help="watermark color, HEX or R,G,B")
+    submit_parser.add_argument("--replacement", default="#FFFFFF", help="replacement color, HEX or R,G,B")
+    submit_parser.add_argument("--tolerance", type=int, default=50)
+    submit_parser.add_argument("--dpi", type=renderer.parse_dpi, default=150, help='a number, or "auto" for the resolution of the scans')
+    submit_parser.add_argument("--pages-per-split", type=int, default=None)
+    submit_parser.add_argument("--grayscale", action="store_true", help="render, clean and save pages in grayscale")
+
+    worker_parser = commands.add_parser("worker", help="process shards from the queue")
+    worker_parser.add_argument("shared_dir")
+    worker_parser.add_argument("--worker-id", default=None)
+    worker_parser.add_argument("--wait", action="store_true", help="keep polling until all shards are done")
+
+    local_parser = commands.add_parser("local", help="start several workers on this machine")
+    local_parser.add_argument("shared_dir")
+    local_parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+
+    status_parser = commands.add_parser("status", help="show how many shards are in every state")
+    status_parser.add_argument("shared_dir")
+
+    retry_parser = commands.add_parser("retry", help="put the failed shards back in the queue")
+    retry_parser.add_argument("shared_dir")
+
+    gather_parser = commands.add_parser("gather", help="collect the cleaned pages in order")
+    gather_parser.add_argument("shared_dir")
+    gather_parser.add_argument("--output", default="output_images")
+
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        submit(args.input_pdf, args.shared_dir, betterinpage.parse_color(args.color), betterinpage.parse_color(args.replacement),
+               args.tolerance, args.dpi, args.pages_per_split, grayscale=args.grayscale)
+    elif args.command == "worker":
+        worker(args.shared_dir, args.worker_id, args.wait)
+    elif args.command == "local":
+        run_local(args.shared_dir, args.processes)
+    elif args.command == "status":
+        print(status(args.shared_dir))
+    elif args.command == "retry":
+        print(f"{retry(args.shared_dir)} shards queued again")
+    elif args.command == "gather":
+        gather(args.shared_dir, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+Job server: a long running local HTTP server that cleans PDFs without the UI.
+
+The heavy imports (numpy, PyMuPDF, pdf2image...) and the worker processes are started once
+when the server starts, every job after that only pays for its own pages.
+
+    POST /jobs               start a job, body: {"input_pdf": "C:/books/book.pdf", "color": "#C0C0C0",
+                             "replacement": "#FFFFFF", "tolerance": 50, "dpi": 150, "grayscale": false}
+                             "dpi" can also be "auto", pages are then rendered at the resolution of their scan
+                             PDFs where every page is a plain scan are cleaned in place (scan_pages.py),
+                             "fast_scans": false turns that off
+                             the output PDF is written while the job runs ("incremental": false to build
+                             it at the end), "linearize": true rewrites it for fast web view at the end
+                             (needs qpdf)
+                             answers {"id": "..."}
+    GET  /jobs               status of all jobs
+    GET  /jobs/<id>          status of one job, "result" is the path of the cleaned PDF when it's done.
+                             While it runs, "output_pdf" can already be opened: its first
+                             "pages_written" pages are there
+    GET  /jobs/<id>/events   one JSON line every time the status changes, until the job ends
+
+Run it from the betterInPage folder:
+    python job_server.py --port 8765 --workers 4
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import splitter  # Assuming splitter.py is in the same directory
+import betterinpage  # Assuming betterinpage.py is in the same directory
+import pdfer  # Assuming pdfer.py is in the same directory
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import renderer  # Render backends and DPI settings
+import scan_pages  # Fast path for scanned PDFs
+import kernels  # Mask and fill kernels: NumPy, numexpr or Numba
+
+
+# Configure the logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_WORK_ROOT = os.path.abspath("server_jobs")
+FINISHED_STATES = ("done", "failed")
+
+
+def warm_up(kernel_backend=None):
+    """
+    Pool initializer: make sure every worker has the cleaning engine loaded before the first job.
+    kernel_backend is the pixel kernel backend the parent picked (kernels.get_backend().name).
+    """
+    import numpy  # noqa: F401
+    import renderer  # noqa: F401
+    import kernels
+    if kernel_backend:
+        kernels.use_backend(kernel_backend)
+    # Load (or compile) the pixel kernels now, not on the first page
+    kernels.run_kernels(kernels.get_backend(), kernels.sample_page((300, 400)))
+
+
+def clean_shard(pdf_path, output_folder, params):
+    """
+    Runs in a pool worker: clean one split of a job.
+    Returns the number of pages and the worker's metrics for this split.
+    """
+    pages = betterinpage.clean_pdf(
+        pdf_path,
+        output_folder,
+        params["target_color"],
+        params["replacement_color"],
+        params["tolerance"],
+        params["dpi"],
+        0,
+        grayscale=params["grayscale"],
+    )
+    return pages, metrics.snapshot(reset=True)
+
+
+def clean_scan_range(pdf_path, first, last, params):
+    """
+    Runs in a pool worker: clean the scans of the pages first..last-1 of a fully scanned PDF.
+    Returns the cleaned pages (for scan_pages.apply_pages, the PDF is written by the parent)
+    and the worker's metrics.
+    """
+    pages = betterinpage.clean_scanned_pages(
+        pdf_path,
+        first,
+        last,
+        params["target_color"],
+        params["replacement_color"],
+        params["tolerance"],
+        params["dpi"],
+        grayscale=params["grayscale"],
+    )
+    return pages, metrics.snapshot(reset=True)
+
+
+class JobManager:
+    def __init__(self, workers=None, work_root=DEFAULT_WORK_ROOT):
+        self.work_root = work_root
+        os.makedirs(self.work_root, exist_ok=True)
+
+        self.workers = workers or os.cpu_count() or 1
+        # The kernel backend is picked once here, the workers all use the same one
+        self.pool = multiprocessing.Pool(self.workers, initializer=warm_up, initargs=(kernels.pool_backend(),))
+        self.jobs = {}
+        self.pending_shards = 0  # Splits waiting for or running on the pool, all jobs together
+        self.changed = threading.Condition()  # Notified on every status change
+
+    def submit(self, request):
+        """
+        Queue a new job and return its id.
+        """
+        if not isinstance(request, dict):
+            raise ValueError("the body must be a JSON object")
+        params = {
+            "input_pdf": os.path.abspath(request["input_pdf"]),
+            "target_color": betterinpage.parse_color(request.get("color", "#000000")),
+            "replacement_color": betterinpage.parse_color(request.get("replacement", "#FFFFFF")),
+            "tolerance": int(request.get("tolerance", 50)),
+            "dpi": renderer.parse_dpi(request.get("dpi", 150)),
+            "grayscale": bool(request.get("grayscale", False)),
+            "fast_scans": bool(request.get("fast_scans", True)),
+            "incremental": bool(request.get("incremental", True)),
+            "linearize": bool(request.get("linearize", False)),
+        }
+        if not os.path.exists(params["input_pdf"]):
+            raise ValueError(f"File not found: {params['input_pdf']}")
+
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "id": job_id,
+            "input_pdf": params["input_pdf"],
+            "state": "queued",
+            "shards_total": 0,
+            "shards_done": 0,
+            "pages_done": 0,
+            "pages_written": 0,  # Pages already readable in output_pdf
+            "output_pdf": None,
+            "result": None,
+            "error": None,
+            "submitted_at": time.time(),
+            "finished_at": None,
+            "version": 0,  # Goes up on every change, used by /events
+        }
+        with self.changed:
+            self.jobs[job_id] = job
+
+        threading.Thread(target=self.run_job, args=(job_id, params), daemon=True).start()
+        return job_id
+
+    def update(self, job_id, **fields):
+        with self.changed:
+            job = self.jobs[job_id]
+            for key, value in fields.items():
+                if key in ("shards_done", "pages_done"):
+                    job[key] += value  # Counters
+                else:
+                    job[key] = value
+            job["version"] += 1
+            if "state" in fields:
+                metrics.set_queue_depth("job_server_active_jobs", sum(1 for j in self.jobs.values() if j["state"] not in FINISHED_STATES))
+            self.changed.notify_all()
+
+    def shard_done(self, job_id, pages, worker_metrics):
+        metrics.merge(worker_metrics)
+        self.shard_finished()
+        self.update(job_id, shards_done=1, pages_done=pages)
+
+    def shard_finished(self, error=None):
+        """
+        A split left the pool, done or failed (error_callback): the failed job is reported by
+        run_job, here only the queue depth goes down.
+        """
+        with self.changed:
+            self.pending_shards -= 1
+            metrics.set_queue_depth("job_server_shards", self.pending_shards)
+
+    def status(self, job_id):
+        with self.changed:
+            return dict(self.jobs[job_id])
+
+    def run_job(self, job_id, params):
+        """
+        Split the PDF, clean the splits on the pool, then build the PDF.
+        """
+        job_dir = os.path.join(self.work_root, job_id)
+        try:
+            if params["fast_scans"] and scan_pages.is_scanned(params["input_pdf"]):
+                self.run_scanned_job(job_id, params, job_dir)
+                return
+
+            self.update(job_id, state="splitting")
+            split_files, _ = splitter.split_pdf_file(params["input_pdf"], os.path.join(job_dir, "temp_cut"))
+
+            self.update(job_id, state="cleaning", shards_total=len(split_files))
+            with self.changed:
+                self.pending_shards += len(split_files)
+                metrics.set_queue_depth("job_server_shards", self.pending_shards)
+            results = [
+                self.pool.apply_async(
+                    clean_shard,
+                    (split_pdf, os.path.join(job_dir, "shards", f"{index:05d}"), params),
+                    callback=lambda result: self.shard_done(job_id, *result),
+                    error_callback=self.shard_finished,
+                )
+                for index, split_pdf in enumerate(split_files)
+            ]
+            if params["incremental"]:
+                self.write_incrementally(job_id, params, job_dir, results)
+                return
+            page_counts = [result.get()[0] for result in results]
+
+            # Put the pages of all splits in order in one folder, like the UI flow does
+            self.update(job_id, state="assembling")
+            output_folder = os.path.join(job_dir, "output_images")
+            os.makedirs(output_folder, exist_ok=True)
+            image_counter = 0
+            for index, pages in enumerate(page_counts):
+                shard_folder = os.path.join(job_dir, "shards", f"{index:05d}")
+                for page in range(pages):
+                    os.replace(os.path.join(shard_folder, f"image_{page}.jpg"), os.path.join(output_folder, f"image_{image_counter}.jpg"))
+                    image_counter += 1
+
+            pdfer_app = pdfer.run(output_folder, os.path.join(job_dir, "output.pdf"), os.path.join(job_dir, "temp_sticking"))
+            if not pdfer_app.process_done:
+                raise RuntimeError("PDF generation failed, see the log")
+            if params["linearize"]:
+                pdfer.linearize_pdf(pdfer_app.final_pdf_path)
+
+            self.update(job_id, state="done", result=pdfer_app.final_pdf_path, finished_at=time.time())
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {e}")
+            self.update(job_id, state="failed", error=str(e), finished_at=time.time())
+
+    def write_incrementally(self, job_id, params, job_dir, results):
+        """
+        Add the pages of every split to the output PDF as soon as that split and the ones
+        before it are done, so the start of the document is readable long before the end.
+        """
+        output_pdf_path = os.path.join(job_dir, "output.pdf")
+        writer = pdfer.IncrementalPdfWriter(output_pdf_path)
+        self.update(job_id, output_pdf=output_pdf_path)
+        for index, result in enumerate(results):
+            pages = result.get()[0]  # The splits finish in any order, they are written in order
+            shard_folder = os.path.join(job_dir, "shards", f"{index:05d}")
+            for page in range(pages):
+                writer.add_image(os.path.join(shard_folder, f"image_{page}.jpg"))
+            writer.flush()
+            self.update(job_id, pages_written=writer.pages_written)
+
+        self.update(job_id, state="assembling")
+        writer.close(params["linearize"])
+        self.update(job_id, state="done", result=output_pdf_path, finished_at=time.time())
+
+    def run_scanned_job(self, job_id, params, job_dir):
+        """
+        Every page is a plain scan: no split files, no rendering and no PDF building. The page
+        ranges are cleaned on the pool like splits, then the cleaned scans are put back in the
+        PDF here and it is saved once.
+        """
+        os.makedirs(job_dir, exist_ok=True)
+        output_pdf_path = os.path.join(job_dir, "output.pdf")
+        ranges = splitter.page_ranges(params["input_pdf"], workers=self.workers)
+        self.update(job_id, state="cleaning", shards_total=len(ranges))
+        with self.changed:
+            self.pending_shards += len(ranges)
+            metrics.set_queue_depth("job_server_shards", self.pending_shards)
+        results = [
+            self.pool.apply_async(
+                clean_scan_range,
+                (params["input_pdf"], first, last, params),
+                callback=lambda result: self.shard_done(job_id, len(result[0]), result[1]),
+                error_callback=self.shard_finished,
+            )
+            for first, last in ranges
+        ]
+        cleaned = [page for result in results for page in result.get()[0]]
+
+        self.update(job_id, state="assembling")
+        scan_pages.apply_pages(params["input_pdf"], output_pdf_path, cleaned)
+        if params["linearize"]:
+            pdfer.linearize_pdf(output_pdf_path)
+        self.update(job_id, state="done", result=output_pdf_path, finished_at=time.time())
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    manager = None  # Set by serve()
+
+    def send_json(self, data, code=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self.send_json({"error": "not found"}, 404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            job_id = self.manager.submit(request)
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json({"error": f"bad request: {e}"}, 400)
+            return
+        self.send_json({"id": job_id}, 201)
+
+    def do_GET(self):
+        parts = [part for part in self.path.split("/") if part]
+        if parts == ["jobs"]:
+            with self.manager.changed:
+                self.send_json([dict(job) for job in self.manager.jobs.values()])
+        elif len(parts) == 2 and parts[0] == "jobs" and parts[1] in self.manager.jobs:
+            self.send_json(self.manager.status(parts[1]))
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[1] in self.manager.jobs and parts[2] == "events":
+            self.stream_events(parts[1])
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def stream_events(self, job_id):
+        """
+        Send the job status as JSON lines every time it changes, the response ends with the job.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+        last_version = -1
+        while True:
+            with self.manager.changed:
+                self.manager.changed.wait_for(lambda: self.manager.jobs[job_id]["version"] != last_version, timeout=30)
+                job = dict(self.manager.jobs[job_id])
+            if job["version"] == last_version:
+                continue  # Timeout, nothing changed
+            last_version = job["version"]
+            try:
+                self.wfile.write((json.dumps(job) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return  # Client went away
+            if job["state"] in FINISHED_STATES:
+                return
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+
+def serve(host="127.0.0.1", port=8765, workers=None, work_root=DEFAULT_WORK_ROOT):
+    manager = JobManager(workers, work_root)
+    JobRequestHandler.manager = manager
+    server = ThreadingHTTPServer((host, port), JobRequestHandler)
+    metrics.start_exporter()
+    logging.info(f"Job server listening on http://{host}:{port} with {manager.pool._processes} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        manager.close()
+        metrics.export()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the watermark remover as a local job server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: number of CPU cores)")
+    parser.add_argument("--work-root", default=DEFAULT_WORK_ROOT, help="folder where every job gets its own working folder")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.work_root)
+
+
+if __name__ == "__main__":
+    main()
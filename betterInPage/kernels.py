@@ -0,0 +1,354 @@
+"""
+Compute backends for the pixel kernels of the cleaners: the color mask, the fill of the masked
+pixels, and upcleaner's blend fills.
+
+    numpy       plain vectorized NumPy, always there, the reference the others are checked against
+    numexpr     numexpr expressions, several threads, no temporary arrays per channel
+    numba       compiled loops (Numba), mask and fill in parallel over the rows of the page
+
+"auto" checks every available backend against numpy on a synthetic page (same mask, same pixels,
+or the backend is not used) and keeps the fastest one for the process. Set WMREM_KERNELS to a
+backend name to skip the benchmark, "numpy" to turn the others off. Process pools benchmark
+once before they start (pool_backend) and pass the name to their workers (use_backend).
+
+Numba compiles the kernels the first time they run (a few seconds, cached in __pycache__ for the
+next runs). numexpr and Numba use every core: when several worker processes clean pages at the
+same time, set NUMEXPR_MAX_THREADS / NUMBA_NUM_THREADS so they don't fight over the cores.
+"""
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+DEFAULT_BACKEND = os.environ.get("WMREM_KERNELS", "auto")
+BENCHMARK_SIZE = (1754, 1240)  # An A4 page at 150 DPI
+BENCHMARK_RUNS = 3
+
+
+class NumpyKernels:
+    name = "numpy"
+
+    def available(self):
+        return True
+
+    def mask(self, area, lower, upper):
+        """
+        Pixels of area (H x W gray, or H x W x channels) whose first len(lower) channels are all
+        within lower..upper (inclusive). For gray areas lower and upper are one number.
+        """
+        if area.ndim == 2:
+            return (area >= lower) & (area <= upper)
+        lower, upper = np.asarray(lower), np.asarray(upper)
+        channels = area[..., :len(lower)]
+        return np.all((channels >= lower) & (channels <= upper), axis=-1)
+
+    def fill(self, area, mask, value):
+        """
+        Set the masked pixels of area to value (a number, or one number per channel), in place.
+        """
+        area[mask] = value
+
+    def copy_masked(self, area, source, mask):
+        """
+        Copy the masked pixels of source (same shape as area) into area, in place.
+        """
+        area[mask] = source[mask]
+
+    def neighbor_mean(self, area, mask):
+        """
+        Replace every masked pixel by the mean of its unmasked 8 neighbors (rounded down),
+        white when they are all masked. Only unmasked pixels are read, so the order doesn't matter.
+        """
+        height, width = mask.shape
+        valid = np.pad(~mask, 1)
+        values = np.pad(area.astype(np.int32), ((1, 1), (1, 1)) + ((0, 0),) * (area.ndim - 2))
+        if area.ndim == 3:
+            valid_values = values * valid[..., None]
+        else:
+            valid_values = values * valid
+        sums = np.zeros(area.shape, dtype=np.int32)
+        counts = np.zeros(mask.shape, dtype=np.int32)
+        for dy in (0, 1, 2):
+            for dx in (0, 1, 2):
+                if dy == 1 and dx == 1:
+                    continue
+                sums += valid_values[dy:dy + height, dx:dx + width]
+                counts += valid[dy:dy + height, dx:dx + width]
+
+        found = mask & (counts > 0)
+        divisor = counts[found][:, None] if area.ndim == 3 else counts[found]
+        area[found] = (sums[found] / divisor).astype(np.uint8)
+        area[mask & (counts == 0)] = 255
+
+
+class NumexprKernels(NumpyKernels):
+    name = "numexpr"
+
+    def available(self):
+        return numexpr is not None
+
+    def mask(self, area, lower, upper):
+        if area.ndim == 2:
+            return numexpr.evaluate(f"(area >= {int(lower)}) & (area <= {int(upper)})", local_dict={"area": area})
+        # One expression over the channel views, no boolean array per channel
+        names = {}
+        terms = []
+        for channel, (low, high) in enumerate(zip(lower, upper)):
+            names[f"c{channel}"] = area[..., channel]
+            terms.append(f"(c{channel} >= {int(low)}) & (c{channel} <= {int(high)})")
+        return numexpr.evaluate(" & ".join(terms), local_dict=names)
+
+    def fill(self, area, mask, value):
+        if area.ndim == 2:
+            numexpr.evaluate(f"where(mask, {int(value)}, area)", out=area, casting="unsafe")
+            return
+        for channel, channel_value in enumerate(np.broadcast_to(value, area.shape[-1:])):
+            view = area[..., channel]
+            numexpr.evaluate(f"where(mask, {int(channel_value)}, view)", out=view, casting="unsafe")
+
+
+if numba is not None:
+    # Every pixel only depends on itself (and unmasked neighbors for neighbor_mean), so the
+    # rows can run in parallel without locks
+
+    @numba.njit(parallel=True, cache=True)
+    def _mask_gray(area, lower, upper):
+        mask = np.empty(area.shape, dtype=np.bool_)
+        for y in numba.prange(area.shape[0]):
+            for x in range(area.shape[1]):
+                mask[y, x] = lower <= area[y, x] <= upper
+        return mask
+
+    @numba.njit(parallel=True, cache=True)
+    def _mask_color(area, lower, upper):
+        mask = np.empty(area.shape[:2], dtype=np.bool_)
+        for y in numba.prange(area.shape[0]):
+            for x in range(area.shape[1]):
+                inside = True
+                for c in range(lower.shape[0]):
+                    if area[y, x, c] < lower[c] or area[y, x, c] > upper[c]:
+                        inside = False
+                        break
+                mask[y, x] = inside
+        return mask
+
+    @numba.njit(parallel=True, cache=True)
+    def _fill_gray(area, mask, value):
+        for y in numba.prange(area.shape[0]):
+            for x in range(area.shape[1]):
+                if mask[y, x]:
+                    area[y, x] = value
+
+    @numba.njit(parallel=True, cache=True)
+    def _fill_color(area, mask, value):
+        for y in numba.prange(area.shape[0]):
+            for x in range(area.shape[1]):
+                if mask[y, x]:
+                    for c in range(area.shape[2]):
+                        area[y, x, c] = value[c]
+
+    @numba.njit(parallel=True, cache=True)
+    def _copy_masked(area, source, mask):
+        for y in numba.prange(area.shape[0]):
+            for x in range(area.shape[1]):
+                if mask[y, x]:
+                    area[y, x] = source[y, x]
+
+    @numba.njit(parallel=True, cache=True)
+    def _neighbor_mean(area, mask):
+        height, width, channels = area.shape
+        for y in numba.prange(height):
+            for x in range(width):
+                if not mask[y, x]:
+                    continue
+                sums = np.zeros(channels, dtype=np.int64)
+                count = 0
+                for ny in range(max(0, y - 1), min(height, y + 2)):
+                    for nx in range(max(0, x - 1), min(width, x + 2)):
+                        if not mask[ny, nx]:
+                            for c in range(channels):
+                                sums[c] += area[ny, nx, c]
+                            count += 1
+                for c in range(channels):
+                    area[y, x, c] = sums[c] // count if count else 255
+
+
+class NumbaKernels(NumpyKernels):
+    name = "numba"
+
+    def available(self):
+        return numba is not None
+
+    def mask(self, area, lower, upper):
+        if area.ndim == 2:
+            return _mask_gray(area, int(lower), int(upper))
+        return _mask_color(area, np.asarray(lower, dtype=np.int64), np.asarray(upper, dtype=np.int64))
+
+    def fill(self, area, mask, value):
+        if area.ndim == 2:
+            _fill_gray(area, mask, np.uint8(value))
+        else:
+            _fill_color(area, mask, np.broadcast_to(np.asarray(value, dtype=np.uint8), area.shape[-1:]).copy())
+
+    def copy_masked(self, area, source, mask):
+        _copy_masked(area, source, mask)
+
+    def neighbor_mean(self, area, mask):
+        _neighbor_mean(area[..., None] if area.ndim == 2 else area, mask)  # Gray areas as one channel
+
+
+BACKENDS = {backend.name: backend for backend in [NumpyKernels(), NumexprKernels(), NumbaKernels()]}
+
+if DEFAULT_BACKEND != "auto" and DEFAULT_BACKEND not in BACKENDS:
+    # A typo in WMREM_KERNELS shouldn't stop the tool from starting
+    logging.warning(f"Unknown kernel backend WMREM_KERNELS={DEFAULT_BACKEND} (auto, {', '.join(BACKENDS)}), using auto.")
+    DEFAULT_BACKEND = "auto"
+
+# Backend picked by the benchmark, it only runs once per process
+_auto_choice = []
+
+
+def sample_page(size=BENCHMARK_SIZE, seed=0):
+    """
+    Synthetic RGBA page: random background with blocks of the watermark color (128, 128, 128).
+    """
+    rng = np.random.default_rng(seed)
+    page = rng.integers(0, 256, size + (4,), dtype=np.uint8)
+    page[size[0] // 4:size[0] // 2, :, :3] = rng.integers(100, 156, (size[0] // 2 - size[0] // 4, size[1], 3), dtype=np.uint8)
+    return page
+
+
+def run_kernels(backend, page):
+    """
+    Every kernel once on a copy of page, the way the cleaners call them. Returns the outputs.
+    """
+    lower, upper = (78, 78, 78), (178, 178, 178)
+    outputs = []
+    # A box view (not contiguous) and the whole page: Numba compiles the kernels once per
+    # memory layout, both have to be compiled before a real page comes
+    for rgba, gray, box in [(page.copy(), page[..., 0].copy(), (slice(100, -100), slice(50, -50))),
+                            (page.copy(), page[..., 0].copy(), (slice(None), slice(None)))]:
+        area = rgba[box]
+        mask = backend.mask(area, lower, upper)
+        backend.fill(area, mask, (255, 255, 255, 255))
+
+        gray_area = gray[box]
+        gray_mask = backend.mask(gray_area, 78, 178)
+        backend.fill(gray_area, gray_mask, 255)
+        outputs += [mask, rgba, gray_mask, gray]
+
+    # upcleaner's fills, on a region like a selected stamp (a view into the page) and on a
+    # region that covers the whole page
+    for rgb, region_box in [(page[..., :3].copy(), (slice(0, 200), slice(0, 300))),
+                            (page[..., :3].copy(), (slice(None), slice(None)))]:
+        region = rgb[region_box]
+        region_mask = backend.mask(region, lower, upper)
+        backend.neighbor_mean(region, region_mask)
+        backend.copy_masked(region, np.ascontiguousarray(page[::-1, ::-1, :3][region_box]), region_mask)
+        outputs += [region_mask, rgb]
+    return outputs
+
+
+def check_backend(backend, page=None):
+    """
+    True if the backend gives exactly the numpy results on a sample page.
+    """
+    page = sample_page((300, 400)) if page is None else page
+    expected = run_kernels(BACKENDS["numpy"], page)
+    return all(np.array_equal(a, b) for a, b in zip(expected, run_kernels(backend, page)))
+
+
+def benchmark(size=BENCHMARK_SIZE, runs=BENCHMARK_RUNS):
+    """
+    Check and time every available backend on a synthetic page (the first call, which compiles
+    the Numba kernels, is not timed). Returns {backend name: seconds per page}, without the
+    backends that failed or gave other results than numpy.
+    """
+    page = sample_page(size)
+    results = {}
+    for name, backend in BACKENDS.items():
+        if not backend.available():
+            continue
+        try:
+            if not check_backend(backend):
+                logging.warning(f"Kernel backend {name} doesn't give the same pixels as numpy, not used.")
+                continue
+            started = time.perf_counter()
+            for _ in range(runs):
+                run_kernels(backend, page)
+            results[name] = (time.perf_counter() - started) / runs
+        except Exception as e:
+            logging.warning(f"Kernel backend {name} failed during benchmark: {e}")
+    return results
+
+
+def pick_backend():
+    """
+    The fastest correct backend, benchmarking them the first time.
+    """
+    if not _auto_choice:
+        results = benchmark()
+        _auto_choice.append(min(results, key=results.get))
+        logging.info(f"Kernel backend: {_auto_choice[0]} ({results})")
+    return BACKENDS[_auto_choice[0]]
+
+
+def backend_name():
+    return get_backend().name
+
+
+def pool_backend():
+    """
+    Name of the backend the workers of a process pool should use, benchmarked once in a
+    short-lived child process. Not in the parent itself: Numba's threads don't survive a fork,
+    a pool forked after the parent ran the Numba kernels hangs on the first page.
+    """
+    if DEFAULT_BACKEND != "auto":
+        return backend_name()
+    with multiprocessing.Pool(1) as probe:
+        return probe.apply(backend_name)
+
+
+def use_backend(name):
+    """
+    Make "auto" use the backend name without benchmarking: for worker processes, when the
+    parent process picked it already (workers benchmarking all at once on a busy CPU would
+    disturb each other's timings and could pick different backends).
+    """
+    _auto_choice[:] = [name]
+
+
+def get_backend(name=None):
+    """
+    The kernels to use: a name from BACKENDS or "auto", None means DEFAULT_BACKEND.
+    A backend that is not installed falls back to numpy, an unknown name to "auto".
+    """
+    name = name or DEFAULT_BACKEND
+    if name != "auto" and name not in BACKENDS:
+        logging.warning(f"Unknown kernel backend {name} (auto, {', '.join(BACKENDS)}), using auto.")
+        name = "auto"
+    if name == "auto":
+        return pick_backend()
+    backend = BACKENDS[name]
+    if not backend.available():
+        logging.warning(f"Kernel backend {name} is not installed, using numpy.")
+        return BACKENDS["numpy"]
+    return backend
+
+
+if __name__ == "__main__":
+    # python kernels.py: check every backend and print the timings
+    for name, seconds in sorted(benchmark().items(), key=lambda item: item[1]):
+        print(f"{name:8s} {seconds * 1000:8.1f} ms per page")
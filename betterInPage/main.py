@@ -1,93 +1,76 @@
-import splitter  # Assuming splitter.py is in the same directory
-import betterinpage  # Assuming wmremv2.py is in the same directory
-import time
-import page_remover
-import pdfer  # Assuming pdfer.py is in the same directory
-import os
-import shutil
-
-def cleanup():
-    """
-    Removes the folders "temp_cut", "output_images", and "temp_sticking",
-    as well as the file "output.txt", if they exist.
-    """
-    folders_to_delete = ["temp_cut", "output_images", "temp_sticking", "__pycache__"]
-    file_to_delete = "output.txt"
-    
-    # Remove folders
-    for folder in folders_to_delete:
-        if os.path.exists(folder):
-            try:
-                shutil.rmtree(folder)  # Delete the folder and all its contents
-                print(f"Folder '{folder}' has been deleted.")
-            except Exception as e:
-                print(f"Error deleting folder '{folder}': {e}")
-        else:
-            print(f"Folder '{folder}' does not exist.")
-    
-    # Remove file
-    if os.path.exists(file_to_delete):
-        try:
-            os.remove(file_to_delete)
-            print(f"File '{file_to_delete}' has been deleted.")
-        except Exception as e:
-            print(f"Error deleting file '{file_to_delete}': {e}")
-    else:
-        print(f"File '{file_to_delete}' does not exist.")
-
-if __name__ == "__main__":
-    try:
-        cleanup()  # Call the cleanup function to delete the folders and file before starting the process
-
-        # Run splitter.py - First step
-        print("Running PdfSplitterApp...")
-        splitter_app = splitter.run()
-        if not splitter_app.process_done:
-            print("Splitter process was not completed successfully. Exiting...")
-            cleanup()
-            exit()
-        else:
-            print("the spilitting process was successfull")
-
-        time.sleep(0.5) #so the ui s don't mix up
-        
-        # After splitter completes, run betterinpage.py - Second step
-        print("Opening betterinpage UI...")
-        BetterInpage_app = betterinpage.run()
-        if not BetterInpage_app.process_done:
-            print("BetterInpage Core process was not completed successfully. Exiting...")
-            cleanup()
-            exit()
-        else:
-            print("the cleaning process was successfull")
-
-        time.sleep(0.5) #so the ui s don't mix up
-
-        # After betterinpage.py completes, run page_remover.py - third step
-        print("Opening page_remover UI...")
-        ImageManagerApp_app = page_remover.run()
-        if not ImageManagerApp_app.process_done:
-            print("Processing started but incomplete. Exiting...")
-            cleanup()
-            exit()
-        else:
-            print("User skipped or completed the cleanup.")
-
-        
-        # After page_remover completes, run pdfer.py - fourth step
-        print("Generating PDF...")
-        pdfer_app = pdfer.run()
-        if not pdfer_app.process_done:
-            print("PDF generation process was not completed successfully. Exiting...")
-            cleanup()
-            exit()
-        else:
-            print("PDF generating process was successfull")
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-    finally:
-        # Always perform cleanup after all steps, even if an error occurs
-        print("Performing cleanup...")
-        cleanup()
+import splitter  # Assuming splitter.py is in the same directory
+import betterinpage  # Assuming wmremv2.py is in the same directory
+import time
+import page_remover
+import pdfer  # Assuming pdfer.py is in the same directory
+import os
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import workspace  # Per-job working folder, so several jobs can run side by side
+
+if __name__ == "__main__":
+    metrics.start_exporter()  # Export the metrics every few seconds if WMREM_METRICS_FILE is set
+    keep_temp_files = False  # Set when the user cancels, so the pages cleaned so far are not lost
+
+    # Splits, list of splits, cleaned pages, page spool and PDF batches all go in this job's own
+    # folder (in RAM with WMREM_WORKSPACE_ROOT=shm), nothing is shared with another running job
+    job = workspace.Workspace()
+    print(f"Working folder: {job.path}")
+
+    try:
+        # Run splitter.py - First step
+        print("Running PdfSplitterApp...")
+        splitter_app = splitter.run(job.temp_cut, job.pdf_list)
+        if not splitter_app.process_done:
+            print("Splitter process was not completed successfully. Exiting...")
+            exit()
+        else:
+            print("the spilitting process was successfull")
+
+        time.sleep(0.5) #so the ui s don't mix up
+        
+        # After splitter completes, run betterinpage.py - Second step
+        print("Opening betterinpage UI...")
+        BetterInpage_app = betterinpage.run(job.pdf_list, job.output_images, job.spool)
+        if BetterInpage_app.cancelled:
+            print(f"Cleaning was cancelled, the pages cleaned so far are kept in {BetterInpage_app.spool_path or job.output_images}. Exiting...")
+            keep_temp_files = True
+            exit()
+        elif not BetterInpage_app.process_done:
+            print("BetterInpage Core process was not completed successfully. Exiting...")
+            exit()
+        else:
+            print("the cleaning process was successfull")
+
+        time.sleep(0.5) #so the ui s don't mix up
+
+        # After betterinpage.py completes, run page_remover.py - third step
+        print("Opening page_remover UI...")
+        ImageManagerApp_app = page_remover.run(BetterInpage_app.spool_path, job.output_images)
+        if not ImageManagerApp_app.process_done:
+            print("Processing started but incomplete. Exiting...")
+            exit()
+        else:
+            print("User skipped or completed the cleanup.")
+
+        
+        # After page_remover completes, run pdfer.py - fourth step
+        print("Generating PDF...")
+        pdfer_app = pdfer.run(job.output_images, job.output_pdf, job.temp_sticking, BetterInpage_app.spool_path)
+        if not pdfer_app.process_done:
+            print("PDF generation process was not completed successfully. Exiting...")
+            exit()
+        else:
+            # output.pdf next to this file, or output-2.pdf... if another job left one there
+            final_pdf_path = job.deliver(os.path.dirname(os.path.abspath(__file__)))
+            print(f"PDF generating process was successfull: {final_pdf_path}")
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+    finally:
+        metrics.export()  # Final numbers, if WMREM_METRICS_FILE is set
+
+        # Always remove the working folder after all steps, even if an error occurs
+        if not keep_temp_files:
+            print("Performing cleanup...")
+            job.cleanup()
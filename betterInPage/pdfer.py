@@ -1,122 +1,324 @@
-import logging
-from fpdf import FPDF
-from PIL import Image
-import os
-import natsort  # Import the natsort library
-from PyPDF2 import PdfMerger  # To merge PDFs
-
-# Class to maintain the process_done status
-class PdfGeneratorApp:
-    def __init__(self):
-        self.process_done = False
-
-def run():
-    app = PdfGeneratorApp()  # Track process status with this instance
-    
-    try:
-        # --------------- USER INPUT -------------------- #
-        folder = r"output_images"  # Folder containing all the images (relative path).
-        name = "output.pdf"        # Name of the output PDF file.
-
-        # Create the 'temp_sticking' directory if it doesn't exist
-        temp_sticking_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp_sticking")
-        if not os.path.exists(temp_sticking_dir):
-            os.makedirs(temp_sticking_dir)
-
-        # Set up logging to save the log file in 'temp_sticking' folder
-        log_file_path = os.path.join(temp_sticking_dir, "batch_processing.log")
-        logging.basicConfig(
-            filename=log_file_path,  # Log file to store the logs
-            level=logging.INFO,      # Log level (INFO level for general info)
-            format="%(asctime)s - %(levelname)s - %(message)s",  # Log format
-        )
-
-        # Get the absolute path of the folder
-        folder = os.path.abspath(folder)
-
-        # Ensure the folder exists
-        if not os.path.exists(folder):
-            logging.error(f"The folder {folder} does not exist.")
-            print(f"Error: The folder '{folder}' does not exist.")
-            return app  # Return with process_done=False
-
-        # ------------- ADD ALL THE IMAGES IN A LIST ------------- #
-        imagelist = []  # Contains the list of all images to be converted to PDF.
-
-        for dirpath, dirnames, filenames in os.walk(folder):
-            for filename in [f for f in filenames if f.endswith(".jpg")]:
-                full_path = os.path.join(dirpath, filename)
-                imagelist.append(full_path)
-
-        # Sort the images using natural sorting (numerical order in filenames)
-        imagelist = natsort.natsorted(imagelist)
-
-        # Log all image paths
-        logging.info(f"Found {len(imagelist)} images to process.")
-        for img_path in imagelist:
-            logging.debug(f"Image: {img_path}")
-
-        if len(imagelist) == 0:
-            logging.error("No images found in the folder.")
-            print("Error: No images found in the folder.")
-            return app
-
-        # --------------- ROTATE ANY LANDSCAPE MODE IMAGE IF PRESENT ----------------- #
-        for i in range(len(imagelist)):
-            im1 = Image.open(imagelist[i])  # Open the image.
-            width, height = im1.size       # Get the width and height of that image.
-
-            # If the image is in landscape mode (width > height), rotate it.
-            if width > height:
-                im2 = im1.transpose(Image.ROTATE_270)  # Rotate the image.
-                os.remove(imagelist[i])                # Delete the original image.
-                im2.save(imagelist[i])                 # Save the rotated image back.
-                logging.info(f"Rotated image: {imagelist[i]}")
-
-        logging.info(f"Found {len(imagelist)} image files. Converting to PDF....")
-
-        # --------------- BATCH PDF CREATION AND MERGING ---------------- #
-        pdf_merger = PdfMerger()  # To merge the PDF files.
-
-        batch_size = 50  # Number of pages per PDF batch.
-        batch_count = len(imagelist) // batch_size + (1 if len(imagelist) % batch_size != 0 else 0)
-
-        # Process images in batches and create PDFs
-        for batch_index in range(batch_count):
-            pdf = FPDF()
-            start_index = batch_index * batch_size
-            end_index = min((batch_index + 1) * batch_size, len(imagelist))
-
-            # Add images for the current batch
-            for image in imagelist[start_index:end_index]:
-                pdf.add_page()
-                pdf.image(image, 0, 0, 210, 297)  # 210 and 297 are the dimensions of an A4 size sheet.
-
-            # Save the batch PDF in the 'temp_sticking' subfolder
-            batch_pdf_name = f"batch_{batch_index + 1}.pdf"
-            batch_pdf_path = os.path.join(temp_sticking_dir, batch_pdf_name)
-            pdf.output(batch_pdf_path, "F")
-            pdf_merger.append(batch_pdf_path)  # Add this batch PDF to the merger
-
-            # Log progress
-            logging.info(f"Batch {batch_index + 1} processed, containing images {start_index + 1} to {end_index}.")
-        
-        # Final merged PDF (saved in the original directory)
-        final_pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
-        pdf_merger.write(final_pdf_path)
-        pdf_merger.close()
-
-        logging.info(f"PDF generated successfully and saved as {final_pdf_path}")
-        print(f"PDF generated successfully and saved as {final_pdf_path}")
-
-        app.process_done = True  # Mark process as completed successfully
-
-    except Exception as e:
-        logging.error(f"An error occurred: {e}")
-        print(f"Error: {e}")
-
-    finally:
-        return app  # Return the app instance with process_done status
-
-if __name__ == "__main__":
-    run()
+import hashlib
+import io
+import logging
+from fpdf import FPDF
+from PIL import Image
+import fitz  # PyMuPDF, builds the PDF from a page spool
+import numpy as np
+import os
+import shutil
+import subprocess
+import natsort  # Import the natsort library
+from PyPDF2 import PdfMerger  # To merge PDFs
+import time
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import profiler  # Per-page trace timeline when WMREM_PROFILE is set
+import page_spool  # Raw pages from betterinpage, when it used a spool
+
+A4_POINTS = (595, 842)  # The page size the images are put on, same as the 210 x 297 mm below
+SPOOL_JPEG_QUALITY = 85  # Spool pages are compressed only once, at the quality scanners use
+FLUSH_PAGES = 25  # IncrementalPdfWriter writes the new pages to the file at least this often
+
+# Class to maintain the process_done status
+class PdfGeneratorApp:
+    def __init__(self):
+        self.process_done = False
+        self.final_pdf_path = None
+
+def image_digest(image_path):
+    """
+    Content hash of an image file, identical pages get the same one.
+    """
+    with open(image_path, "rb") as image_file:
+        return hashlib.sha256(image_file.read()).hexdigest()
+
+def dedupe_pdf(pdf_path):
+    """
+    Rewrite a PDF with its identical objects merged (image streams too), for identical pages
+    that ended up in different batches: FPDF only shares an image inside one batch.
+    """
+    tmp_path = f"{pdf_path}.dedupe.tmp"
+    with metrics.stage("dedupe") as measurement:
+        doc = fitz.open(pdf_path)
+        doc.save(tmp_path, garbage=4)  # 4 = also compare the stream contents
+        doc.close()
+        os.replace(tmp_path, pdf_path)
+        measurement["bytes_out"] = os.path.getsize(pdf_path)
+    logging.info(f"Identical pages of {pdf_path} share their image now.")
+
+def spool_to_pdf(spool_path, final_pdf_path):
+    """
+    Build the PDF from the pages of a page spool that are not deleted: every page is read from
+    the memory-mapped file, turned upright if it is landscape (a view, nothing is copied) and
+    compressed to JPEG, once. Identical pages are compressed once and share one image.
+    Returns (pages, raw bytes read).
+    """
+    doc = fitz.open()
+    pages, bytes_in = 0, 0
+    xrefs = {}  # Hash of the raw page -> xref of its image in the PDF
+    with page_spool.PageSpool.open(spool_path) as spool:
+        for number in spool.pages():
+            data = spool.array(number)
+            if data.shape[1] > data.shape[0]:
+                data = np.rot90(data, k=-1)  # Same as Image.ROTATE_270
+            with metrics.stage("hash", pages=1, bytes_in=data.nbytes):
+                data = np.ascontiguousarray(data)
+                digest = hashlib.sha256(data.data).hexdigest()
+            page = doc.new_page(width=A4_POINTS[0], height=A4_POINTS[1])
+            if digest in xrefs:
+                page.insert_image(page.rect, xref=xrefs[digest])
+            else:
+                buffer = io.BytesIO()
+                with metrics.stage("encode", pages=1, bytes_in=data.nbytes) as measurement:
+                    Image.fromarray(data).save(buffer, "JPEG", quality=SPOOL_JPEG_QUALITY)
+                    measurement["bytes_out"] = buffer.tell()
+                xrefs[digest] = page.insert_image(page.rect, stream=buffer.getvalue())
+            pages += 1
+            bytes_in += data.nbytes
+            logging.info(f"Spool page {number + 1} added to the PDF.")
+    with profiler.span("merge"):
+        doc.save(final_pdf_path, garbage=3, deflate=True)
+    doc.close()
+    return pages, bytes_in
+
+class IncrementalPdfWriter:
+    """
+    Writes the output PDF while the pages come in, in order, instead of after the last one:
+    every flush appends the new pages as an incremental update, so after each flush the file
+    is a complete PDF a viewer can open (pages_written pages so far). The JPEGs are put in the
+    PDF as they are, nothing is decoded or compressed again, and identical JPEGs are put in
+    once: every copy of the page points to the same image.
+    """
+
+    def __init__(self, final_pdf_path, flush_pages=FLUSH_PAGES):
+        self.final_pdf_path = final_pdf_path
+        self.flush_pages = flush_pages
+        self.doc = fitz.open()
+        self.on_disk = False  # The first flush writes the file, the next ones append to it
+        self.pending = 0
+        self.pending_bytes = 0
+        self.pages_written = 0
+        self.xrefs = {}  # image_digest -> xref of the image, they stay the same across flushes
+
+    def add_image(self, image_path):
+        """
+        Add a page with the image on it (A4, landscape images turned like run() does).
+        """
+        with Image.open(image_path) as image:  # Only reads the header
+            width, height = image.size
+        digest = image_digest(image_path)
+        page = self.doc.new_page(width=A4_POINTS[0], height=A4_POINTS[1])
+        # rotate is counterclockwise, like Image.ROTATE_270
+        rotate = 270 if width > height else 0
+        if digest in self.xrefs:
+            page.insert_image(page.rect, xref=self.xrefs[digest], rotate=rotate)
+        else:
+            self.xrefs[digest] = page.insert_image(page.rect, filename=image_path, rotate=rotate)
+        self.pending += 1
+        self.pending_bytes += os.path.getsize(image_path)
+        if self.pending >= self.flush_pages:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pages added since the last flush to the file.
+        """
+        if not self.pending:
+            return
+        with metrics.stage("assemble", pages=self.pending, bytes_in=self.pending_bytes) as measurement:
+            if self.on_disk:
+                self.doc.saveIncr()
+            else:
+                self.doc.save(self.final_pdf_path)
+                self.doc.close()
+                self.doc = fitz.open(self.final_pdf_path)  # saveIncr needs the document opened from the file
+                self.on_disk = True
+            measurement["bytes_out"] = os.path.getsize(self.final_pdf_path)
+        self.pages_written = len(self.doc)
+        self.pending, self.pending_bytes = 0, 0
+        logging.info(f"{self.pages_written} pages written to {self.final_pdf_path}")
+
+    def close(self, linearize=False):
+        """
+        Write the last pages, and rewrite the file linearized if asked (see linearize_pdf).
+        """
+        self.flush()
+        self.doc.close()
+        if linearize and self.on_disk:
+            linearize_pdf(self.final_pdf_path)
+
+def linearize_pdf(pdf_path):
+    """
+    Rewrite a PDF linearized ("fast web view": the first page is at the start of the file, a
+    viewer can show it before the rest is downloaded). PyMuPDF can't do it anymore, qpdf is
+    used if it is installed. Returns False when the file was left as it was.
+    """
+    qpdf = shutil.which("qpdf")
+    if qpdf is None:
+        logging.warning("qpdf is not installed, the PDF is not linearized.")
+        return False
+    tmp_path = f"{pdf_path}.linear.tmp"
+    with metrics.stage("linearize") as measurement:
+        completed = subprocess.run([qpdf, "--linearize", pdf_path, tmp_path], capture_output=True, text=True)
+        if completed.returncode not in (0, 3):  # 3 = done, with warnings
+            logging.error(f"qpdf failed: {completed.stderr.strip()}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, pdf_path)
+        measurement["bytes_out"] = os.path.getsize(pdf_path)
+    logging.info(f"{pdf_path} linearized.")
+    return True
+
+def run(folder=r"output_images", final_pdf_path=None, temp_sticking_dir=None, spool_path=None):
+    """
+    Put all the images of folder in one PDF.
+    By default the PDF is output.pdf next to this file and the batches go in temp_sticking next to it.
+    With spool_path the pages come from that page spool instead of folder (see spool_to_pdf).
+    """
+    app = PdfGeneratorApp()  # Track process status with this instance
+    started = time.perf_counter()
+    
+    try:
+        # --------------- USER INPUT -------------------- #
+        name = "output.pdf"        # Name of the output PDF file.
+
+        # Create the 'temp_sticking' directory if it doesn't exist
+        if temp_sticking_dir is None:
+            temp_sticking_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp_sticking")
+        if not os.path.exists(temp_sticking_dir):
+            os.makedirs(temp_sticking_dir)
+
+        # Set up logging to save the log file in 'temp_sticking' folder
+        log_file_path = os.path.join(temp_sticking_dir, "batch_processing.log")
+        logging.basicConfig(
+            filename=log_file_path,  # Log file to store the logs
+            level=logging.INFO,      # Log level (INFO level for general info)
+            format="%(asctime)s - %(levelname)s - %(message)s",  # Log format
+        )
+
+        if spool_path is not None:
+            if final_pdf_path is None:
+                final_pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+            pages, bytes_in = spool_to_pdf(spool_path, final_pdf_path)
+            if pages == 0:
+                logging.error("No pages in the page spool.")
+                print("Error: No pages in the page spool.")
+                return app
+            metrics.record("assemble", time.perf_counter() - started, pages=pages, bytes_in=bytes_in,
+                           bytes_out=os.path.getsize(final_pdf_path))
+            print(f"PDF generated successfully and saved as {final_pdf_path}")
+            app.final_pdf_path = final_pdf_path
+            app.process_done = True
+            return app
+
+        # Get the absolute path of the folder
+        folder = os.path.abspath(folder)
+
+        # Ensure the folder exists
+        if not os.path.exists(folder):
+            logging.error(f"The folder {folder} does not exist.")
+            print(f"Error: The folder '{folder}' does not exist.")
+            return app  # Return with process_done=False
+
+        # ------------- ADD ALL THE IMAGES IN A LIST ------------- #
+        imagelist = []  # Contains the list of all images to be converted to PDF.
+
+        for dirpath, dirnames, filenames in os.walk(folder):
+            for filename in [f for f in filenames if f.endswith(".jpg")]:
+                full_path = os.path.join(dirpath, filename)
+                imagelist.append(full_path)
+
+        # Sort the images using natural sorting (numerical order in filenames)
+        imagelist = natsort.natsorted(imagelist)
+
+        # Log all image paths
+        logging.info(f"Found {len(imagelist)} images to process.")
+        for img_path in imagelist:
+            logging.debug(f"Image: {img_path}")
+
+        if len(imagelist) == 0:
+            logging.error("No images found in the folder.")
+            print("Error: No images found in the folder.")
+            return app
+
+        # --------------- ROTATE ANY LANDSCAPE MODE IMAGE IF PRESENT ----------------- #
+        for i in range(len(imagelist)):
+            im1 = Image.open(imagelist[i])  # Open the image.
+            width, height = im1.size       # Get the width and height of that image.
+
+            # If the image is in landscape mode (width > height), rotate it.
+            if width > height:
+                im2 = im1.transpose(Image.ROTATE_270)  # Rotate the image.
+                os.remove(imagelist[i])                # Delete the original image.
+                im2.save(imagelist[i])                 # Save the rotated image back.
+                logging.info(f"Rotated image: {imagelist[i]}")
+
+        logging.info(f"Found {len(imagelist)} image files. Converting to PDF....")
+
+        # --------------- BATCH PDF CREATION AND MERGING ---------------- #
+        pdf_merger = PdfMerger()  # To merge the PDF files.
+
+        # Identical pages (blank separators, covers, repeated watermark pages) point to one image:
+        # FPDF embeds an image once per file name, so every copy uses the name of the first one
+        with metrics.stage("hash", pages=len(imagelist)):
+            digests = [image_digest(image) for image in imagelist]
+        first_with_digest = {}
+        for image, digest in zip(imagelist, digests):
+            first_with_digest.setdefault(digest, image)
+        logging.info(f"{len(imagelist) - len(first_with_digest)} pages are identical to an earlier page.")
+
+        batch_size = 50  # Number of pages per PDF batch.
+        batch_count = len(imagelist) // batch_size + (1 if len(imagelist) % batch_size != 0 else 0)
+
+        # Process images in batches and create PDFs
+        for batch_index in range(batch_count):
+            pdf = FPDF()
+            start_index = batch_index * batch_size
+            end_index = min((batch_index + 1) * batch_size, len(imagelist))
+
+            # Add images for the current batch
+            for image, digest in zip(imagelist[start_index:end_index], digests[start_index:end_index]):
+                pdf.add_page()
+                pdf.image(first_with_digest[digest], 0, 0, 210, 297)  # 210 and 297 are the dimensions of an A4 size sheet.
+
+            # Save the batch PDF in the 'temp_sticking' subfolder
+            batch_pdf_name = f"batch_{batch_index + 1}.pdf"
+            batch_pdf_path = os.path.join(temp_sticking_dir, batch_pdf_name)
+            pdf.output(batch_pdf_path, "F")
+            pdf_merger.append(batch_pdf_path)  # Add this batch PDF to the merger
+
+            # Log progress
+            logging.info(f"Batch {batch_index + 1} processed, containing images {start_index + 1} to {end_index}.")
+        
+        # Final merged PDF (saved in the original directory)
+        if final_pdf_path is None:
+            final_pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+        with profiler.span("merge"):  # The PdfMerger pass
+            pdf_merger.write(final_pdf_path)
+        pdf_merger.close()
+
+        # The same page in two batches is still two images, merge them in the final PDF
+        batches_of = {}
+        for index, digest in enumerate(digests):
+            batches_of.setdefault(digest, set()).add(index // batch_size)
+        if any(len(batches) > 1 for batches in batches_of.values()):
+            dedupe_pdf(final_pdf_path)
+        metrics.record("assemble", time.perf_counter() - started, pages=len(imagelist),
+                       bytes_in=sum(os.path.getsize(image) for image in imagelist), bytes_out=os.path.getsize(final_pdf_path))
+
+        logging.info(f"PDF generated successfully and saved as {final_pdf_path}")
+        print(f"PDF generated successfully and saved as {final_pdf_path}")
+
+        app.final_pdf_path = final_pdf_path
+        app.process_done = True  # Mark process as completed successfully
+
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        print(f"Error: {e}")
+
+    finally:
+        return app  # Return the app instance with process_done status
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,195 @@
+"""
+Fast path for scanned PDFs: most scanned pages are one full-page image (usually a JPEG) and
+nothing else. For those the image is taken out of the PDF as it is, cleaned, and put back in
+place of the old one, the page is never rendered and the PDF is never rebuilt from images.
+
+Pages that are not a plain scan (vector text, drawings or visible text over the scan, small
+pictures...) are rendered, cleaned and replaced by an image page, like the normal pipeline
+would do with them.
+
+The cleaning (clean_pages) works on a page range and writes nothing, so the ranges of a big
+scan can run on several pool workers. The parent puts the cleaned images back in the PDF and
+saves it once (apply_pages).
+"""
+import io
+import logging
+import os
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import profiler  # Per-page trace timeline when WMREM_PROFILE is set
+import renderer  # Render backends, for the pages that are not a scan
+
+MIN_COVERAGE = 0.9  # The image must cover this much of the page
+JPEG_QUALITY = 85  # About what scanners use, higher only makes the PDF bigger
+
+
+def scan_xref(page):
+    """
+    xref of the image if the page is a plain scan: a single image over (almost) the whole page,
+    no drawings and no visible text (an invisible OCR layer is fine). None otherwise.
+    """
+    # get_images reads the page resources only, get_image_info would decode the image
+    images = page.get_images(full=True)
+    if len(images) != 1:
+        return None
+    bbox = page.get_image_bbox(images[0])
+    if bbox.is_infinite or bbox.is_empty:
+        return None  # In the resources but not drawn
+    bbox &= page.rect
+    if bbox.width * bbox.height < MIN_COVERAGE * page.rect.width * page.rect.height:
+        return None
+    if page.get_drawings():
+        return None  # Vector watermark or annotations drawn over the scan
+    if any(span["type"] != 3 for span in page.get_texttrace()):
+        return None  # Visible text, 3 is the invisible render mode of OCR layers
+    return images[0][0]
+
+
+def scan_xrefs(pdf_path):
+    """
+    scan_xref of every page of a PDF.
+    """
+    with fitz.open(pdf_path) as doc:
+        return [scan_xref(page) for page in doc]
+
+
+def is_scanned(pdf_path):
+    """
+    True if every page of the PDF is a plain scan, so the whole document can go through the fast path.
+    """
+    return all(xref is not None for xref in scan_xrefs(pdf_path))
+
+
+def extract_scan(doc, xref):
+    """
+    Decode a scan image straight from the PDF. Returns None for images PIL can't read or
+    images with a soft mask, those pages are rendered instead.
+    """
+    info = doc.extract_image(xref)
+    if not info or info.get("smask"):
+        return None
+    try:
+        image = Image.open(io.BytesIO(info["image"]))
+        image.load()
+    except OSError:
+        return None
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("L" if image.mode in ("1", "LA", "I", "I;16") else "RGB")
+    return image
+
+
+def encode_jpeg(image):
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    with metrics.stage("encode", pages=1, bytes_in=metrics.image_bytes(image)) as measurement:
+        image.save(buffer, "JPEG", quality=JPEG_QUALITY)
+        measurement["bytes_out"] = buffer.tell()
+    return buffer.getvalue()
+
+
+def replace_scan(doc, xref, data, width, height, mode):
+    """
+    Put a cleaned image (data: the JPEG) in place of the scan: the image object keeps its xref,
+    so every page that shows it keeps its position, size and rotation. (Page.replace_image
+    would leave a second copy of the image in the page resources.)
+    """
+    doc.update_stream(xref, data, compress=False)
+    doc.xref_set_key(xref, "Filter", "/DCTDecode")
+    doc.xref_set_key(xref, "Width", str(width))
+    doc.xref_set_key(xref, "Height", str(height))
+    doc.xref_set_key(xref, "BitsPerComponent", "8")
+    doc.xref_set_key(xref, "ColorSpace", "/DeviceGray" if mode == "L" else "/DeviceRGB")
+    for key in ("DecodeParms", "Decode", "SMask", "Mask", "ImageMask"):
+        doc.xref_set_key(xref, key, "null")  # Settings of the old encoding
+
+
+def clean_pages(input_pdf_path, first, last, clean_image, dpi=150, progress_callback=None):
+    """
+    Clean the pages first..last-1 (0-based) of a PDF without writing it: the part of
+    clean_in_place that can run in a pool worker, on a page range.
+    clean_image(PIL image) -> PIL image is applied to the scan of every scanned page, the
+    other pages are rendered at dpi and cleaned.
+    progress_callback(pages_done, pages_total) is called after every page of the range.
+    Returns one dict per page for apply_pages: "page" (0-based), "xref" (the scan, None for a
+    rendered page), "jpeg" (the cleaned image, None when the scan was cleaned for an earlier
+    page of the range), "width", "height" and "mode".
+    """
+    cleaned_xrefs = set()  # An image used by several pages is cleaned once
+    pages = []
+
+    with fitz.open(input_pdf_path) as doc:
+        last = min(last, len(doc))
+        for page_num in range(first, last):
+            with profiler.page(f"{os.path.basename(input_pdf_path)}#{page_num + 1}"):
+                xref = scan_xref(doc[page_num])
+                image = None
+                if xref in cleaned_xrefs:
+                    pages.append({"page": page_num, "xref": xref, "jpeg": None})
+                else:
+                    if xref is not None:
+                        with metrics.stage("extract", pages=1) as measurement:
+                            image = extract_scan(doc, xref)
+                            measurement["bytes_out"] = metrics.image_bytes(image) if image else 0
+
+                    if image is not None:
+                        cleaned_xrefs.add(xref)
+                    else:
+                        # Not a plain scan: rendered, cleaned and put on an image page
+                        xref = None
+                        image = renderer.render_pages(input_pdf_path, dpi, page_num + 1, page_num + 1)[0]
+                    cleaned = clean_image(image)
+                    if cleaned.mode not in ("RGB", "L"):
+                        cleaned = cleaned.convert("RGB")
+                    pages.append({"page": page_num, "xref": xref, "jpeg": encode_jpeg(cleaned),
+                                  "width": cleaned.width, "height": cleaned.height, "mode": cleaned.mode})
+
+            if progress_callback:
+                progress_callback(page_num + 1 - first, last - first)
+    return pages
+
+
+def apply_pages(input_pdf_path, output_pdf_path, pages):
+    """
+    Write a copy of the PDF with the pages cleaned by clean_pages (the lists of all the page
+    ranges, in any order): the scans are replaced in place, the rendered pages are swapped
+    for an image page. Returns (pages done in place, pages rendered).
+    """
+    replaced_xrefs = set()  # Two ranges can both clean an image their pages share, the first one is kept
+    in_place, rendered = 0, 0
+
+    with fitz.open(input_pdf_path) as doc:
+        for cleaned in sorted(pages, key=lambda cleaned: cleaned["page"]):
+            xref = cleaned["xref"]
+            if xref is not None:
+                if cleaned["jpeg"] is not None and xref not in replaced_xrefs:
+                    replace_scan(doc, xref, cleaned["jpeg"], cleaned["width"], cleaned["height"], cleaned["mode"])
+                    replaced_xrefs.add(xref)
+                in_place += 1
+            else:
+                page_num = cleaned["page"]
+                page = doc[page_num]
+                new_page = doc.new_page(page_num, width=page.rect.width, height=page.rect.height)
+                new_page.insert_image(new_page.rect, stream=cleaned["jpeg"])
+                doc.delete_page(page_num + 1)
+                rendered += 1
+
+        # garbage=3 drops the old image streams that nothing uses anymore
+        with metrics.stage("assemble", pages=len(doc)) as measurement:
+            doc.save(output_pdf_path, garbage=3, deflate=True)
+            measurement["bytes_out"] = os.path.getsize(output_pdf_path)
+    logging.info(f"{input_pdf_path}: {in_place} scanned pages cleaned in place, {rendered} pages rendered")
+    return in_place, rendered
+
+
+def clean_in_place(input_pdf_path, output_pdf_path, clean_image, dpi=150, progress_callback=None):
+    """
+    Write a cleaned copy of a PDF in one process: clean_pages on every page, then apply_pages.
+    An exception from clean_image (like a cancelled job) stops everything, nothing is written then.
+    Returns (pages done in place, pages rendered).
+    """
+    pages = clean_pages(input_pdf_path, 0, renderer.page_count(input_pdf_path), clean_image, dpi, progress_callback)
+    return apply_pages(input_pdf_path, output_pdf_path, pages)
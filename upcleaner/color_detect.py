@@ -0,0 +1,220 @@
+"""
+Guess the watermark color (and a tolerance) from a few pages, instead of trying colors on the
+whole document.
+
+A few pages are rendered at a low DPI. The pixels of every page are counted per color with
+np.bincount, on colors quantized to BITS bits per channel and packed into one number. The same
+pass adds up the exact R, G and B values of every bin, to get the mean color and spread back.
+The most common color is the paper. Every other color that peaks in the histogram is a
+candidate, and the candidates are ranked on the pages:
+
+    share       part of the page it covers, averaged over the pages
+    presence    share of the pages it is on
+    stability   a watermark covers about the same part of every page, text and pictures don't
+
+Two kinds of candidates go after the others: very dark grays, most likely the text, and the
+mixes of the paper with a bigger color (the anti-aliased edges of the text at a low DPI, they
+peak too). A gray watermark is also a mix of white and black, so it can be one of those, it is
+then still ranked with them by share. The tolerance covers the spread of the color (scan noise,
+JPEG) and stays clear of the paper color.
+"""
+import logging
+
+import numpy as np
+from scipy.ndimage import maximum_filter, uniform_filter
+
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import renderer  # Render backends (PyMuPDF / poppler)
+
+SAMPLE_PAGES = 8  # Pages rendered for the analysis, spread over the document
+ANALYZE_DPI = 50  # Plenty to count colors
+BITS = 4  # Bits per channel kept for the histogram: 16 levels, 4096 bins
+MIN_SHARE = 0.001  # A candidate covers at least this part of a page (0.1%)
+BACKGROUND_DISTANCE = 32  # Colors this close to the paper color are the paper
+TEXT_LEVEL, TEXT_SATURATION = 80, 24  # Darker and grayer than this: probably the text
+BLEND_DISTANCE = 12  # A color this close to the line between the paper and a bigger color is a mix of the two
+MIN_TOLERANCE, MAX_TOLERANCE = 40, 80
+CANDIDATES = 3  # Colors proposed
+
+LEVELS = 1 << BITS
+SHIFT = 8 - BITS
+
+
+def sample_pages(pdf_paths, count=SAMPLE_PAGES):
+    """
+    (pdf path, 1-based page number) of count pages spread evenly over all the PDFs.
+    """
+    pages = [(pdf_path, page_num) for pdf_path in pdf_paths for page_num in range(1, renderer.page_count(pdf_path) + 1)]
+    if len(pages) <= count:
+        return pages
+    step = len(pages) / count
+    return [pages[int(i * step)] for i in range(count)]
+
+
+def pack(data):
+    """
+    Bin number of every pixel of an RGB array: the top BITS bits of R, G and B side by side.
+    """
+    quantized = (data >> SHIFT).astype(np.intp)
+    return (quantized[..., 0] << (2 * BITS)) | (quantized[..., 1] << BITS) | quantized[..., 2]
+
+
+def page_histogram(data):
+    """
+    For one RGB page, per bin: the pixel count, the sums of R, G and B, and the sums of their
+    squares (for the mean color and spread of each bin). A 7 x bins array.
+    """
+    bins = pack(data).ravel()
+    sums = np.empty((7, LEVELS ** 3))
+    sums[0] = np.bincount(bins, minlength=LEVELS ** 3)
+    for channel in range(3):
+        values = data[..., channel].ravel().astype(np.float64)
+        sums[1 + channel] = np.bincount(bins, weights=values, minlength=LEVELS ** 3)
+        sums[4 + channel] = np.bincount(bins, weights=values * values, minlength=LEVELS ** 3)
+    return sums
+
+
+def histograms(pdf_paths, samples=SAMPLE_PAGES, dpi=ANALYZE_DPI, region=None):
+    """
+    Share of every bin on every sampled page (pages x bins), and the color sums of all pages.
+    region (x0, y0, x1, y1 in PDF points) limits the analysis to that part of the pages.
+    """
+    pages = sample_pages(pdf_paths, samples)
+    shares = np.zeros((len(pages), LEVELS ** 3))
+    sums = np.zeros((7, LEVELS ** 3))
+    for index, (pdf_path, page_num) in enumerate(pages):
+        data = np.asarray(renderer.render_pages(pdf_path, dpi, page_num, page_num)[0].convert("RGB"))
+        if region is not None:
+            scale = dpi / 72
+            x0, y0, x1, y1 = region
+            data = data[int(min(y0, y1) * scale):int(np.ceil(max(y0, y1) * scale)), int(min(x0, x1) * scale):int(np.ceil(max(x0, x1) * scale))]
+        if data.size == 0:
+            raise ValueError(f"The region {region} is outside of page {page_num} of {pdf_path}")
+        page_sums = page_histogram(data)
+        shares[index] = page_sums[0] / page_sums[0].sum()
+        sums += page_sums
+    return shares, sums
+
+
+def neighborhood(bin_number):
+    """
+    The bin and its neighbors (one level up or down on every channel): one color is often
+    split over two bins.
+    """
+    r, g, b = bin_number >> (2 * BITS), (bin_number >> BITS) & (LEVELS - 1), bin_number & (LEVELS - 1)
+    return [
+        (nr << (2 * BITS)) | (ng << BITS) | nb
+        for nr in range(max(0, r - 1), min(LEVELS, r + 2))
+        for ng in range(max(0, g - 1), min(LEVELS, g + 2))
+        for nb in range(max(0, b - 1), min(LEVELS, b + 2))
+    ]
+
+
+def bin_color(sums, bins):
+    """
+    Mean color (R, G, B) of the pixels in bins, and the largest standard deviation of a channel.
+    """
+    totals = sums[:, bins].sum(axis=1)
+    count = max(totals[0], 1)
+    mean = totals[1:4] / count
+    spread = np.sqrt(np.maximum(0, totals[4:7] / count - mean ** 2)).max()
+    return tuple(int(round(v)) for v in mean), float(spread)
+
+
+def is_blend(color, paper, other):
+    """
+    True if color is (about) a mix of the paper color and other, not one of the two.
+    """
+    color, paper, other = (np.array(c, dtype=np.float64) for c in (color, paper, other))
+    direction = other - paper
+    t = np.dot(color - paper, direction) / max(np.dot(direction, direction), 1)
+    if not 0.1 < t < 0.9:
+        return False
+    return np.abs(color - (paper + t * direction)).max() <= BLEND_DISTANCE
+
+
+def detect_colors(pdf_paths, samples=SAMPLE_PAGES, dpi=ANALYZE_DPI, region=None, count=CANDIDATES):
+    """
+    Candidate watermark colors, best first: dicts with "color" (R, G, B), "tolerance", "share",
+    "presence", "stability", "text" (True when it looks like the text color) and "blend" (True
+    when it may be a mix of the paper and another color).
+    Empty when there are no pages or the pages have a single color.
+    """
+    with metrics.stage("color_detect") as measurement:
+        shares, sums = histograms(pdf_paths, samples, dpi, region)
+        measurement["pages"] = len(shares)
+        if len(shares) == 0:
+            return []
+        mean = shares.mean(axis=0)
+
+        # The paper: the most common color, with the bins around it
+        background = int(np.argmax(mean))
+        background_color = bin_color(sums, [background])[0]
+
+        # Without the paper, or its mass would hide the peaks of the light colors next to it
+        levels = np.arange(LEVELS) * (256 // LEVELS) + (128 // LEVELS)  # Middle of every level
+        centers = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), axis=-1).reshape(-1, 3)
+        colors = np.where(np.abs(centers - background_color).max(axis=1) < BACKGROUND_DISTANCE, 0, mean)
+
+        # Peaks of the histogram (in the 3D color grid), big enough to matter. Every bin counts
+        # with its neighbors: scan noise and JPEG spread one color over several bins
+        grid = uniform_filter(colors.reshape(LEVELS, LEVELS, LEVELS), size=3, mode="constant") * 27
+        peaks = np.flatnonzero((grid == maximum_filter(grid, size=3, mode="constant")) & (grid >= MIN_SHARE))
+        grid = grid.ravel()
+
+        candidates = []
+        taken = set()
+        for peak in sorted(peaks, key=lambda peak: -grid[peak]):
+            if peak in taken:
+                continue  # Same color as a bigger peak (flat top)
+            bins = [b for b in neighborhood(peak) if b not in taken]
+            taken.update(bins)
+            color, spread = bin_color(sums, bins)
+            distance = max(abs(a - b) for a, b in zip(color, background_color))
+            if distance < BACKGROUND_DISTANCE:
+                continue
+
+            page_shares = shares[:, bins].sum(axis=1)
+            share = float(page_shares.mean())
+            presence = float(np.mean(page_shares >= MIN_SHARE))
+            stability = float(1 / (1 + page_shares.std() / share))
+            tolerance = int(min(MAX_TOLERANCE, max(MIN_TOLERANCE, np.ceil(3 * spread)), distance - BACKGROUND_DISTANCE // 2))
+            text = max(color) < TEXT_LEVEL and max(color) - min(color) < TEXT_SATURATION
+            candidates.append({
+                "color": color,
+                "tolerance": max(1, tolerance),
+                "share": share,
+                "presence": presence,
+                "stability": stability,
+                "text": text,
+            })
+
+        # Mixes of the paper with a bigger candidate, or with black ink (small text never has
+        # a pixel of pure black at a low DPI, only the mixes)
+        for c in candidates:
+            others = [other["color"] for other in candidates if other["share"] > c["share"]] + [(0, 0, 0)]
+            c["blend"] = any(is_blend(c["color"], background_color, other) for other in others)
+
+    candidates.sort(key=lambda c: (c["text"], c["blend"], -c["presence"] * c["stability"] * np.sqrt(c["share"])))
+    candidates = candidates[:count]
+    for c in candidates:
+        logging.info(f"Color candidate {to_hex(c['color'])} tolerance {c['tolerance']}: {c['share']:.2%} of the page, "
+                     f"on {c['presence']:.0%} of the pages, stability {c['stability']:.2f}{' (text?)' if c['text'] else ''}{' (mix?)' if c['blend'] else ''}")
+    return candidates
+
+
+def to_hex(color):
+    return "#{:02X}{:02X}{:02X}".format(*color)
+
+
+def describe(candidates):
+    """
+    One line for the UIs: the best color and the other candidates.
+    """
+    if not candidates:
+        return "No watermark color found."
+    best, others = candidates[0], candidates[1:]
+    text = f"Detected {to_hex(best['color'])} (tolerance {best['tolerance']})"
+    if others:
+        text += ", other candidates: " + ", ".join(to_hex(c["color"]) for c in others)
+    return text
@@ -0,0 +1,183 @@
+"""
+Per-stage metrics: time, pages and bytes in/out of every stage (split, render, mask, fill,
+encode, hash, assemble), queue depths and peak memory.
+
+Set the WMREM_METRICS_FILE environment variable to export them while the program runs:
+a file ending in .prom gets the Prometheus text format (rewritten every time, for the
+node_exporter textfile collector), anything else gets one JSON line per export.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import profiler  # Stages are also spans on the profiling timeline when WMREM_PROFILE is set
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+METRICS_FILE = os.environ.get("WMREM_METRICS_FILE")
+EXPORT_INTERVAL = float(os.environ.get("WMREM_METRICS_INTERVAL", "15"))  # Seconds between exports
+
+_lock = threading.Lock()
+_stages = {}  # stage name -> {"calls", "seconds", "pages", "bytes_in", "bytes_out"}
+_queues = {}  # queue name -> current depth
+_started = time.time()
+_exporter = None
+
+
+def record(stage_name, seconds, pages=0, bytes_in=0, bytes_out=0):
+    """
+    Add one measurement to a stage.
+    """
+    with _lock:
+        stats = _stages.setdefault(stage_name, {"calls": 0, "seconds": 0.0, "pages": 0, "bytes_in": 0, "bytes_out": 0})
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        stats["pages"] += pages
+        stats["bytes_in"] += bytes_in
+        stats["bytes_out"] += bytes_out
+
+
+@contextmanager
+def stage(stage_name, pages=0, bytes_in=0):
+    """
+    Time a block of code as one call of a stage:
+
+        with metrics.stage("encode", pages=1) as m:
+            image.save(path)
+            m["bytes_out"] = os.path.getsize(path)
+    """
+    measurement = {"pages": pages, "bytes_in": bytes_in, "bytes_out": 0}
+    started = time.perf_counter()
+    try:
+        with profiler.span(stage_name):
+            yield measurement
+    finally:
+        record(stage_name, time.perf_counter() - started, measurement["pages"], measurement["bytes_in"], measurement["bytes_out"])
+
+
+def set_queue_depth(queue_name, depth):
+    with _lock:
+        _queues[queue_name] = depth
+
+
+def image_bytes(image):
+    """
+    Size of a decoded PIL image in memory.
+    """
+    return image.width * image.height * len(image.getbands())
+
+
+def peak_rss_bytes():
+    """
+    Peak resident memory of this process and of the child processes it waited for (poppler),
+    None where the platform can't tell.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale
+
+
+def snapshot(reset=False):
+    """
+    Current values of all metrics as a dict. With reset=True the stage counters start over,
+    that's how worker processes hand their numbers to the main process (see merge).
+    """
+    with _lock:
+        stages = {name: dict(stats) for name, stats in _stages.items()}
+        queues = dict(_queues)
+        if reset:
+            _stages.clear()
+
+    for stats in stages.values():
+        stats["pages_per_second"] = stats["pages"] / stats["seconds"] if stats["seconds"] else 0.0
+
+    return {
+        "time": time.time(),
+        "uptime_seconds": time.time() - _started,
+        "pid": os.getpid(),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "stages": stages,
+        "queues": queues,
+    }
+
+
+def merge(other):
+    """
+    Add the stage counters of another process' snapshot to ours.
+    """
+    with _lock:
+        for stage_name, other_stats in other["stages"].items():
+            stats = _stages.setdefault(stage_name, {"calls": 0, "seconds": 0.0, "pages": 0, "bytes_in": 0, "bytes_out": 0})
+            for key in stats:
+                stats[key] += other_stats[key]
+
+
+def to_prometheus(data):
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP wmrem_{name} {help_text}")
+        lines.append(f"# TYPE wmrem_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"wmrem_{name}{labels} {value}")
+
+    stages = sorted(data["stages"].items())
+    metric("stage_calls_total", "counter", "Number of times a stage ran.", [(f'{{stage="{n}"}}', s["calls"]) for n, s in stages])
+    metric("stage_seconds_total", "counter", "Time spent in a stage.", [(f'{{stage="{n}"}}', s["seconds"]) for n, s in stages])
+    metric("stage_pages_total", "counter", "Pages that went through a stage.", [(f'{{stage="{n}"}}', s["pages"]) for n, s in stages])
+    metric("stage_bytes_in_total", "counter", "Bytes read by a stage.", [(f'{{stage="{n}"}}', s["bytes_in"]) for n, s in stages])
+    metric("stage_bytes_out_total", "counter", "Bytes written by a stage.", [(f'{{stage="{n}"}}', s["bytes_out"]) for n, s in stages])
+    metric("stage_pages_per_second", "gauge", "Average throughput of a stage.", [(f'{{stage="{n}"}}', s["pages_per_second"]) for n, s in stages])
+    metric("queue_depth", "gauge", "Items waiting in a queue.", [(f'{{queue="{n}"}}', v) for n, v in sorted(data["queues"].items())])
+    if data["peak_rss_bytes"] is not None:
+        metric("peak_rss_bytes", "gauge", "Peak resident memory.", [("", data["peak_rss_bytes"])])
+    metric("uptime_seconds", "gauge", "Seconds since the process started.", [("", data["uptime_seconds"])])
+    return "\n".join(lines) + "\n"
+
+
+def export(path=None):
+    """
+    Write the metrics to path (default: WMREM_METRICS_FILE). Does nothing when no file is set.
+    """
+    path = path or METRICS_FILE
+    if not path:
+        return
+    data = snapshot()
+    if path.endswith(".prom"):
+        # Write and rename, so a scraper never reads half a file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(to_prometheus(data))
+        os.replace(tmp_path, path)
+    else:
+        with open(path, "a", encoding="utf-8") as metrics_file:
+            metrics_file.write(json.dumps(data) + "\n")
+
+
+def start_exporter(path=None, interval=EXPORT_INTERVAL):
+    """
+    Export the metrics every interval seconds in a background thread (for long batch jobs).
+    Does nothing when no metrics file is set.
+    """
+    global _exporter
+    path = path or METRICS_FILE
+    if not path or _exporter is not None:
+        return
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            export(path)
+
+    _exporter = threading.Thread(target=loop, daemon=True)
+    _exporter.start()
@@ -0,0 +1,226 @@
+"""
+Persistent cache of cleaned pages.
+
+Pages are stored by a hash of what the page looks like in the PDF (content stream, images,
+fonts, annotations, page box) together with the cleaning settings, so when a new revision of a book
+comes in, the pages that didn't change are copied from the cache instead of rendered and
+cleaned again.
+
+Every cached page is one file in the cache folder, the file's mtime is its last use, that
+is what the LRU eviction sorts on.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import uuid
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "wm-remove-pdf", "pages")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+
+
+# Keys that point away from what a page looks like: back to the page tree or the page,
+# to other pages (link targets, article beads) or to metadata. Following them would hash
+# half the document, and a page's hash would change whenever an unrelated page did.
+SKIPPED_KEYS = {"Parent", "P", "Popup", "IRT", "A", "AA", "Dest", "B", "Thumb", "Metadata", "PieceInfo",
+                "LastModified", "StructParent", "StructParents"}
+
+# Stream keys that only describe how the bytes are stored. The splitter compresses again when
+# it saves, so streams are hashed decoded and these are left out
+STORAGE_KEYS = {"Length", "Filter", "DecodeParms", "DL"}
+
+# Image codecs are hashed as they are stored: they are never re-encoded, and decoding every
+# scan just for a hash would cost as much as rendering it
+IMAGE_FILTERS = ("DCTDecode", "JPXDecode", "JBIG2Decode", "CCITTFaxDecode")
+
+REFERENCE = re.compile(r"\b(\d+)\s+(\d+)\s+R\b")
+
+
+def object_hash(doc, xref, hashes, active=None):
+    """
+    Content hash of a PDF object and of everything it references. Every "N 0 R" is replaced
+    by the hash of object N, so the hash doesn't depend on object numbers (which change when
+    a PDF is split or edited) but does change when anything the object uses changes (soft
+    masks, ToUnicode maps, CID fonts, resources of nested forms...).
+    hashes is a dict of the objects hashed so far, shared by all pages of a document.
+    """
+    if xref in hashes:
+        return hashes[xref]
+    active = active if active is not None else set()
+    if xref in active:
+        return "loop"  # Reference back to an object that is being hashed
+    active.add(xref)
+
+    def resolve(text):
+        return REFERENCE.sub(lambda match: "<" + object_hash(doc, int(match.group(1)), hashes, active) + ">", text)
+
+    digest = hashlib.sha256()
+    keys = doc.xref_get_keys(xref)
+    if not keys:
+        digest.update(resolve(doc.xref_object(xref, compressed=True)).encode())  # Array, number...
+
+    is_stream = doc.xref_is_stream(xref)
+    raw = is_stream and any(codec in doc.xref_get_key(xref, "Filter")[1] for codec in IMAGE_FILTERS)
+    for key in sorted(keys):  # Key order changes when a PDF is saved again
+        if key in SKIPPED_KEYS or (is_stream and not raw and key in STORAGE_KEYS) or key == "Length":
+            continue
+        kind, value = doc.xref_get_key(xref, key)
+        digest.update(f"/{key} {kind} {resolve(value)}\n".encode())
+
+    if raw:
+        digest.update(doc.xref_stream_raw(xref) or b"")
+    elif is_stream:
+        digest.update(doc.xref_stream(xref) or b"")
+
+    active.discard(xref)
+    hashes[xref] = digest.hexdigest()
+    return hashes[xref]
+
+
+def page_fingerprint(doc, page_num, hashes=None):
+    """
+    Hash everything that decides how a page renders: the page box and rotation, and the page
+    object with all it references (content stream, resources with images, fonts, forms and
+    transparency settings, annotations), see object_hash.
+    Pass the same hashes dict for all pages of a document, shared fonts and images are then
+    only hashed once.
+    """
+    hashes = hashes if hashes is not None else {}
+    page = doc[page_num]
+    digest = hashlib.sha256()
+
+    digest.update(repr((tuple(page.mediabox), tuple(page.cropbox), page.rotation)).encode())
+    digest.update(object_hash(doc, page.xref, hashes).encode())
+
+    # Resources can also be inherited from the page tree, which object_hash doesn't follow
+    xref = page.xref
+    kind, value = doc.xref_get_key(xref, "Resources")
+    while kind == "null":
+        kind, parent = doc.xref_get_key(xref, "Parent")
+        if kind != "xref":
+            break
+        xref = int(parent.split()[0])
+        kind, value = doc.xref_get_key(xref, "Resources")
+        if kind != "null":
+            resources = REFERENCE.sub(lambda match: "<" + object_hash(doc, int(match.group(1)), hashes) + ">", value)
+            digest.update(f"inherited {resources}".encode())
+
+    return digest.hexdigest()
+
+
+def cache_key(fingerprint, **params):
+    """
+    Combine a page fingerprint with the cleaning settings (colors, tolerance, DPI, region,
+    engine version...) into the key the page is stored under.
+    """
+    settings = json.dumps(params, sort_keys=True, default=list)
+    return hashlib.sha256(f"{fingerprint}:{settings}".encode()).hexdigest()
+
+
+class PageCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Statistics for this run
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Size of the cache on disk
+        self.size = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.jpg")
+
+    def contains(self, key):
+        """
+        Whether the page is in the cache, without counting a lookup. Another process can evict
+        it right after, so only use this to plan, and copy_to to get the page.
+        """
+        return os.path.exists(self._path(key))
+
+    def lookup(self, key):
+        """
+        Return the path of the cached page, or None on a miss.
+        Another process can evict the file at any time, use copy_to to get the page.
+        """
+        path = self._path(key)
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def copy_to(self, key, output_path):
+        """
+        Copy a cached page to output_path. Returns False on a miss, also when the page was
+        evicted by another process between the lookup and the copy.
+        """
+        path = self.lookup(key)
+        if path is None:
+            return False
+        try:
+            shutil.copyfile(path, output_path)
+        except FileNotFoundError:
+            self.hits -= 1
+            self.misses += 1
+            return False
+        return True
+
+    def store(self, key, image_path):
+        """
+        Add a cleaned page (an image file on disk) to the cache.
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"  # Unique per thread too
+        shutil.copyfile(image_path, tmp_path)
+        try:
+            replaced = os.path.getsize(path)  # Same page stored again (another worker, cleaned again)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)  # Atomic, so other processes never read half a file
+        self.size += os.path.getsize(path) - replaced
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used pages until the cache is back under 90% of max_bytes.
+        """
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith(".jpg")]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+
+        self.size = sum(entry.stat().st_size for entry in entries)
+        target = self.max_bytes * 0.9
+        for entry in entries:
+            if self.size <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.size -= size
+                self.evictions += 1
+            except FileNotFoundError:
+                pass  # Evicted by another process
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size_bytes": self.size,
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"Page cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%}), "
+                     f"{stats['evictions']} evicted, {stats['size_bytes'] / 1024 ** 2:.1f} MB on disk")
@@ -0,0 +1,157 @@
+"""
+Preview: clean a few pages at a low DPI and put them before/after on one image (a contact sheet),
+to check the color, tolerance and region settings in seconds instead of a full run.
+
+The pages are the first and last pages of the document and a few random ones (always the same
+for the same document, the seed is fixed). They go through clean_pdfs, the function the full
+run uses, limited to those pages, so the preview shows exactly what the full run does (JPEG
+compression, odd/even regions and the skipped first page included). The "before" side is the
+same pages rendered at the same DPI.
+
+    python preview.py book.pdf --region 200,770,395,820 --color 220,40,40
+    python preview.py book.pdf --region 0,0,595,60 --color "#C0C0C0" --random 8 --dpi 100 --output sheet.png
+
+Regions are in PDF points (x0,y0,x1,y1 from the top left of the page).
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+import remover  # Assuming remover.py is in the same directory
+import renderer  # Render backends and DPI settings
+
+PREVIEW_DPI = 72  # Enough to judge the settings, and fast
+FIRST_PAGES, LAST_PAGES, RANDOM_PAGES = 1, 1, 4
+SEED = 0
+THUMB_WIDTH = 420  # Width of every page on the sheet, in pixels
+LABEL_HEIGHT = 20
+MARGIN = 10
+
+
+def pick_pages(page_total, first=FIRST_PAGES, last=LAST_PAGES, random_count=RANDOM_PAGES, seed=SEED):
+    """
+    Page numbers (1-based, sorted) to preview: the first and last pages and random_count
+    random pages in between.
+    """
+    pages = set(range(1, min(first, page_total) + 1))
+    pages |= set(range(max(1, page_total - last + 1), page_total + 1))
+    others = [page for page in range(1, page_total + 1) if page not in pages]
+    pages |= set(random.Random(seed).sample(others, min(random_count, len(others))))
+    return sorted(pages)
+
+
+def locate_pages(pdf_paths, pages):
+    """
+    (pdf path, 1-based page number in that PDF) of pages numbered over all the PDFs together
+    (the splits of one document).
+    """
+    located, offset = [], 0
+    for pdf_path in pdf_paths:
+        count = renderer.page_count(pdf_path)
+        located += [(pdf_path, page - offset) for page in pages if offset < page <= offset + count]
+        offset += count
+    return located
+
+
+def contact_sheet(rows, output_path, thumb_width=THUMB_WIDTH):
+    """
+    One image with a row per page: label, page before and after (None when the page is not in
+    the output). rows are (label, before image, after image).
+    """
+    def thumb(image):
+        height = round(image.height * thumb_width / image.width)
+        return image.convert("RGB").resize((thumb_width, height), Image.LANCZOS)
+
+    thumbs = [(label, thumb(before), thumb(after) if after is not None else None) for label, before, after in rows]
+    row_heights = [LABEL_HEIGHT + before.height + MARGIN for _, before, _ in thumbs]
+    sheet = Image.new("RGB", (2 * thumb_width + 3 * MARGIN, LABEL_HEIGHT + sum(row_heights) + MARGIN), "white")
+    draw = ImageDraw.Draw(sheet)
+    draw.text((MARGIN, 4), "before", fill="black")
+    draw.text((2 * MARGIN + thumb_width, 4), "after", fill="black")
+
+    y = LABEL_HEIGHT
+    for (label, before, after), row_height in zip(thumbs, row_heights):
+        draw.text((MARGIN, y + 4), label, fill="black")
+        sheet.paste(before, (MARGIN, y + LABEL_HEIGHT))
+        if after is not None:
+            sheet.paste(after, (2 * MARGIN + thumb_width, y + LABEL_HEIGHT))
+        else:
+            draw.text((2 * MARGIN + thumb_width, y + LABEL_HEIGHT + 4), "not in the output", fill="red")
+        y += row_height
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    sheet.save(output_path)
+    return sheet
+
+
+def preview(pdf_paths, output_path, regions, dpi=PREVIEW_DPI, fill="blend", first=FIRST_PAGES, last=LAST_PAGES, random_count=RANDOM_PAGES, seed=SEED):
+    """
+    Clean a sample of the pages of pdf_paths (the splits of one document) with clean_pdfs and
+    the region entries (see remover.region_entry), and write the before/after contact sheet to
+    output_path. Returns the page numbers shown.
+    """
+    started = time.perf_counter()
+    page_total = sum(renderer.page_count(pdf_path) for pdf_path in pdf_paths)
+    pages = pick_pages(page_total, first, last, random_count, seed)
+
+    output_folder = tempfile.mkdtemp(prefix="wmrem-preview-")
+    try:
+        remover.clean_pdfs(pdf_paths, regions, output_folder, dpi=dpi, fill=fill, pages=set(pages))
+
+        rows = []
+        for page, (pdf_path, page_num) in zip(pages, locate_pages(pdf_paths, pages)):
+            before = renderer.render_pages(pdf_path, dpi, page_num, page_num)[0]
+            after_path = os.path.join(output_folder, f"{os.path.basename(pdf_path)}_page_{page_num}.jpg")
+            after = None
+            if os.path.exists(after_path):  # Page 1 is not in the output
+                with Image.open(after_path) as after_image:
+                    after = after_image.copy()
+            rows.append((f"page {page}", before, after))
+        contact_sheet(rows, output_path)
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+    logging.info(f"Preview of pages {pages} written to {output_path} in {time.perf_counter() - started:.1f}s")
+    return pages
+
+
+def parse_color(color_input):
+    """
+    Parse a color, either HEX (#RRGGBB) or RGB (R,G,B).
+    """
+    color_input = color_input.strip()
+    if color_input.startswith('#'):
+        color_input = color_input[1:]
+        return tuple(int(color_input[i:i + 2], 16) for i in (0, 2, 4))
+    return tuple(map(int, color_input.split(',')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean a few pages at a low DPI and write a before/after contact sheet.")
+    parser.add_argument("inputs", nargs="+", help="the PDF (or its splits, in order)")
+    parser.add_argument("--output", default="preview.png", help="contact sheet image")
+    parser.add_argument("--region", action="append", required=True, help="x0,y0,x1,y1 in PDF points, can be given several times")
+    parser.add_argument("--color", default="#000000", help="watermark color, HEX or R,G,B")
+    parser.add_argument("--tolerance", type=int, default=80)
+    parser.add_argument("--page-set", choices=remover.PAGE_SETS, default="all", help="pages the regions are on")
+    parser.add_argument("--dpi", type=renderer.parse_dpi, default=PREVIEW_DPI, help='a number, or "auto" for the resolution of the scans')
+    parser.add_argument("--fill", choices=remover.FILL_ENGINES, default="blend")
+    parser.add_argument("--first", type=int, default=FIRST_PAGES, help="first pages to show")
+    parser.add_argument("--last", type=int, default=LAST_PAGES, help="last pages to show")
+    parser.add_argument("--random", type=int, default=RANDOM_PAGES, help="random pages to show")
+    parser.add_argument("--seed", type=int, default=SEED, help="another seed shows other random pages")
+    args = parser.parse_args()
+
+    color = parse_color(args.color)
+    regions = [remover.region_entry([float(v) for v in region.split(",")], color, args.tolerance, args.page_set) for region in args.region]
+    pages = preview(args.inputs, args.output, regions, args.dpi, args.fill, args.first, args.last, args.random, args.seed)
+    print(f"Pages {', '.join(map(str, pages))}: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
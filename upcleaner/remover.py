@@ -1,274 +1,481 @@
-import fitz  # PyMuPDF
-from tkinter import Tk, Canvas, Button, Frame, Label
-from PIL import Image, ImageTk, ImageFilter
-
-from scipy.ndimage import binary_dilation, gaussian_filter
-import numpy as np
-import os
-
-# Load PDF file paths from a .txt file
-def load_pdf_paths(file_path):
-    with open(file_path, 'r') as file:
-        pdf_paths = eval(file.read())
-    return pdf_paths
-
-# Convert a PDF page to an image
-def pdf_page_to_image(pdf_path, page_num):
-    doc = fitz.open(pdf_path)
-    page = doc.load_page(page_num)
-    pix = page.get_pixmap()
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-    return img, pix.width, pix.height
-
-# Replace selected color in the region
-
-def color_distance(c1, c2):
-    """Compute the Euclidean distance between two RGB colors."""
-    return np.sqrt(np.sum((np.array(c1) - np.array(c2))**2))
-
-def replace_color_in_region(image, region, target_color, tolerance=80, iterations=5, dilation_radius=3, blur_radius=5):
-    """Replace watermark color with surrounding pixels over multiple iterations."""
-    image_np = np.array(image)  # Convert image to numpy array
-    x_start, y_start, x_end, y_end = region
-
-    # Ensure the region coordinates are ordered correctly
-    if x_start > x_end:
-        x_start, x_end = x_end, x_start
-    if y_start > y_end:
-        y_start, y_end = y_end, y_start
-
-    # Extract the selected region
-    region_image = image_np[y_start:y_end, x_start:x_end]
-
-    # Calculate the absolute difference from the target color
-    diff = np.abs(region_image - target_color)
-    
-    # Create a mask where all RGB channels are within tolerance
-    mask = np.all(diff <= tolerance, axis=-1)  # Match pixels within tolerance
-
-    # Debugging: Check how many pixels match the target color
-    print(f"Mask shape: {mask.shape}, Matching pixels: {np.count_nonzero(mask)}")
-    
-    if np.count_nonzero(mask) == 0:
-        print("No matching pixels found.")
-        return image
-
-    # Apply multiple iterations of replacement and smoothing
-    for _ in range(iterations):
-        region_image = apply_blending(region_image, mask, blur_radius)
-    
-    # Apply dilation to the mask to ensure we cover nearby pixels
-    mask = dilate_mask(mask, dilation_radius)
-    
-    # Replace matching pixels with the blended region
-    for y in range(region_image.shape[0]):
-        for x in range(region_image.shape[1]):
-            if mask[y, x]:
-                # Get valid neighbors for averaging
-                neighbors = []
-                for dy in [-1, 0, 1]:
-                    for dx in [-1, 0, 1]:
-                        ny, nx = y + dy, x + dx
-                        if 0 <= ny < region_image.shape[0] and 0 <= nx < region_image.shape[1]:
-                            if not mask[ny, nx]:  # If neighbor is not the target color
-                                neighbors.append(region_image[ny, nx])
-
-                # Replace the target pixel with the average of valid neighbors
-                if neighbors:
-                    region_image[y, x] = np.mean(neighbors, axis=0).astype(np.uint8)
-                else:
-                    # If no valid neighbors, replace with white or fallback color
-                    region_image[y, x] = [255, 255, 255]
-
-    # Update the image with the modified region
-    image_np[y_start:y_end, x_start:x_end] = region_image
-    return Image.fromarray(image_np)  # Convert back to Image object
-
-def apply_blending(region_image, mask, blur_radius):
-    """Apply a smooth blending filter to the region."""
-    region_image = Image.fromarray(region_image)
-    blurred_region = region_image.filter(ImageFilter.GaussianBlur(blur_radius))  # Apply blur
-    blurred_region_np = np.array(blurred_region)
-
-    # Ensure the dimensions match
-    assert blurred_region_np.shape == region_image.size[::-1] + (3,), "Dimensions mismatch in the image and blurred region."
-
-    # For each pixel in the selected region, apply blending using the blurred version
-    for y in range(region_image.height):
-        for x in range(region_image.width):
-            if mask[y, x]:  # Only process matching pixels
-                region_image.putpixel((x, y), tuple(blurred_region_np[y, x]))  # Replace with blurred pixel
-    
-    return np.array(region_image)
-
-def dilate_mask(mask, radius):
-    """Dilate the mask to cover nearby pixels to ensure a smooth transition."""
-    dilated_mask = binary_dilation(mask, structure=np.ones((radius, radius)))
-    return dilated_mask.astype(np.bool)
-
-# Tkinter GUI for region and color selection
-class RegionSelector:
-    def __init__(self, pdf_paths):
-        self.pdf_paths = pdf_paths
-        self.selected_region = None
-        self.selected_color = None
-        self.root = Tk()
-        self.root.title("PDF Watermark Replacer")
-        self.init_gui()
-
-    def init_gui(self):
-        """Initialize the GUI components."""
-        # Top frame for buttons
-        self.top_frame = Frame(self.root)
-        self.top_frame.pack(fill="x", pady=5)
-
-        self.info_label = Label(self.top_frame, text="Select a region and color on Page 2 of the first PDF.")
-        self.info_label.pack(side="left", padx=10)
-
-        self.next_button = Button(self.top_frame, text="Next", command=self.process_pdfs, state="disabled")
-        self.next_button.pack(side="right", padx=5)
-
-        self.pick_color_button = Button(self.top_frame, text="Pick Color", command=self.pick_color, state="disabled")
-        self.pick_color_button.pack(side="right", padx=5)
-
-        self.clear_button = Button(self.top_frame, text="Clear Selection", command=self.clear_selection)
-        self.clear_button.pack(side="right", padx=5)
-
-        # Canvas for displaying the PDF page image
-        self.canvas = Canvas(self.root)
-        self.canvas.pack(fill="both", expand=True)
-
-        # Bind mouse click events for region selection
-        self.canvas.bind("<Button-1>", self.on_canvas_click)
-
-        # Load the second page of the first PDF
-        self.load_second_page()
-
-    def load_second_page(self):
-        """Load the second page of the first PDF for selection."""
-        pdf_path = self.pdf_paths[0]
-        img, width, height = pdf_page_to_image(pdf_path, 1)  # Page 2 is at index 1
-        self.image = img
-        self.tk_image = ImageTk.PhotoImage(img)
-        self.canvas.delete("all")
-        self.canvas.create_image(0, 0, image=self.tk_image, anchor="nw")
-        self.canvas.config(scrollregion=(0, 0, width, height))
-
-    def on_canvas_click(self, event):
-        """Handle mouse clicks for selecting a region."""
-        if self.selected_region is None:
-            # Start of selection rectangle
-            self.selected_region = [event.x, event.y, None, None]
-        else:
-            # End of selection rectangle
-            self.selected_region[2], self.selected_region[3] = event.x, event.y
-
-            # Ensure the selected region has valid coordinates
-            if self.selected_region[0] > self.selected_region[2]:
-                self.selected_region[0], self.selected_region[2] = self.selected_region[2], self.selected_region[0]
-            if self.selected_region[1] > self.selected_region[3]:
-                self.selected_region[1], self.selected_region[3] = self.selected_region[3], self.selected_region[1]
-
-            self.draw_region()
-
-            # Print the selected region for debugging
-            print(f"Region selected: {self.selected_region}")
-
-            self.pick_color_button.config(state="normal")
-
-
-    def draw_region(self):
-        """Draw the selection rectangle on the canvas."""
-        if self.selected_region and None not in self.selected_region:
-            self.canvas.delete("region")
-            x_start, y_start, x_end, y_end = self.selected_region
-            self.canvas.create_rectangle(x_start, y_start, x_end, y_end, outline="red", width=2, tags="region")
-
-
-    def clear_selection(self):
-        """Clear the current region and color selection."""
-        self.selected_region = None
-        self.selected_color = None
-        self.canvas.delete("region")
-        self.pick_color_button.config(state="disabled")
-        self.next_button.config(state="disabled")
-
-    def pick_color(self):
-        """Pick a color within the selected region."""
-        def on_color_pick(event):
-            x, y = event.x, event.y
-            self.selected_color = self.image.getpixel((x, y))
-            print(f"Selected color: {self.selected_color}")
-            self.next_button.config(state="normal")
-            self.canvas.unbind("<Button-1>")
-
-        self.canvas.bind("<Button-1>", on_color_pick)
-
-    def calculate_surrounding_color(image, region, margin=10):
-        """Calculate the average color from the region around the watermark."""
-        x_start, y_start, x_end, y_end = region
-
-        # Create a margin around the selected region to calculate the surrounding color
-        surrounding_x_start = max(x_start - margin, 0)
-        surrounding_y_start = max(y_start - margin, 0)
-        surrounding_x_end = x_end + margin
-        surrounding_y_end = y_end + margin
-
-        # Ensure that the surrounding region is within image bounds
-        surrounding_x_end = min(surrounding_x_end, image.width)
-        surrounding_y_end = min(surrounding_y_end, image.height)
-
-        surrounding_region = image.crop((surrounding_x_start, surrounding_y_start, surrounding_x_end, surrounding_y_end))
-
-        # Convert surrounding region to numpy array and calculate average color
-        surrounding_np = np.array(surrounding_region)
-
-        # Calculate the average color (mean of all pixels in the region)
-        avg_color = np.mean(surrounding_np, axis=(0, 1)).astype(int)
-        return tuple(avg_color)  # Return the average color as a tuple (R, G, B)
-
-    def process_pdfs(self):
-        """Apply region and color replacement to all pages of all PDFs."""
-        if not self.selected_region or not self.selected_color:
-            print("No region or color selected!")
-            return
-
-        output_folder = "output_images"
-        os.makedirs(output_folder, exist_ok=True)
-
-        for pdf_index, pdf_path in enumerate(self.pdf_paths):
-            doc = fitz.open(pdf_path)
-            print(f"Processing {pdf_path}...")
-
-            # Process all pages, but skip page 1 (index 0) for the first PDF (file1.pdf)
-            for page_num in range(len(doc)):
-                # If this is the first PDF, skip the first page (index 0)
-                if pdf_index == 0 and page_num == 0:
-                    continue  # Skip the first page of the first PDF
-
-                img, _, _ = pdf_page_to_image(pdf_path, page_num)
-                img = replace_color_in_region(img, self.selected_region, self.selected_color)
-
-                # Save the image as JPG with quality control
-                jpg_path = f"{output_folder}/{os.path.basename(pdf_path)}_page_{page_num + 1}.jpg"
-                img.save(jpg_path, "JPEG", quality=90, optimize=True, progressive=True)  # You can adjust the quality (0-100)
-
-            print(f"Processing complete! Images saved in {output_folder}")
-    
-        self.root.quit()
-    
-    def start(self):
-        """Start the Tkinter event loop."""
-        self.root.mainloop()
-
-# Main function
-def main():
-    pdf_paths = load_pdf_paths("output.txt")  # Update path to your .txt file
-    selector = RegionSelector(pdf_paths)
-    selector.start()
-
-def run():
-    main()
-
-if __name__ == "__main__":
-    main()
+import fitz  # PyMuPDF
+from tkinter import Tk, Canvas, Button, Frame, Label, Checkbutton, BooleanVar, Entry, OptionMenu, StringVar
+from PIL import Image, ImageTk, ImageFilter
+
+from scipy.ndimage import binary_dilation, distance_transform_edt, gaussian_filter
+import numpy as np
+import math
+import os
+import renderer  # Render backends (PyMuPDF / poppler)
+import metrics  # Per-stage timings, exported when WMREM_METRICS_FILE is set
+import profiler  # Per-page trace timeline when WMREM_PROFILE is set
+import kernels  # Mask and fill kernels: NumPy, numexpr or Numba
+import color_detect  # Guesses the watermark color from a few pages
+from page_cache import PageCache, page_fingerprint, cache_key
+
+# Bump this when the cleaning output changes, so old pages in the cache are not used anymore
+ENGINE_VERSION = "upcleaner-2"
+
+# Regions are kept in PDF points (1/72 inch, from the top left of the page), so the page can be
+# shown at one DPI to select them and cleaned at another
+PREVIEW_DPI = 72  # The page shown in the selector, cheap to render
+PROCESS_DPI = 150  # Default DPI the pages are cleaned and saved at
+
+# How the watermark pixels are filled: "blend" blurs the region again and again (slow, soft),
+# "nearest" copies the closest non-watermark pixel in one pass (fast)
+FILL_ENGINES = ("blend", "nearest")
+
+# Load PDF file paths from a .txt file
+def load_pdf_paths(file_path):
+    with open(file_path, 'r') as file:
+        pdf_paths = eval(file.read())
+    return pdf_paths
+
+# Convert a PDF page to an image
+def pdf_page_to_image(pdf_path, page_num, dpi=72):
+    img = renderer.render_pages(pdf_path, dpi, page_num + 1, page_num + 1)[0]
+    return img, img.width, img.height
+
+def pixels_to_points(region, dpi):
+    """A region in pixels of a page rendered at dpi, in PDF points."""
+    return [round(v * 72 / dpi, 2) for v in region]
+
+def points_to_pixels(region, dpi, width=None, height=None):
+    """A region in PDF points, in pixels of the page rendered at dpi. The pixel box covers the
+    whole region (rounded outwards) and is clipped to width x height when they are given."""
+    scale = dpi / 72
+    x_start, x_end = sorted((region[0], region[2]))
+    y_start, y_end = sorted((region[1], region[3]))
+    pixels = [math.floor(x_start * scale), math.floor(y_start * scale), math.ceil(x_end * scale), math.ceil(y_end * scale)]
+    if width is not None:
+        pixels[0], pixels[2] = max(0, min(pixels[0], width)), max(0, min(pixels[2], width))
+    if height is not None:
+        pixels[1], pixels[3] = max(0, min(pixels[1], height)), max(0, min(pixels[3], height))
+    return pixels
+
+# Replace selected color in the region
+
+def color_distance(c1, c2):
+    """Compute the Euclidean distance between two RGB colors."""
+    return np.sqrt(np.sum((np.array(c1) - np.array(c2))**2))
+
+def replace_color_in_region(image, region, target_color, tolerance=80, iterations=5, dilation_radius=3, blur_radius=5, fill="blend", smooth_radius=1):
+    """Replace watermark color with surrounding pixels over multiple iterations.
+    fill="nearest" uses fill_nearest instead (iterations and blur_radius are not used then)."""
+    image_np = np.array(image)  # Convert image to numpy array
+    x_start, y_start, x_end, y_end = region
+
+    # Ensure the region coordinates are ordered correctly
+    if x_start > x_end:
+        x_start, x_end = x_end, x_start
+    if y_start > y_end:
+        y_start, y_end = y_end, y_start
+
+    # Extract the selected region
+    region_image = image_np[y_start:y_end, x_start:x_end]
+    backend = kernels.get_backend()  # NumPy, numexpr or Numba, whichever is fastest here
+
+    with metrics.stage("mask", pages=1, bytes_in=region_image.nbytes):
+        # Create a mask where all RGB channels are within tolerance of the target color
+        mask = backend.mask(region_image, [c - tolerance for c in target_color], [c + tolerance for c in target_color])
+
+    # Debugging: Check how many pixels match the target color
+    print(f"Mask shape: {mask.shape}, Matching pixels: {np.count_nonzero(mask)}")
+    
+    if np.count_nonzero(mask) == 0:
+        print("No matching pixels found.")
+        return image
+
+    if fill == "nearest":
+        with metrics.stage("fill", pages=1):
+            region_image = fill_nearest(region_image, dilate_mask(mask, dilation_radius), smooth_radius)
+        image_np[y_start:y_end, x_start:x_end] = region_image
+        return Image.fromarray(image_np)
+
+    with metrics.stage("fill", pages=1):
+        # Apply multiple iterations of replacement and smoothing
+        for _ in range(iterations):
+            region_image = apply_blending(region_image, mask, blur_radius)
+    
+        # Apply dilation to the mask to ensure we cover nearby pixels
+        mask = dilate_mask(mask, dilation_radius)
+    
+        # Replace every matching pixel with the average of its neighbors that are not the target
+        # color (white if there are none)
+        backend.neighbor_mean(region_image, mask)
+
+    # Update the image with the modified region
+    image_np[y_start:y_end, x_start:x_end] = region_image
+    return Image.fromarray(image_np)  # Convert back to Image object
+
+def fill_nearest(region_image, mask, smooth_radius=1):
+    """Replace every masked pixel with the nearest unmasked pixel, all in one pass
+    (distance transform), then blur the filled pixels once if smooth_radius is set."""
+    if mask.all():
+        region_image[...] = 255  # Nothing left to copy from
+        return region_image
+
+    # For every pixel, the coordinates of the closest pixel outside the mask
+    _, (nearest_y, nearest_x) = distance_transform_edt(mask, return_indices=True)
+    filled = region_image[nearest_y, nearest_x]
+
+    if smooth_radius:
+        # Blur only along the image axes, not across the color channels
+        sigma = (smooth_radius, smooth_radius) + (0,) * (filled.ndim - 2)
+        filled = gaussian_filter(filled.astype(np.float32), sigma).round().astype(np.uint8)
+
+    kernels.get_backend().copy_masked(region_image, filled, mask)
+    return region_image
+
+def apply_blending(region_image, mask, blur_radius):
+    """Apply a smooth blending filter to the region."""
+    blurred_region = Image.fromarray(region_image).filter(ImageFilter.GaussianBlur(blur_radius))  # Apply blur
+    blurred_region_np = np.array(blurred_region)
+
+    # Ensure the dimensions match
+    assert blurred_region_np.shape == region_image.shape[:2] + (3,), "Dimensions mismatch in the image and blurred region."
+
+    # Replace the matching pixels with the blurred version
+    kernels.get_backend().copy_masked(region_image, blurred_region_np, mask)
+    return region_image
+
+def dilate_mask(mask, radius):
+    """Dilate the mask to cover nearby pixels to ensure a smooth transition."""
+    dilated_mask = binary_dilation(mask, structure=np.ones((radius, radius)))
+    return dilated_mask.astype(np.bool)
+
+PAGE_SETS = ("all", "odd", "even")
+
+def region_entry(region, color, tolerance=80, pages="all"):
+    """One watermark to remove: a region (in PDF points, see pixels_to_points), its color and
+    tolerance, and the pages it is on ("all", "odd" or "even", counted over all the PDFs together)."""
+    if pages not in PAGE_SETS:
+        raise ValueError(f"Unknown page set: {pages}")
+    return {"region": list(region), "color": tuple(color), "tolerance": tolerance, "pages": pages}
+
+def regions_for_page(regions, page_number):
+    """The region entries that apply to a page (1-based page number)."""
+    parity = "odd" if page_number % 2 else "even"
+    return [entry for entry in regions if entry["pages"] in ("all", parity)]
+
+def clean_pdfs(pdf_paths, regions, output_folder="output_images", page_cache=None, dpi=PROCESS_DPI, fill="blend", pages=None):
+    """
+    Headless version of the cleaning step: apply every region entry (see region_entry) to the
+    pages it is for and save the pages as <pdf name>_page_<n>.jpg in output_folder.
+    Every page is rendered at dpi (a number or "auto", see renderer.parse_dpi) and saved once,
+    however many regions it has. The regions are in points, they fit the page at any DPI.
+    fill is one of FILL_ENGINES.
+    Page 1 of the first PDF is skipped, like the UI always did.
+    With a PageCache, pages cleaned before with the same settings are copied from the cache.
+    With pages (page numbers counted over all the PDFs, from 1) only those pages are done, for previews.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    page_offset = 0  # The PDFs are the parts of one document, odd/even is counted over all of them
+    for pdf_index, pdf_path in enumerate(pdf_paths):
+        doc = fitz.open(pdf_path)
+        hashes = {}  # Objects already hashed for the page cache, fonts and images are shared by pages
+        print(f"Processing {pdf_path}...")
+
+        # Process all pages, but skip page 1 (index 0) for the first PDF (file1.pdf)
+        for page_num in range(len(doc)):
+            # If this is the first PDF, skip the first page (index 0)
+            if pdf_index == 0 and page_num == 0:
+                continue  # Skip the first page of the first PDF
+            if pages is not None and page_offset + page_num + 1 not in pages:
+                continue
+
+            page_regions = regions_for_page(regions, page_offset + page_num + 1)
+            with profiler.page(f"{os.path.basename(pdf_path)}#{page_num + 1}"):
+                jpg_path = f"{output_folder}/{os.path.basename(pdf_path)}_page_{page_num + 1}.jpg"
+
+                # Skip rendering and cleaning if this page is in the cache
+                if page_cache is not None:
+                    with metrics.stage("hash", pages=1):
+                        key = cache_key(page_fingerprint(doc, page_num, hashes), engine=ENGINE_VERSION, regions=page_regions,
+                                        dpi=dpi, fill=fill)
+                    if page_cache.copy_to(key, jpg_path):
+                        continue
+
+                img, width, height = pdf_page_to_image(pdf_path, page_num, dpi)
+                page_dpi = width * 72 / doc[page_num].rect.width  # The real one, also when dpi is "auto"
+                for entry in page_regions:
+                    region = points_to_pixels(entry["region"], page_dpi, width, height)
+                    img = replace_color_in_region(img, region, entry["color"], entry["tolerance"], fill=fill)
+
+                # Save the image as JPG with quality control
+                with metrics.stage("encode", pages=1, bytes_in=metrics.image_bytes(img)) as measurement:
+                    img.save(jpg_path, "JPEG", quality=90, optimize=True, progressive=True)  # You can adjust the quality (0-100)
+                    measurement["bytes_out"] = os.path.getsize(jpg_path)
+                if page_cache is not None:
+                    page_cache.store(key, jpg_path)
+
+        page_offset += len(doc)
+        doc.close()
+        print(f"Processing complete! Images saved in {output_folder}")
+
+# Tkinter GUI for region and color selection
+class RegionSelector:
+    def __init__(self, pdf_paths, output_folder="output_images"):
+        self.pdf_paths = pdf_paths
+        self.output_folder = output_folder
+        self.selected_region = None
+        self.selected_color = None
+        self.regions = []  # Region entries added so far (see region_entry)
+        self.page_cache = PageCache()  # Pages cleaned before with the same settings are reused
+        self.root = Tk()
+        self.root.title("PDF Watermark Replacer")
+        self.init_gui()
+
+    def init_gui(self):
+        """Initialize the GUI components."""
+        # Top frame for buttons
+        self.top_frame = Frame(self.root)
+        self.top_frame.pack(fill="x", pady=5)
+
+        self.info_label = Label(self.top_frame, text="Select a region and color on Page 2 of the first PDF.")
+        self.info_label.pack(side="left", padx=10)
+
+        self.next_button = Button(self.top_frame, text="Next", command=self.process_pdfs, state="disabled")
+        self.next_button.pack(side="right", padx=5)
+
+        # A few pages cleaned at a low DPI, before/after on one image, to check the regions first
+        self.preview_button = Button(self.top_frame, text="Preview", command=self.preview, state="disabled")
+        self.preview_button.pack(side="right", padx=5)
+
+        # Several watermarks (header and footer...): add every region with its color, they are all removed in one run
+        self.add_region_button = Button(self.top_frame, text="Add Region", command=self.add_region, state="disabled")
+        self.add_region_button.pack(side="right", padx=5)
+
+        self.pages_var = StringVar(value="all")
+        OptionMenu(self.top_frame, self.pages_var, *PAGE_SETS).pack(side="right", padx=5)
+        Label(self.top_frame, text="Pages:").pack(side="right")
+
+        self.tolerance_entry = Entry(self.top_frame, width=4)
+        self.tolerance_entry.insert(0, "80")
+        self.tolerance_entry.pack(side="right", padx=5)
+        Label(self.top_frame, text="Tolerance:").pack(side="right")
+
+        # The DPI the pages are cleaned at, the preview below stays at PREVIEW_DPI
+        self.dpi_entry = Entry(self.top_frame, width=5)
+        self.dpi_entry.insert(0, str(PROCESS_DPI))
+        self.dpi_entry.pack(side="right", padx=5)
+        Label(self.top_frame, text="DPI:").pack(side="right")
+
+        self.pick_color_button = Button(self.top_frame, text="Pick Color", command=self.pick_color, state="disabled")
+        self.pick_color_button.pack(side="right", padx=5)
+
+        # Or let the colors in the region on a few pages decide (color and tolerance)
+        self.detect_color_button = Button(self.top_frame, text="Detect Color", command=self.detect_color, state="disabled")
+        self.detect_color_button.pack(side="right", padx=5)
+
+        self.clear_button = Button(self.top_frame, text="Clear Selection", command=self.clear_selection)
+        self.clear_button.pack(side="right", padx=5)
+
+        # Fast fill: copy the nearest clean pixel instead of blurring the region 5 times
+        self.fast_fill_var = BooleanVar(value=False)
+        self.fast_fill_check = Checkbutton(self.top_frame, text="Fast fill", variable=self.fast_fill_var)
+        self.fast_fill_check.pack(side="right", padx=5)
+
+        # Canvas for displaying the PDF page image
+        self.canvas = Canvas(self.root)
+        self.canvas.pack(fill="both", expand=True)
+
+        # Bind mouse click events for region selection
+        self.canvas.bind("<Button-1>", self.on_canvas_click)
+
+        # Load the second page of the first PDF
+        self.load_second_page()
+
+    def load_second_page(self):
+        """Load the second page of the first PDF for selection."""
+        pdf_path = self.pdf_paths[0]
+        img, width, height = pdf_page_to_image(pdf_path, 1, PREVIEW_DPI)  # Page 2 is at index 1
+        self.image = img
+        self.tk_image = ImageTk.PhotoImage(img)
+        self.canvas.delete("all")
+        self.canvas.create_image(0, 0, image=self.tk_image, anchor="nw")
+        self.canvas.config(scrollregion=(0, 0, width, height))
+
+    def on_canvas_click(self, event):
+        """Handle mouse clicks for selecting a region."""
+        if self.selected_region is None:
+            # Start of selection rectangle
+            self.selected_region = [event.x, event.y, None, None]
+        else:
+            # End of selection rectangle
+            self.selected_region[2], self.selected_region[3] = event.x, event.y
+
+            # Ensure the selected region has valid coordinates
+            if self.selected_region[0] > self.selected_region[2]:
+                self.selected_region[0], self.selected_region[2] = self.selected_region[2], self.selected_region[0]
+            if self.selected_region[1] > self.selected_region[3]:
+                self.selected_region[1], self.selected_region[3] = self.selected_region[3], self.selected_region[1]
+
+            self.draw_region()
+
+            # Print the selected region for debugging
+            print(f"Region selected: {self.selected_region}")
+
+            self.pick_color_button.config(state="normal")
+            self.detect_color_button.config(state="normal")
+
+
+    def draw_region(self):
+        """Draw the selection rectangle on the canvas."""
+        if self.selected_region and None not in self.selected_region:
+            self.canvas.delete("region")
+            x_start, y_start, x_end, y_end = self.selected_region
+            self.canvas.create_rectangle(x_start, y_start, x_end, y_end, outline="red", width=2, tags="region")
+
+
+    def clear_selection(self):
+        """Clear the current region and color selection, and the regions added before."""
+        self.selected_region = None
+        self.selected_color = None
+        self.regions = []
+        self.canvas.delete("region")
+        self.canvas.delete("added_region")
+        self.canvas.bind("<Button-1>", self.on_canvas_click)
+        self.pick_color_button.config(state="disabled")
+        self.detect_color_button.config(state="disabled")
+        self.add_region_button.config(state="disabled")
+        self.next_button.config(state="disabled")
+        self.preview_button.config(state="disabled")
+
+    def add_region(self):
+        """Add the current region and color to the list, then a new region can be selected."""
+        try:
+            tolerance = int(self.tolerance_entry.get())
+        except ValueError:
+            print("Invalid tolerance value!")
+            return
+        # The canvas shows the page at PREVIEW_DPI, the region is kept in points
+        entry = region_entry(pixels_to_points(self.selected_region, PREVIEW_DPI), self.selected_color[:3], tolerance, self.pages_var.get())
+        self.regions.append(entry)
+        print(f"Region added: {entry}")
+
+        # Keep the added region on the canvas, in blue
+        x_start, y_start, x_end, y_end = self.selected_region
+        self.canvas.delete("region")
+        self.canvas.create_rectangle(x_start, y_start, x_end, y_end, outline="blue", width=2, tags="added_region")
+        self.canvas.create_text(x_start + 4, y_start + 2, text=f"{len(self.regions)} ({entry['pages']})", anchor="nw", fill="blue", tags="added_region")
+
+        self.selected_region = None
+        self.selected_color = None
+        self.pick_color_button.config(state="disabled")
+        self.detect_color_button.config(state="disabled")
+        self.add_region_button.config(state="disabled")
+
+    def pick_color(self):
+        """Pick a color within the selected region."""
+        def on_color_pick(event):
+            x, y = event.x, event.y
+            self.selected_color = self.image.getpixel((x, y))
+            print(f"Selected color: {self.selected_color}")
+            self.next_button.config(state="normal")
+            self.preview_button.config(state="normal")
+            self.add_region_button.config(state="normal")
+            self.canvas.bind("<Button-1>", self.on_canvas_click)  # Back to selecting regions
+
+        self.canvas.bind("<Button-1>", on_color_pick)
+
+    def detect_color(self):
+        """Find the watermark color in the selected region, on a few pages of all the PDFs."""
+        self.info_label.config(text="Detecting the watermark color...")
+        self.root.update_idletasks()
+        candidates = color_detect.detect_colors(self.pdf_paths, region=pixels_to_points(self.selected_region, PREVIEW_DPI))
+        self.info_label.config(text=color_detect.describe(candidates))
+        print(color_detect.describe(candidates))
+        if not candidates:
+            return
+        self.selected_color = candidates[0]["color"]
+        self.tolerance_entry.delete(0, "end")
+        self.tolerance_entry.insert(0, str(candidates[0]["tolerance"]))
+        self.next_button.config(state="normal")
+        self.preview_button.config(state="normal")
+        self.add_region_button.config(state="normal")
+
+    def preview(self):
+        """Clean the first, last and a few random pages at a low DPI with the regions so far
+        (and the current one), and open the before/after contact sheet."""
+        import preview  # preview.py imports this module
+        regions = list(self.regions)
+        if self.selected_region and None not in self.selected_region and self.selected_color:
+            try:
+                tolerance = int(self.tolerance_entry.get())
+            except ValueError:
+                print("Invalid tolerance value!")
+                return
+            regions.append(region_entry(pixels_to_points(self.selected_region, PREVIEW_DPI), self.selected_color[:3], tolerance, self.pages_var.get()))
+        if not regions:
+            print("No region or color selected!")
+            return
+
+        self.info_label.config(text="Making the preview...")
+        self.root.update_idletasks()
+        sheet_path = os.path.join(os.path.dirname(os.path.abspath(self.output_folder)), "preview.png")
+        fill = "nearest" if self.fast_fill_var.get() else "blend"
+        pages = preview.preview(self.pdf_paths, sheet_path, regions, preview.PREVIEW_DPI, fill)
+        self.info_label.config(text=f"Preview of pages {', '.join(map(str, pages))}: {sheet_path}")
+        Image.open(sheet_path).show()
+
+    def calculate_surrounding_color(image, region, margin=10):
+        """Calculate the average color from the region around the watermark."""
+        x_start, y_start, x_end, y_end = region
+
+        # Create a margin around the selected region to calculate the surrounding color
+        surrounding_x_start = max(x_start - margin, 0)
+        surrounding_y_start = max(y_start - margin, 0)
+        surrounding_x_end = x_end + margin
+        surrounding_y_end = y_end + margin
+
+        # Ensure that the surrounding region is within image bounds
+        surrounding_x_end = min(surrounding_x_end, image.width)
+        surrounding_y_end = min(surrounding_y_end, image.height)
+
+        surrounding_region = image.crop((surrounding_x_start, surrounding_y_start, surrounding_x_end, surrounding_y_end))
+
+        # Convert surrounding region to numpy array and calculate average color
+        surrounding_np = np.array(surrounding_region)
+
+        # Calculate the average color (mean of all pixels in the region)
+        avg_color = np.mean(surrounding_np, axis=(0, 1)).astype(int)
+        return tuple(avg_color)  # Return the average color as a tuple (R, G, B)
+
+    def process_pdfs(self):
+        """Apply region and color replacement to all pages of all PDFs."""
+        # A region with its color that wasn't added yet counts too
+        if self.selected_region and None not in self.selected_region and self.selected_color:
+            self.add_region()
+        if not self.regions:
+            print("No region or color selected!")
+            return
+
+        try:
+            dpi = renderer.parse_dpi(self.dpi_entry.get())
+        except ValueError:
+            print("Invalid DPI value!")
+            return
+
+        fill = "nearest" if self.fast_fill_var.get() else "blend"
+        clean_pdfs(self.pdf_paths, self.regions, self.output_folder, page_cache=self.page_cache, dpi=dpi, fill=fill)
+
+        print(f"Page cache: {self.page_cache.stats()}")
+        self.root.quit()
+    
+    def start(self):
+        """Start the Tkinter event loop."""
+        self.root.mainloop()
+
+# Main function
+def main(list_file="output.txt", output_folder="output_images"):
+    pdf_paths = load_pdf_paths(list_file)  # Written by the splitter
+    selector = RegionSelector(pdf_paths, output_folder)
+    selector.start()
+
+def run(list_file="output.txt", output_folder="output_images"):
+    main(list_file, output_folder)
+
+if __name__ == "__main__":
+    main()
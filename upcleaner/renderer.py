@@ -0,0 +1,253 @@
+"""
+Render backends: turn PDF pages into PIL images.
+
+    pymupdf     renders in-process with PyMuPDF, no temp files, no extra process
+    poppler     pdf2image + pdftoppm, several pdftoppm threads
+    pdftocairo  pdf2image + pdftocairo, sometimes faster/better on vector heavy pages
+
+"auto" renders a couple of sample pages with every available backend and keeps the
+fastest one for that kind of document (scanned vs vector, DPI).
+
+The DPI can be a number or "auto": every page is then rendered at the resolution of the
+scan embedded in it, so scans are neither upsampled nor downsampled. Pages without a scan
+use VECTOR_DPI, or the number after the colon ("auto:300").
+"""
+import itertools
+import logging
+import math
+import os
+import shutil
+import time
+
+from PIL import Image
+
+import metrics
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+try:
+    from pdf2image import convert_from_path, pdfinfo_from_path
+except ImportError:
+    convert_from_path = None
+
+DEFAULT_BACKEND = "auto"
+BENCHMARK_PAGES = 2  # Pages rendered per backend when picking one
+
+AUTO_DPI = "auto"
+VECTOR_DPI = 150  # DPI in auto mode for pages without a scan
+MIN_NATIVE_DPI, MAX_NATIVE_DPI = 72, 600  # Broken or odd scans stay in a sane range
+
+
+class PymupdfRenderer:
+    name = "pymupdf"
+
+    def available(self):
+        return fitz is not None
+
+    def render(self, pdf_path, dpi, first_page=None, last_page=None, grayscale=False):
+        """
+        Render pages first_page..last_page (1-based, inclusive, like pdf2image) to RGB images,
+        or single channel "L" images with grayscale=True.
+        """
+        colorspace, mode = (fitz.csGRAY, "L") if grayscale else (fitz.csRGB, "RGB")
+        images = []
+        with fitz.open(pdf_path) as doc:
+            first = (first_page or 1) - 1
+            last = (last_page or len(doc)) - 1
+            for page_num in range(first, last + 1):
+                pix = doc[page_num].get_pixmap(dpi=dpi, colorspace=colorspace, alpha=False)
+                images.append(Image.frombytes(mode, (pix.width, pix.height), pix.samples))
+        return images
+
+
+class PopplerRenderer:
+    name = "poppler"
+    use_pdftocairo = False
+
+    def __init__(self, thread_count=None):
+        # pdftoppm doesn't get faster past a few threads, and every thread is a process
+        self.thread_count = thread_count or min(4, os.cpu_count() or 1)
+
+    def available(self):
+        tool = "pdftocairo" if self.use_pdftocairo else "pdftoppm"
+        return convert_from_path is not None and shutil.which(tool) is not None
+
+    def render(self, pdf_path, dpi, first_page=None, last_page=None, grayscale=False):
+        return convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            first_page=first_page,
+            last_page=last_page,
+            thread_count=self.thread_count,
+            use_pdftocairo=self.use_pdftocairo,
+            grayscale=grayscale,
+        )
+
+
+class PdftocairoRenderer(PopplerRenderer):
+    name = "pdftocairo"
+    use_pdftocairo = True
+
+
+BACKENDS = {backend.name: backend for backend in [PymupdfRenderer(), PopplerRenderer(), PdftocairoRenderer()]}
+
+# Backend picked by the benchmark for every document profile, so it only runs once
+_auto_choice = {}
+
+# What was already worked out about a file, per file_key: callers render one page or one range
+# at a time, every call would open and sample the document again
+_profiles = {}  # file key -> "scanned" / "vector"
+_native_dpis = {}  # (file key, vector DPI) -> {page number: native DPI}
+
+
+def page_count(pdf_path):
+    if fitz is not None:
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+    return pdfinfo_from_path(pdf_path)["Pages"]
+
+
+def file_key(pdf_path):
+    """
+    Identifies a version of a file: path, modification time and size.
+    """
+    stat = os.stat(pdf_path)
+    return (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+
+
+def document_profile(pdf_path, dpi):
+    """
+    Rough description of a document, backends are picked per profile.
+    "scanned" when most pages are one big image, "vector" otherwise.
+    """
+    if fitz is None:
+        return ("unknown", dpi)
+
+    key = file_key(pdf_path)
+    if key not in _profiles:
+        with fitz.open(pdf_path) as doc:
+            sample = range(0, len(doc), max(1, len(doc) // 5))
+            image_pages = sum(1 for page_num in sample if doc[page_num].get_images())
+            _profiles[key] = "scanned" if image_pages * 2 > len(sample) else "vector"
+    return (_profiles[key], dpi)
+
+
+def benchmark(pdf_path, dpi, pages=BENCHMARK_PAGES):
+    """
+    Time every available backend on the first pages of the document, one page per call like
+    the cleaners do. Returns {backend name: seconds per page}.
+    """
+    pages = min(pages, page_count(pdf_path))
+    results = {}
+    for name, backend in BACKENDS.items():
+        if not backend.available():
+            continue
+        try:
+            started = time.perf_counter()
+            for page in range(1, pages + 1):
+                backend.render(pdf_path, dpi, page, page)
+            results[name] = (time.perf_counter() - started) / pages
+        except Exception as e:
+            logging.warning(f"Render backend {name} failed during benchmark: {e}")
+    return results
+
+
+def pick_backend(pdf_path, dpi):
+    """
+    Return the fastest backend for this kind of document, benchmarking it the first time.
+    """
+    profile = document_profile(pdf_path, dpi)
+    if profile not in _auto_choice:
+        results = benchmark(pdf_path, dpi)
+        if not results:
+            raise RuntimeError("No render backend available, install PyMuPDF or poppler.")
+        _auto_choice[profile] = min(results, key=results.get)
+        logging.info(f"Render backend for {profile}: {_auto_choice[profile]} ({results})")
+    return BACKENDS[_auto_choice[profile]]
+
+
+def parse_dpi(value):
+    """
+    Read a DPI setting: a number, "auto" or "auto:<DPI for pages without a scan>".
+    Raises ValueError for anything else.
+    """
+    text = str(value).strip().lower()
+    if text == AUTO_DPI:
+        return AUTO_DPI
+    if text.startswith(AUTO_DPI + ":"):
+        return f"{AUTO_DPI}:{int(text[len(AUTO_DPI) + 1:])}"
+    return int(text)
+
+
+def native_dpi(page, vector_dpi=VECTOR_DPI):
+    """
+    Resolution of the scan on a PyMuPDF page: pixels of its biggest image over the size the
+    image is drawn at. vector_dpi when no image covers at least a quarter of the page.
+    """
+    page_area = page.rect.width * page.rect.height
+    biggest, biggest_area = None, 0
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"]) & page.rect
+        if not bbox.is_empty and bbox.width * bbox.height > biggest_area:
+            biggest, biggest_area = info, bbox.width * bbox.height
+    if biggest is None or biggest_area < page_area / 4:
+        return vector_dpi  # No scan, small logos and pictures don't count
+
+    # Drawn size in points from the transform matrix, so rotated scans work too
+    a, b, c, d = biggest["transform"][:4]
+    width_points, height_points = math.hypot(a, b), math.hypot(c, d)
+    dpi = max(biggest["width"] * 72 / width_points, biggest["height"] * 72 / height_points)
+    return int(min(MAX_NATIVE_DPI, max(MIN_NATIVE_DPI, round(dpi))))
+
+
+def page_dpis(pdf_path, first_page=None, last_page=None, vector_dpi=VECTOR_DPI):
+    """
+    Native DPI of pages first_page..last_page (1-based, inclusive).
+    """
+    if fitz is None:
+        logging.warning("Auto DPI needs PyMuPDF, rendering every page at the vector DPI.")
+        last_page = last_page or page_count(pdf_path)
+        return [vector_dpi] * (last_page - (first_page or 1) + 1)
+
+    known = _native_dpis.setdefault((file_key(pdf_path), vector_dpi), {})
+    pages = range(first_page or 1, (last_page or page_count(pdf_path)) + 1)
+    missing = [page_num for page_num in pages if page_num not in known]
+    if missing:
+        with fitz.open(pdf_path) as doc:
+            for page_num in missing:
+                known[page_num] = native_dpi(doc[page_num - 1], vector_dpi)
+    return [known[page_num] for page_num in pages]
+
+
+def render_pages(pdf_path, dpi, first_page=None, last_page=None, backend=None, grayscale=False):
+    """
+    Render pages first_page..last_page (1-based, inclusive) of a PDF to PIL images.
+    dpi is a number or "auto" / "auto:<vector DPI>" (see parse_dpi).
+    backend is a name from BACKENDS or "auto", None means DEFAULT_BACKEND.
+    With grayscale=True the images are single channel ("L").
+    """
+    if isinstance(dpi, str):
+        # Native resolution: pages next to each other with the same DPI are rendered together
+        dpi = parse_dpi(dpi)
+        vector_dpi = int(dpi.split(":")[1]) if ":" in dpi else VECTOR_DPI
+        first_page = first_page or 1
+        images = []
+        dpis = page_dpis(pdf_path, first_page, last_page, vector_dpi)
+        for run_dpi, run in itertools.groupby(enumerate(dpis, first_page), key=lambda page: page[1]):
+            run = [page_num for page_num, _ in run]
+            images += render_pages(pdf_path, run_dpi, run[0], run[-1], backend, grayscale)
+        return images
+
+    backend = backend or DEFAULT_BACKEND
+    if backend == "auto":
+        renderer = pick_backend(pdf_path, dpi)
+    else:
+        renderer = BACKENDS[backend]
+    with metrics.stage("render") as measurement:
+        images = renderer.render(pdf_path, dpi, first_page, last_page, grayscale)
+        measurement["pages"] = len(images)
+        measurement["bytes_out"] = sum(metrics.image_bytes(image) for image in images)
+    return images